@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import proc, reader, writer  # noqa: E402
+
+parser = argparse.ArgumentParser("Compare memory and time of shuffling and copying with lazy payloads.")
+parser.add_argument("-n", "--samples", type=int, default=2000)
+parser.add_argument("-s", "--size", type=int, default=100000, help="bytes per jpg field")
+parser.add_argument("-b", "--bufsize", type=int, default=1000)
+args = parser.parse_args()
+
+tmpdir = tempfile.mkdtemp()
+src = os.path.join(tmpdir, "src.tar")
+with writer.TarWriter(src) as sink:
+    for i in range(args.samples):
+        sink.write(dict(__key__=f"{i:06d}", jpg=os.urandom(args.size), cls=str(i % 10).encode()))
+
+for lazy in [False, True]:
+    dst = os.path.join(tmpdir, "dst.tar")
+    tracemalloc.start()
+    start = time.time()
+    with open(src, "rb") as stream, writer.TarWriter(dst) as sink:
+        for sample in proc.ishuffle(reader.tariterator(stream, lazy=lazy), args.bufsize, seed=0):
+            sink.write(sample)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"lazy={lazy!s:5s} {elapsed:6.2f} s  peak {peak / 1e6:8.1f} MB  {peak / args.bufsize:10.0f} bytes/buffered sample")
+    os.unlink(dst)
+os.unlink(src)
+os.rmdir(tmpdir)
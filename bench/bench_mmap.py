@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import gopen, reader, writer  # noqa: E402
+
+parser = argparse.ArgumentParser("Compare scanning a cached local shard through buffered reads and mmap.")
+parser.add_argument("-n", "--samples", type=int, default=2000)
+parser.add_argument("-s", "--size", type=int, default=100000, help="bytes per jpg field")
+parser.add_argument("-r", "--repeat", type=int, default=5, help="epochs over the shard")
+args = parser.parse_args()
+
+tmpdir = tempfile.mkdtemp()
+fname = os.path.join(tmpdir, "shard.tar")
+with writer.TarWriter(fname) as sink:
+    for i in range(args.samples):
+        sink.write(dict(__key__=f"{i:06d}", jpg=os.urandom(args.size), cls=str(i % 10).encode()))
+total = os.path.getsize(fname)
+
+configs = dict(
+    buffered=dict(mapped=False, copy=True),
+    buffered_nocopy=dict(mapped=False, copy=False),
+    mapped_copy=dict(mapped=True, copy=True),
+    mapped=dict(mapped=True, copy=False),
+)
+
+for name, config in configs.items():
+    start = time.time()
+    for _ in range(args.repeat):
+        with gopen.gopen(fname, "rb", mapped=config["mapped"]) as stream:
+            for sample in reader.tariterator(stream, copy=config["copy"]):
+                pass
+    elapsed = time.time() - start
+    print(f"{name:16s} {args.repeat * total / elapsed / 1e9:6.2f} GB/s {args.repeat * args.samples / elapsed:10.0f} samples/s")
+
+os.unlink(fname)
+os.rmdir(tmpdir)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import mpreader, reader, writer  # noqa: E402
+
+parser = argparse.ArgumentParser("Measure aggregate MB/s of the parallel shard reader against worker count.")
+parser.add_argument("-n", "--shards", type=int, default=16)
+parser.add_argument("-m", "--samples", type=int, default=5000, help="samples per shard")
+parser.add_argument("-s", "--size", type=int, default=10000, help="size of the jpg field")
+parser.add_argument("-z", "--compress", action="store_true", help="use gzip compressed shards")
+parser.add_argument("--workers", default="1 2 4 8")
+args = parser.parse_args()
+
+
+def make_shards(dir):
+    ext = "tgz" if args.compress else "tar"
+    urls = []
+    for i in range(args.shards):
+        fname = os.path.join(dir, f"shard-{i:04d}.{ext}")
+        with writer.TarWriter(fname) as sink:
+            for j in range(args.samples):
+                sink.write(dict(__key__="%08d" % j, jpg=os.urandom(args.size), cls=b"%d" % (j % 1000)))
+        urls.append(fname)
+    return urls
+
+
+def timed(source):
+    start = time.time()
+    total = 0
+    for sample in source:
+        total += len(sample["jpg"])
+    return total / 1e6 / (time.time() - start)
+
+
+with tempfile.TemporaryDirectory() as dir:
+    urls = make_shards(dir)
+    print(f"# {len(urls)} shards, {sum(os.path.getsize(u) for u in urls) / 1e6:.0f} MB")
+    rate = timed(sample for url in urls for sample in reader.TarIterator(url))
+    print(f"{'sequential':12s} {rate:10.1f} MB/s")
+    for workers in [int(w) for w in args.workers.split()]:
+        rate = timed(mpreader.ParallelReader(urls, workers=workers))
+        print(f"{workers:12d} {rate:10.1f} MB/s")
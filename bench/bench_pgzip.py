@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import gzip
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import pgzip  # noqa: E402
+
+parser = argparse.ArgumentParser("Measure parallel gzip throughput against thread count.")
+parser.add_argument("-s", "--size", type=float, default=200e6, help="bytes of test data")
+parser.add_argument("--threads", default="1 2 4 8 16")
+args = parser.parse_args()
+
+chunk = os.urandom(4096) + bytes(12288)
+data = chunk * int(args.size // len(chunk))
+mb = len(data) / 1e6
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return result, mb / (time.time() - start)
+
+
+compressed, rate = timed(lambda: gzip.compress(data))
+_, drate = timed(lambda: gzip.decompress(compressed))
+print(f"{'gzip':8s} {rate:10.1f} MB/s compress {drate:10.1f} MB/s decompress")
+
+for threads in [int(t) for t in args.threads.split()]:
+    def compress():
+        stream = io.BytesIO()
+        with pgzip.PGzipWriter(stream, threads=threads) as sink:
+            sink.write(data)
+        return stream.getvalue()
+    compressed, rate = timed(compress)
+    _, drate = timed(lambda: pgzip.PGzipReader(io.BytesIO(compressed), threads=threads).read())
+    print(f"{threads:8d} {rate:10.1f} MB/s compress {drate:10.1f} MB/s decompress")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import reader, writer  # noqa: E402
+
+parser = argparse.ArgumentParser("Compare samples/sec of the tar reader engines.")
+parser.add_argument("-n", "--samples", type=int, default=20000)
+parser.add_argument("-s", "--size", type=int, default=2000, help="size of the jpg field")
+parser.add_argument("-r", "--repeat", type=int, default=3)
+parser.add_argument("--engines", default="tarfile native native-nocopy")
+args = parser.parse_args()
+
+
+def make_shard(fname):
+    with writer.TarWriter(fname) as sink:
+        for i in range(args.samples):
+            sink.write(dict(__key__="%08d" % i, jpg=os.urandom(args.size), cls=b"%d" % (i % 1000), json=b"{}"))
+
+
+def run(fname, engine):
+    copy = not engine.endswith("-nocopy")
+    engine = engine.split("-")[0]
+    start = time.time()
+    count = 0
+    with open(fname, "rb") as stream:
+        for sample in reader.tariterator(stream, engine=engine, copy=copy):
+            count += 1
+    return count / (time.time() - start)
+
+
+with tempfile.TemporaryDirectory() as dir:
+    fname = os.path.join(dir, "bench.tar")
+    make_shard(fname)
+    print(f"# {args.samples} samples, {os.path.getsize(fname)} bytes")
+    for engine in args.engines.split():
+        rate = max(run(fname, engine) for _ in range(args.repeat))
+        print(f"{engine:16s} {rate:12.0f} samples/s")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import proc  # noqa: E402
+
+parser = argparse.ArgumentParser("Measure the per-sample overhead of shuffle stages.")
+parser.add_argument("-n", "--samples", type=int, default=2000000)
+parser.add_argument("-b", "--bufsize", type=int, default=10000)
+args = parser.parse_args()
+
+
+def list_shuffle(data, bufsize):
+    # the previous list/randint implementation, without the double next()
+    buf = []
+    for sample in data:
+        if len(buf) < bufsize:
+            buf.append(sample)
+            continue
+        k = random.randint(0, len(buf) - 1)
+        sample, buf[k] = buf[k], sample
+        yield sample
+    for sample in buf:
+        yield sample
+
+
+stages = dict(
+    baseline=lambda data: iter(data),
+    list_randint=lambda data: list_shuffle(data, args.bufsize),
+    ishuffle=lambda data: proc.ishuffle(data, args.bufsize, seed=0),
+    ishuffle_numpy=lambda data: proc.ishuffle(data, args.bufsize, rng=np.random.default_rng(0)),
+)
+
+data = range(args.samples)
+for name, stage in stages.items():
+    start = time.time()
+    for _ in stage(data):
+        pass
+    elapsed = time.time() - start
+    print(f"{name:16s} {1e9 * elapsed / args.samples:8.1f} ns/sample")
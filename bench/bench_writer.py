@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import writer  # noqa: E402
+
+parser = argparse.ArgumentParser("Compare samples/sec of the tar writer engines.")
+parser.add_argument("-n", "--samples", type=int, default=20000)
+parser.add_argument("-s", "--size", type=int, default=2000, help="size of the jpg field")
+parser.add_argument("-r", "--repeat", type=int, default=3)
+parser.add_argument("--engines", default="tarfile native")
+args = parser.parse_args()
+
+samples = [
+    dict(__key__="%08d" % i, jpg=os.urandom(args.size), cls=b"%d" % (i % 1000), json=b"{}")
+    for i in range(args.samples)
+]
+
+
+def run(fname, engine):
+    start = time.time()
+    with writer.TarWriter(fname, engine=engine) as sink:
+        for sample in samples:
+            sink.write(sample)
+    return len(samples) / (time.time() - start)
+
+
+with tempfile.TemporaryDirectory() as dir:
+    fname = os.path.join(dir, "bench.tar")
+    for engine in args.engines.split():
+        rate = max(run(fname, engine) for _ in range(args.repeat))
+        print(f"{engine:16s} {rate:12.0f} samples/s {os.path.getsize(fname):12d} bytes")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("verbose", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tarproclib import zcom  # noqa: E402
+
+parser = argparse.ArgumentParser("Measure ZMQ sample throughput with and without batching.")
+parser.add_argument("-n", "--samples", type=int, default=100000)
+parser.add_argument("-s", "--size", type=int, default=1000, help="payload bytes per sample")
+parser.add_argument("-b", "--batch", default="0,16,256")
+parser.add_argument("--port", type=int, default=15789)
+args = parser.parse_args()
+
+
+def run(url, batch):
+    receiver = zcom.Connection("zpull+" + url)
+    sender = zcom.Connection("zpush+" + url, batch=batch)
+    payload = b"x" * args.size
+
+    def send():
+        for i in range(args.samples):
+            sender.send({"__key__": str(i), "data": payload})
+        sender.flush()
+        sender.socket.send(zcom.msgpack.packb(dict(__EOF__=True)))
+
+    thread = threading.Thread(target=send)
+    start = time.time()
+    thread.start()
+    total = 0
+    for sample in receiver:
+        total += len(sample["data"])
+    elapsed = time.time() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return elapsed, total
+
+
+tmpdir = tempfile.mkdtemp()
+urls = dict(ipc="ipc://" + os.path.join(tmpdir, "socket"), tcp=f"tcp://127.0.0.1:{args.port}")
+for name, url in urls.items():
+    for batch in [int(b) for b in args.batch.split(",")]:
+        elapsed, total = run(url, batch)
+        print(f"{name} batch={batch:<5d} {args.samples / elapsed:10.0f} samples/s {total / elapsed / 1e6:8.1f} MB/s")
@@ -12,8 +12,8 @@ if sys.version_info < (3, 6):
     sys.exit("Python versions less than 3.6 are not supported")
 
 SCRIPTS = """
-tarcats tarproc tarshow tarsort tarsplit tarpcat
-lines2tar tar2json
+tarcats tarproc tarshow tarsort tarsplit tarpcat taridx tarshuffle
+lines2tar tar2json tarstats
 """.split()
 
 PREREQS = """
@@ -26,6 +26,11 @@ numpy
 pyyaml
 """.split()
 
+EXTRAS = dict(
+    zstd=["zstandard"],
+    lz4=["lz4"],
+)
+
 setuptools.setup(
     name='tarproc',
     version="0.0.11",
@@ -47,4 +52,5 @@ setuptools.setup(
     python_requires=">=3.6",
     scripts=SCRIPTS,
     install_requires=PREREQS,
+    extras_require=EXTRAS,
 )
@@ -0,0 +1,550 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Asyncio readers and writers for tar shards.
+
+These mirror `reader.TarIterator` and `writer.TarWriter` for use inside
+an event loop, without a thread per shard:
+
+    async for sample in aiotar.AsyncTarIterator("pipe:curl -s http://server/shard-{000..099}.tar"):
+        ...
+
+    async with aiotar.AsyncTarWriter("out.tgz") as sink:
+        await sink.write(sample)
+
+`pipe:` URLs run as asyncio subprocesses, pipes and stdin/stdout are read
+and written through the event loop, and regular files, which cannot be
+polled, are read and written on the loop's default executor. `z*` URLs
+use `zmq.asyncio` with the message format of `zcom`. Parsing, grouping
+and encoding are shared with the synchronous API (`ustar.TarParser`,
+`reader.SampleGrouper`, `ustar.TarEncoder`); decompression uses the
+incremental decompressors of the standard library, `zstandard`, and `lz4`.
+
+Reading only advances as samples are consumed, and writes wait for the
+pipe or socket to drain, so many shards can stream from one loop at a
+time with bounded memory.
+"""
+
+__all__ = "AsyncTarIterator AsyncTarWriter AsyncTarIterator1 AsyncTarWriter1 AsyncConnection".split()
+
+import asyncio
+import bz2
+import collections
+import io
+import lzma
+import math
+import os
+import random
+import stat
+import subprocess
+import sys
+import zlib
+from urllib.parse import urlparse
+
+import braceexpand as braceexpandlib
+
+from . import paths, reader, ustar, writer
+
+zmq_schemes = set("zpush zpull zpub zsub zrpush zrpull zrpub zrsub".split())
+
+
+def decompressor(head):
+    """Return a factory of incremental decompressors for a stream starting with `head`.
+
+    Returns None for uncompressed data.
+
+    :param head: first bytes of the stream
+    """
+    if head.startswith(b"\x1f\x8b"):
+        return lambda: zlib.decompressobj(31)
+    if head.startswith(b"BZh91"):
+        return bz2.BZ2Decompressor
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return lzma.LZMADecompressor
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj
+    if head.startswith(b"\x04\x22\x4d\x18"):
+        import lz4.frame
+        return lz4.frame.LZ4FrameDecompressor
+    return None
+
+
+class Decompressor(object):
+    """Decompress a stream of concatenated compressed members chunk by chunk.
+
+    :param factory: function returning a new decompressor object
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.current = None
+
+    def feed(self, data):
+        result = []
+        while len(data) > 0:
+            if self.current is None:
+                self.current = self.factory()
+            result.append(self.current.decompress(data))
+            if not self.current.eof:
+                break
+            # LZ4FrameDecompressor reports no unused data as None
+            data = self.current.unused_data or b""
+            self.current = None
+        return b"".join(result)
+
+
+def is_regular(fileobj):
+    return stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode)
+
+
+class AsyncSource(object):
+    """Binary input from a `gopen` URL ("-", "pipe:cmd", or a file).
+
+    :param url: input URL
+    :param chunksize: bytes per read (Default value = 1 MB)
+    """
+
+    def __init__(self, url, chunksize=1 << 20):
+        self.url = url
+        self.chunksize = chunksize
+        self.proc = None
+        self.stream = None
+        self.file = None
+        self.eof = False
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self.url.startswith("pipe:"):
+            self.proc = await asyncio.create_subprocess_shell(self.url[5:], stdout=subprocess.PIPE)
+            self.stream = self.proc.stdout
+            return
+        fileobj = sys.stdin.buffer if self.url == "-" else open(self.url, "rb")
+        if is_regular(fileobj):
+            self.file = fileobj
+            return
+        self.stream = asyncio.StreamReader(limit=self.chunksize)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.stream), fileobj)
+
+    async def read(self):
+        """Read the next chunk; returns b"" at EOF."""
+        if self.stream is not None:
+            data = await self.stream.read(self.chunksize)
+        else:
+            data = await asyncio.get_running_loop().run_in_executor(None, self.file.read, self.chunksize)
+        if not data:
+            self.eof = True
+        return data
+
+    async def close(self):
+        if self.file is not None and self.file is not sys.stdin.buffer:
+            self.file.close()
+        if self.proc is not None:
+            if not self.eof and self.proc.returncode is None:
+                self.proc.kill()
+            status = await self.proc.wait()
+            if self.eof and status != 0:
+                raise subprocess.CalledProcessError(status, self.url[5:])
+
+
+async def tar_members(source, select=None):
+    """Iterate over the members of a tar stream from an `AsyncSource`.
+
+    Yields the list of (name, data) pairs completed by each chunk read.
+
+    :param source: AsyncSource
+    :param select: function deciding from the member name whether to keep the payload (Default value = None, all)
+    """
+    parser = ustar.TarParser(select=select)
+    head = b""
+    decoder = None
+    while True:
+        data = await source.read()
+        if decoder is None:
+            head += data
+            if len(head) < ustar.BLOCKSIZE and data:
+                continue
+            factory = decompressor(head)
+            decoder = Decompressor(factory) if factory is not None else False
+            data, head = head, None
+        if decoder:
+            data = decoder.feed(data)
+        members = parser.feed(data)
+        if len(members) > 0:
+            yield members
+        if source.eof:
+            break
+    parser.close()
+
+
+class AsyncTarIterator1(object):
+    """Asynchronously iterate over the samples of tar shards.
+
+    With `interleave=N`, N shards are read concurrently and their samples
+    are yielded in the order they arrive, with at most `bufsize` samples
+    buffered in total. A "#start,end" suffix on the URL selects samples
+    by their position in the output.
+
+    :param url: source URL
+    :param braceexpand: expand braces in the source URL (Default value = True)
+    :param shuffle: shuffle the shards (Default value = False)
+    :param allow_missing: skip shards that cannot be opened (Default value = False)
+    :param interleave: number of shards read at the same time (Default value = 1)
+    :param bufsize: samples buffered when interleaving (Default value = 100)
+    :param chunksize: bytes per read (Default value = 1 MB)
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param suffixes: keep only these suffixes (Default value = None, all)
+    :param decoder: function applied to each sample (Default value = None)
+    :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+    :param fields: list of fields to read; other payloads are dropped unparsed (Default value = None, all)
+    """
+
+    def __init__(self, url, braceexpand=True, shuffle=False, allow_missing=False, interleave=1, bufsize=100,
+                 chunksize=1 << 20, keys=paths.base_plus_ext, suffixes=None, decoder=None,
+                 skip_meta=r"__[^/]*__($|/)", fields=None):
+        self.start = 0
+        self.end = math.inf
+        if len(url.rsplit("#", 1)) > 1:
+            url, fragment = url.rsplit("#", 1)
+            self.start, self.end = [int(x) for x in (fragment.rsplit(",") * 2)[:2]]
+            self.end += 1
+        if braceexpand:
+            self.urls = list(braceexpandlib.braceexpand(url))
+        else:
+            self.urls = [url]
+        if shuffle:
+            random.shuffle(self.urls)
+        self.allow_missing = allow_missing
+        self.interleave = max(1, interleave)
+        self.bufsize = bufsize
+        self.chunksize = chunksize
+        self.keys = keys
+        self.suffixes = suffixes
+        self.decoder = decoder
+        self.skip_meta = skip_meta
+        self.select = None
+        if fields is not None:
+            self.select, self.suffixes = reader.field_selector(fields, keys=keys)
+
+    async def shard_samples(self, url):
+        """Iterate over the samples of one shard.
+
+        :param url: shard URL
+        """
+        source = AsyncSource(url, self.chunksize)
+        try:
+            await source.open()
+        except OSError:
+            if self.allow_missing:
+                return
+            raise
+        grouper = reader.SampleGrouper(keys=self.keys, suffixes=self.suffixes)
+
+        def finished(sample):
+            if "__source__" not in sample:
+                sample["__source__"] = url
+            return sample if self.decoder is None else self.decoder(sample)
+
+        try:
+            async for members in tar_members(source, select=self.select):
+                for fname, value in reader.drop_meta(members, skip_meta=self.skip_meta):
+                    sample = grouper.add(fname, value)
+                    if sample is not None:
+                        yield finished(sample)
+            sample = grouper.finish()
+            if sample is not None:
+                yield finished(sample)
+        finally:
+            await source.close()
+
+    async def interleaved(self):
+        """Read `interleave` shards at a time into a bounded queue."""
+        samples = asyncio.Queue(self.bufsize)
+        urls = iter(self.urls)
+
+        async def work():
+            try:
+                for url in urls:
+                    async for sample in self.shard_samples(url):
+                        await samples.put(sample)
+            except Exception as exn:
+                await samples.put(exn)
+            await samples.put(None)
+
+        tasks = [asyncio.ensure_future(work()) for _ in range(self.interleave)]
+        running = len(tasks)
+        try:
+            while running > 0:
+                sample = await samples.get()
+                if sample is None:
+                    running -= 1
+                    continue
+                if isinstance(sample, Exception):
+                    raise sample
+                yield sample
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def samples(self):
+        if self.interleave == 1:
+            async def sequential():
+                for url in self.urls:
+                    async for sample in self.shard_samples(url):
+                        yield sample
+            samples = sequential()
+        else:
+            samples = self.interleaved()
+        count = 0
+        try:
+            async for sample in samples:
+                if count >= self.end:
+                    break
+                if count >= self.start:
+                    yield sample
+                count += 1
+        finally:
+            await samples.aclose()
+
+    def __aiter__(self):
+        return self.samples()
+
+
+class Collector(io.RawIOBase):
+    """Output stream that collects the written data in memory."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(data if isinstance(data, bytes) else bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts, self.size = [], 0
+        return data
+
+
+class AsyncTarWriter1(object):
+    """Asynchronously write samples to a tar file, pipe, or stdout.
+
+    Samples are encoded (and compressed) in memory and written out in
+    chunks of `chunksize` bytes; `write` waits while the output drains.
+    Use as `async with AsyncTarWriter1(url) as sink` or call `open` and
+    `close` explicitly.
+
+    :param url: output URL ("-", "pipe:cmd", or a file name)
+    :param keep_meta: keep fields starting with "_" (Default value = False)
+    :param user: user name for all members (Default value = "bigdata")
+    :param group: group name for all members (Default value = "bigdata")
+    :param mode: file mode for all members (Default value = 0o444)
+    :param compress: True/False for gzip, or "gz", "zst", "lz4" (Default value = None, by extension)
+    :param chunksize: bytes per write (Default value = 1 MB)
+    """
+
+    def __init__(self, url, keep_meta=False, user="bigdata", group="bigdata", mode=0o0444, compress=None,
+                 chunksize=1 << 20):
+        self.url = url
+        self.keep_meta = keep_meta
+        self.chunksize = chunksize
+        self.buffer = Collector()
+        self.zstream = None
+        codec = writer.compression_codec(url if url != "-" else None, compress)
+        stream = self.buffer
+        if codec is not None:
+            self.zstream = writer.open_compressor(stream, codec)
+            stream = self.zstream
+        self.tarstream = ustar.TarEncoder(stream, user=user, group=group, mode=mode)
+        self.proc = None
+        self.stream = None
+        self.file = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self.url.startswith("pipe:"):
+            self.proc = await asyncio.create_subprocess_shell(self.url[5:], stdin=subprocess.PIPE)
+            self.stream = self.proc.stdin
+            return self
+        fileobj = sys.stdout.buffer if self.url == "-" else open(self.url, "wb")
+        if fileobj is sys.stdout.buffer:
+            fileobj.flush()
+        if is_regular(fileobj):
+            self.file = fileobj
+            return self
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, fileobj)
+        self.stream = asyncio.StreamWriter(transport, protocol, None, loop)
+        return self
+
+    async def emit(self):
+        data = self.buffer.take()
+        if len(data) == 0:
+            return
+        if self.stream is not None:
+            self.stream.write(data)
+            await self.stream.drain()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.file.write, data)
+
+    async def write(self, obj):
+        """Write a dictionary to the tar file.
+
+        :param obj: dictionary of objects to be stored
+        :returns: size of the entry
+        """
+        key, members = writer.sample_members(obj, self.keep_meta)
+        total = self.tarstream.write(members)
+        if self.buffer.size >= self.chunksize:
+            await self.emit()
+        return total
+
+    async def close(self):
+        """Finish the tar file and close the output."""
+        self.tarstream.close()
+        if self.zstream is not None:
+            self.zstream.close()
+        await self.emit()
+        if self.file is not None:
+            if self.file is sys.stdout.buffer:
+                self.file.flush()
+            else:
+                self.file.close()
+        elif self.proc is not None:
+            self.stream.close()
+            status = await self.proc.wait()
+            if status != 0:
+                raise subprocess.CalledProcessError(status, self.url[5:])
+        else:
+            self.stream.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncConnection(object):
+    """Send or receive samples over ZMQ from an event loop.
+
+    The counterpart of `zcom.Connection`; messages (single or batched)
+    are compatible with it and with `zcom.MultiWriter`.
+
+    :param urls: ZMQ URL(s) with a "z*" scheme
+    :param noexpand: do not expand braces in URLs (Default value = False)
+    :param batch: maximum samples per message (Default value = 0, one message per sample)
+    :param batch_bytes: send a batch when its payloads reach this size (Default value = 1 MB)
+    :param batch_time: send a batch when its oldest sample is this many seconds old (Default value = 0.1)
+    """
+
+    def __init__(self, urls, noexpand=False, batch=0, batch_bytes=1 << 20, batch_time=0.1, **kw):
+        import zmq.asyncio
+        from . import zcom
+        self.zcom = zcom
+        self.context = zmq.asyncio.Context()
+        urls = zcom.urls2list(urls, noexpand=noexpand)
+        self.socket = zcom.zmq_make(self.context, urls[0])
+        zcom.zmq_connect(self.socket, urls)
+        self.batcher = zcom.Batcher(batch, batch_bytes, batch_time) if batch > 0 else None
+        self.received = collections.deque()
+        self.acks = {}
+
+    async def send(self, sample):
+        if not isinstance(sample, dict):
+            raise ValueError(f"{sample}: must be dict")
+        if self.batcher is None:
+            await self.socket.send(self.zcom.msgpack.packb(sample))
+        elif self.batcher.add(sample):
+            await self.flush()
+
+    async def write(self, sample):
+        await self.send(sample)
+
+    async def flush(self):
+        """Send any batched samples."""
+        if self.batcher is not None and len(self.batcher.samples) > 0:
+            await self.socket.send_multipart(self.zcom.pack_batch(self.batcher.take()), copy=False)
+
+    async def send_eof(self):
+        await self.flush()
+        await self.socket.send(self.zcom.msgpack.packb(dict(__EOF__=True)))
+
+    async def acknowledge(self, ping):
+        import zmq
+        url = ping["ack"]
+        if url not in self.acks:
+            self.acks[url] = self.context.socket(zmq.PUSH)
+            self.acks[url].setsockopt(zmq.LINGER, 1000)
+            self.acks[url].connect(url)
+        await self.acks[url].send(self.zcom.ack_message(ping))
+
+    async def recv(self):
+        """Receive the next sample."""
+        while len(self.received) == 0:
+            frames = await self.socket.recv_multipart(copy=False)
+            for sample in self.zcom.unpack_message(frames):
+                if "__PING__" in sample:
+                    await self.acknowledge(sample)
+                    if not sample.get("__EOF__", False):
+                        continue
+                self.received.append(sample)
+        return self.received.popleft()
+
+    async def samples(self):
+        while True:
+            sample = await self.recv()
+            if sample.get("__EOF__", False):
+                break
+            yield sample
+
+    def __aiter__(self):
+        return self.samples()
+
+    async def close(self, linger=-1):
+        await self.flush()
+        self.socket.close(linger=linger)
+        for ack in self.acks.values():
+            ack.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def is_zmq(url):
+    addr = urlparse(url if isinstance(url, str) else url[0])
+    return addr.scheme.split("+", 1)[0] in zmq_schemes
+
+
+def AsyncTarIterator(url, **kw):
+    """Open an asynchronous iterator over tar shards or a ZMQ stream.
+
+    :param url: source URL
+    :param **kw: arguments for `AsyncTarIterator1` or `AsyncConnection`
+    """
+    if is_zmq(url):
+        return AsyncConnection(url, **kw)
+    return AsyncTarIterator1(url, **kw)
+
+
+def AsyncTarWriter(url, **kw):
+    """Open an asynchronous writer for a tar file or a ZMQ stream.
+
+    :param url: output URL
+    :param **kw: arguments for `AsyncTarWriter1` or `AsyncConnection`
+    """
+    if is_zmq(url):
+        return AsyncConnection(url, **kw)
+    return AsyncTarWriter1(url, **kw)
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Long-lived worker processes for per-sample Python transformations.
+
+A coprocess reads samples from stdin and writes results to stdout.
+Every message is an 8 byte little-endian length followed by a msgpack
+payload. A request is a sample dict; a response is a pair
+`[status, value]`: `["ok", list_of_samples]` or `["error", traceback]`.
+
+A script only needs to define `process`:
+
+    def process(sample):
+        sample["x.txt"] = sample["txt"].upper()
+        return [sample]
+
+and is run as `python -m tarproclib.coproc script.py`. `process` may also
+return a single sample or None (no output).
+"""
+
+__all__ = "CoprocessError Coprocess Coprocesses serve".split()
+
+import os
+import runpy
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+
+import msgpack
+
+header = struct.Struct("<Q")
+
+
+class CoprocessError(Exception):
+    pass
+
+
+def write_message(stream, obj):
+    """Write a length-prefixed msgpack message.
+
+    :param stream: binary output stream
+    :param obj: object to pack
+    """
+    data = msgpack.packb(obj, use_bin_type=True)
+    stream.write(header.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def read_message(stream):
+    """Read a length-prefixed msgpack message; returns None at EOF.
+
+    :param stream: binary input stream
+    """
+    head = stream.read(header.size)
+    if len(head) == 0:
+        return None
+    if len(head) < header.size:
+        raise CoprocessError("truncated message header")
+    size = header.unpack(head)[0]
+    data = stream.read(size)
+    if len(data) < size:
+        raise CoprocessError("truncated message")
+    return msgpack.unpackb(data, raw=False)
+
+
+def as_samples(result):
+    """Normalize the return value of `process` to a list of samples."""
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        return [result]
+    return list(result)
+
+
+def serve(process, input=None, output=None):
+    """Answer requests from `input` with `process` until EOF.
+
+    :param process: function mapping a sample to a list of samples
+    :param input: binary input stream (Default value = stdin)
+    :param output: binary output stream (Default value = stdout)
+    """
+    input = input or sys.stdin.buffer
+    output = output or sys.stdout.buffer
+    # keep stray prints in the script from corrupting the protocol
+    sys.stdout = sys.stderr
+    while True:
+        sample = read_message(input)
+        if sample is None:
+            break
+        try:
+            write_message(output, ["ok", as_samples(process(sample))])
+        except Exception:
+            write_message(output, ["error", traceback.format_exc()])
+
+
+class Coprocess(object):
+    """A worker process running `process` from a script.
+
+    :param script: Python script defining `process(sample)`
+    :param python: interpreter (Default value = sys.executable)
+    """
+
+    def __init__(self, script, python=None):
+        env = dict(os.environ)
+        # make sure the worker can import this package
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join([root] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+        self.proc = subprocess.Popen(
+            [python or sys.executable, "-m", "tarproclib.coproc", os.path.abspath(script)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+
+    def __call__(self, sample):
+        """Process a sample; returns a list of samples.
+
+        :param sample: sample dict
+        """
+        write_message(self.proc.stdin, sample)
+        response = read_message(self.proc.stdout)
+        if response is None:
+            raise CoprocessError(f"coprocess exited with status {self.proc.wait()}")
+        status, value = response
+        if status != "ok":
+            raise CoprocessError(value)
+        return value
+
+    def close(self):
+        if self.proc.stdin is not None and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        status = self.proc.wait()
+        self.proc.stdout.close()
+        return status
+
+
+class Coprocesses(object):
+    """One coprocess per calling thread, started on first use.
+
+    :param script: Python script defining `process(sample)`
+    :param python: interpreter (Default value = sys.executable)
+    """
+
+    def __init__(self, script, python=None):
+        self.script = script
+        self.python = python
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.procs = []
+
+    def __call__(self, sample):
+        proc = getattr(self.local, "proc", None)
+        if proc is None:
+            proc = Coprocess(self.script, python=self.python)
+            self.local.proc = proc
+            with self.lock:
+                self.procs.append(proc)
+        return proc(sample)
+
+    def close(self):
+        with self.lock:
+            for proc in self.procs:
+                proc.close()
+            self.procs = []
+
+
+def main(argv):
+    if len(argv) != 2:
+        sys.exit("usage: python -m tarproclib.coproc script.py")
+    script = runpy.run_path(argv[1], run_name="__coproc__")
+    if "process" not in script:
+        sys.exit(f"{argv[1]}: does not define process(sample)")
+    serve(script["process"])
+
+
+if __name__ == "__main__":
+    main(sys.argv)
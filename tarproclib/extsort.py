@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""External merge sort for samples stored as raw tar bytes.
+
+Samples are appended to an in-memory run buffer. When the buffer exceeds
+`run_size` bytes, only the small `(sortkey, sequence, offset, length)`
+records are sorted and the raw bytes are spilled to a run file in that
+order. Iteration does a k-way heap merge over the run files, reading
+each run sequentially.
+"""
+
+__all__ = "ExternalSorter".split()
+
+import collections
+import heapq
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+def write_run(fname, buffer, records):
+    """Sort the records of a run and write their data to `fname`.
+
+    :param fname: run file name
+    :param buffer: raw sample bytes
+    :param records: list of (sortkey, sequence, offset, length)
+    :returns: list of (sortkey, sequence, length) in file order
+    """
+    records.sort(key=lambda r: (r[0], r[1]))
+    view = memoryview(buffer)
+    with open(fname, "wb") as stream:
+        for _, _, offset, length in records:
+            stream.write(view[offset:offset + length])
+    return [(sortkey, seq, length) for sortkey, seq, _, length in records]
+
+
+def read_run(fname, records, bufsize):
+    """Iterate over the samples of a run file.
+
+    :param fname: run file name
+    :param records: list of (sortkey, sequence, length) in file order
+    :param bufsize: read buffer size
+    """
+    with open(fname, "rb", buffering=bufsize) as stream:
+        for sortkey, seq, length in records:
+            yield sortkey, seq, stream.read(length)
+
+
+class ExternalSorter(object):
+    """Sort (sortkey, data) pairs using bounded memory.
+
+    With `workers > 0`, runs are sorted and written by background threads
+    while the next run is being collected; at most `workers` runs are
+    pending at a time, so peak memory is roughly `(workers + 1) * run_size`.
+
+    :param run_size: bytes of sample data per in-memory run (Default value = 1e9)
+    :param tempdir: directory for run files (Default value = system temp dir)
+    :param workers: background threads for run generation (Default value = 0)
+    :param duplicates: "keep", "replace" (keep last), or "error" for equal sort keys (Default value = "keep")
+    :param keep: don't delete run files (Default value = False)
+    :param bufsize: read buffer per run during the merge (Default value = 1 MB)
+    """
+
+    def __init__(self, run_size=1e9, tempdir=None, workers=0, duplicates="keep", keep=False, bufsize=1 << 20):
+        if duplicates not in ["keep", "replace", "error"]:
+            raise ValueError(f"{duplicates}: unknown duplicate handling")
+        self.run_size = run_size
+        self.dir = tempfile.mkdtemp(prefix="_extsort-", dir=tempdir)
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.workers = workers
+        self.pending = collections.deque()
+        self.duplicates = duplicates
+        self.keep = keep
+        self.bufsize = bufsize
+        self.runs = []
+        self.count = 0
+        self.buffer = bytearray()
+        self.records = []
+
+    def add(self, sortkey, data):
+        """Add a sample.
+
+        :param sortkey: sort key; all keys must be mutually comparable
+        :param data: raw sample bytes
+        """
+        self.records.append((sortkey, self.count, len(self.buffer), len(data)))
+        self.buffer += data
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        """Write the current run to disk."""
+        if len(self.records) == 0:
+            return
+        fname = os.path.join(self.dir, "run-%06d" % len(self.runs))
+        if self.pool is not None:
+            # wait for the oldest run so that unwritten runs don't pile up in memory
+            while len(self.pending) >= self.workers:
+                self.pending.popleft().result()
+            result = self.pool.submit(write_run, fname, self.buffer, self.records)
+            self.pending.append(result)
+        else:
+            result = write_run(fname, self.buffer, self.records)
+        self.runs.append((fname, result))
+        self.buffer = bytearray()
+        self.records = []
+
+    def __iter__(self):
+        """Iterate over (sortkey, data) in sorted order."""
+        if len(self.runs) == 0:
+            # everything fits in memory
+            self.records.sort(key=lambda r: (r[0], r[1]))
+            view = memoryview(self.buffer)
+            merged = ((k, s, view[o:o + n]) for k, s, o, n in self.records)
+        else:
+            self.spill()
+            sources = []
+            for fname, records in self.runs:
+                if self.pool is not None:
+                    records = records.result()
+                sources.append(read_run(fname, records, self.bufsize))
+            merged = heapq.merge(*sources, key=lambda r: (r[0], r[1]))
+        previous = None
+        for sortkey, seq, data in merged:
+            if self.duplicates != "keep" and previous is not None:
+                if previous[0] == sortkey:
+                    if self.duplicates == "error":
+                        raise ValueError(f"{sortkey}: duplicate sort key")
+                    previous = (sortkey, data)
+                    continue
+            if previous is not None:
+                yield previous
+            previous = (sortkey, data)
+        if previous is not None:
+            yield previous
+
+    def close(self):
+        """Remove temporary files."""
+        if self.pool is not None:
+            self.pool.shutdown()
+        if not self.keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,14 +5,24 @@
 # See the LICENSE file for licensing terms (BSD-style).
 #
 
+import fcntl
+import hashlib
 import io
+import os
+import re
 import subprocess
 import sys
+import tempfile
+import time
 
 bufsize = 8192
 
 processes = []
 
+cache_dir = os.environ.get("GOPEN_CACHE")
+cache_size = int(float(os.environ.get("GOPEN_CACHE_SIZE", 1e11)))
+cache_stats = dict(hits=0, misses=0, bytes_saved=0, bytes_cached=0, discarded=0, evicted=0)
+
 
 def maybe_wait(proc):
     status = proc.poll()
@@ -52,12 +62,192 @@ def open_pipe(cmd, mode):
     proc = subprocess.Popen(cmd, shell=True, **kw)
     proc.gopen_command = cmd
     stream = proc.stdout if mode[0] == "r" else proc.stdin
+    stream.gopen_process = proc
+    if "b" not in mode:
+        stream = io.TextIOWrapper(stream)
+    return stream
+
+
+def cache_path(url, cache):
+    """Return the cache file for `url`: a hash of the URL plus its last path component.
+
+    :param url: url being cached
+    :param cache: cache directory
+    """
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    tail = re.sub(r"[^A-Za-z0-9._-]+", "_", url.rsplit("/", 1)[-1])[-64:]
+    return os.path.join(cache, f"{digest}-{tail}")
+
+
+def evict(cache, max_size, stale=3600.0):
+    """Delete the least recently used cache files until the cache fits in `max_size`.
+
+    Files are ordered by mtime, which is updated on every cache hit.
+    Eviction holds an exclusive `flock` on the cache's ".lock" file, so
+    processes sharing the cache do not evict concurrently. Readers that
+    still have an evicted file open keep reading it. Temporary files are
+    only removed once they are `stale` seconds old (left by a crashed writer).
+
+    :param cache: cache directory
+    :param max_size: maximum total size in bytes
+    :param stale: age in seconds after which temporary files are removed (Default value = 3600.0)
+    """
+    with open(os.path.join(cache, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        now = time.time()
+        entries = []
+        for entry in os.scandir(cache):
+            try:
+                stat = entry.stat()
+                if entry.name.startswith(".tmp-") and now - stat.st_mtime > stale:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            if not entry.name.startswith("."):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.unlink(path)
+                cache_stats["evicted"] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class CachingReader(io.RawIOBase):
+    """Read a stream while copying it into a cache file.
+
+    The copy goes to a temporary file in the cache directory and is
+    renamed into place only when the stream has been read to the end and
+    its `pipe:` process exited successfully. Tar readers stop at the
+    end-of-archive blocks, so on `close` up to `tail` more bytes are read
+    to reach the end of the stream; streams that are closed earlier than
+    that, fail, or exceed `max_size` leave nothing behind. Errors writing
+    the copy (e.g., a full disk) only disable caching for this stream.
+
+    :param stream: binary input stream
+    :param path: cache file
+    :param max_size: maximum size of the cache (Default value = cache_size)
+    :param tail: bytes read on close to reach the end of the stream (Default value = 1 << 20)
+    """
+
+    def __init__(self, stream, path, max_size=None, tail=1 << 20):
+        self.stream = stream
+        self.path = path
+        self.max_size = max_size if max_size is not None else cache_size
+        self.tail = tail
+        self.proc = getattr(stream, "gopen_process", None)
+        fd, self.tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        self.out = os.fdopen(fd, "wb", buffering=1 << 20)
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        read = getattr(self.stream, "readinto1", self.stream.readinto)
+        n = read(b)
+        if self.out is not None:
+            if n:
+                try:
+                    self.out.write(memoryview(b)[:n])
+                    self.size += n
+                except OSError:
+                    self.discard()
+            else:
+                self.commit()
+        return n
+
+    def commit(self):
+        """Move the completed copy into the cache and evict old entries."""
+        try:
+            self.out.close()
+        except OSError:
+            self.out = None
+            self.discard()
+            return
+        self.out = None
+        status = self.proc.wait() if self.proc is not None else 0
+        if status != 0 or self.size > self.max_size:
+            self.discard()
+            return
+        os.replace(self.tmp, self.path)
+        cache_stats["bytes_cached"] += self.size
+        evict(os.path.dirname(self.path), self.max_size)
+
+    def discard(self):
+        """Drop the partial copy."""
+        if self.out is not None:
+            try:
+                self.out.close()
+            except OSError:
+                pass
+            self.out = None
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+        cache_stats["discarded"] += 1
+
+    def close(self):
+        if not self.closed:
+            buf = bytearray(min(self.tail, 1 << 16))
+            remaining = self.tail
+            try:
+                while self.out is not None and remaining > 0:
+                    n = self.readinto(buf)
+                    remaining -= n
+                    if n == 0:
+                        break
+            except OSError:
+                pass
+            if self.out is not None:
+                self.discard()
+            self.stream.close()
+        super().close()
+
+
+def open_cached(url, mode, cache, mapped=False):
+    """Open a `pipe:` URL for reading through the cache directory `cache`.
+
+    On a hit, the cached copy is opened and its mtime is updated for LRU
+    eviction; on a miss, the command is run and its output is copied into
+    the cache as it is read (see `CachingReader`).
+
+    :param url: "pipe:" url
+    :param mode: "r" or "rb"
+    :param cache: cache directory
+    :param mapped: memory map cache hits opened with "rb" (Default value = False)
+    """
+    path = cache_path(url, cache)
+    try:
+        if mapped and mode == "rb":
+            from . import ustar
+            stream = ustar.MappedFile(path)
+        else:
+            stream = open(path, mode)
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        cache_stats["hits"] += 1
+        cache_stats["bytes_saved"] += os.fstat(stream.fileno()).st_size
+        return stream
+    cache_stats["misses"] += 1
+    os.makedirs(cache, exist_ok=True)
+    stream = io.BufferedReader(CachingReader(open_pipe(url[5:], "rb"), path), 1 << 16)
     if "b" not in mode:
         stream = io.TextIOWrapper(stream)
     return stream
 
 
-def gopen(url, mode="rb", collect=True):
+def gopen(url, mode="rb", collect=True, threads=0, mapped=False, cache=None):
     """Open an I/O stream. This understands:
 
     "-": stdin/stdout
@@ -68,18 +258,50 @@ def gopen(url, mode="rb", collect=True):
     and may give an exception unrelated to the current `gopen`. Call `collect_processes`
     explicitly to avoid this.
 
+    With `threads > 0`, URLs ending in "gz" are transparently decompressed
+    or compressed using `threads` threads (see `pgzip`).
+
+    With `mapped=True`, local files opened with "rb" are memory mapped
+    (see `ustar.MappedFile`).
+
+    With a `cache` directory (by default `cache_dir`, from $GOPEN_CACHE),
+    "pipe:" URLs opened for reading are copied to local disk the first
+    time they are read in full and read from there afterwards. The cache
+    is kept below `cache_size` bytes ($GOPEN_CACHE_SIZE) by evicting the
+    least recently used shards and can be shared by several processes;
+    hits, misses, and bytes saved are counted in `cache_stats`.
+
     :param url: url to be opened
     :param mode: one of "r", "w", "rb", or "wb"
+    :param threads: threads for parallel gzip (Default value = 0)
+    :param mapped: memory map local files for reading (Default value = False)
+    :param cache: cache directory for "pipe:" URLs (Default value = None, use `cache_dir`)
     """
 
     assert mode in ["r", "w", "rb", "wb"]
 
     if url == "-":
-        return open_std(mode)
-
-    if url.startswith("pipe:"):
+        stream = open_std(mode)
+    elif url.startswith("pipe:"):
         if collect:
             collect_processes()
-        return open_pipe(url[5:], mode)
+        cache = cache if cache is not None else cache_dir
+        if cache and mode[0] == "r":
+            stream = open_cached(url, mode, cache, mapped=mapped)
+        else:
+            stream = open_pipe(url[5:], mode)
+    elif mapped and mode == "rb":
+        from . import ustar
+        stream = ustar.MappedFile(url)
+    else:
+        stream = open(url, mode)
 
-    return open(url, mode)
+    if threads > 0 and url.endswith("gz"):
+        if "b" not in mode:
+            raise ValueError("parallel gzip requires a binary mode")
+        from . import pgzip
+        if mode[0] == "r":
+            stream = io.BufferedReader(pgzip.PGzipReader(stream, threads=threads, close_stream=True))
+        else:
+            stream = io.BufferedWriter(pgzip.PGzipWriter(stream, threads=threads, close_stream=True))
+    return stream
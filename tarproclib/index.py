@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Sidecar index files (.idx) for uncompressed tar shards.
+
+An index is a text file with one line per sample:
+
+    key <TAB> offset <TAB> length <TAB> ext=size,ext=size,...
+
+`offset` and `length` give the byte span of the sample in the shard,
+including all of its tar headers, so a sample can be fetched with
+a single `pread`. The first line is a comment naming the shard and,
+for shards written with one zstd frame per sample, the codec; offsets
+then refer to the compressed frames.
+"""
+
+__all__ = "IndexEntry IndexWriter IndexedShard read_index scan_samples build_index find_index".split()
+
+import io
+import os
+from collections import namedtuple
+
+from . import paths, ustar
+
+magic = "#tarproc-index 1"
+
+IndexEntry = namedtuple("IndexEntry", "key offset length sizes")
+
+
+def index_name(fname):
+    """Return the name of the sidecar index for a shard.
+
+    :param fname: shard file name
+    """
+    return fname + ".idx"
+
+
+def find_index(url):
+    """Return the index file for a URL if it is a local file with an index.
+
+    :param url: shard URL
+    :returns: index file name or None
+    """
+    if url == "-" or url.startswith("pipe:") or ":" in url.split("/", 1)[0]:
+        return None
+    fname = index_name(url)
+    if not os.path.exists(fname):
+        return None
+    return fname
+
+
+class IndexWriter(object):
+    """Write index entries to a stream or file.
+
+    :param output: file name or text stream
+    :param shard: name of the shard being indexed (Default value = "")
+    :param codec: "zst" if every sample is a separate zstd frame (Default value = "")
+    """
+
+    def __init__(self, output, shard="", codec=""):
+        if isinstance(output, str):
+            output = open(output, "w")
+        self.stream = output
+        self.stream.write(f"{magic}\t{shard}\t{codec}\n")
+
+    def add(self, key, offset, length, sizes):
+        """Add an entry.
+
+        :param key: sample key
+        :param offset: byte offset of the sample in the shard
+        :param length: byte length of the sample including headers
+        :param sizes: list of (extension, size) pairs
+        """
+        fields = ",".join(f"{ext}={size}" for ext, size in sizes)
+        self.stream.write(f"{key}\t{offset}\t{length}\t{fields}\n")
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_index(fname):
+    """Read an index file.
+
+    :param fname: index file name
+    :returns: dict with shard name and codec, list of IndexEntry
+    """
+    entries = []
+    with open(fname) as stream:
+        header = stream.readline().rstrip("\n").split("\t")
+        if header[0] != magic:
+            raise ValueError(f"{fname}: not a tarproc index")
+        header += [""] * (3 - len(header))
+        info = dict(shard=header[1], codec=header[2])
+        for line in stream:
+            key, offset, length, fields = line.rstrip("\n").split("\t")
+            sizes = {}
+            for field in fields.split(","):
+                if field != "":
+                    ext, size = field.rsplit("=", 1)
+                    sizes[ext] = int(size)
+            entries.append(IndexEntry(key, int(offset), int(length), sizes))
+    return info, entries
+
+
+def scan_samples(stream, keys=paths.base_plus_ext, head=b""):
+    """Iterate over the sample spans of an uncompressed tar stream.
+
+    Members are grouped into samples the same way as `reader.group_by_keys`.
+    Only headers are parsed; payloads are skipped without being read
+    (with `seek` on plain files).
+
+    :param stream: uncompressed binary tar stream
+    :param keys: function splitting names into key and extension (Default value = base_plus_ext)
+    :param head: bytes already consumed from the stream (Default value = b"")
+    :returns: iterator of IndexEntry with sizes as a list of (ext, size)
+    """
+    scanner = ustar.TarScanner(stream, head=head, select=lambda name: False)
+    current = None
+    start = end = 0
+    sizes = []
+    for fname, _ in scanner:
+        prefix, suffix = keys(fname)
+        if prefix is None:
+            continue
+        if prefix != current:
+            if current is not None:
+                yield IndexEntry(current, start, end - start, sizes)
+            current = prefix
+            start = scanner.start
+            sizes = []
+        sizes.append((suffix, scanner.size))
+        end = scanner.offset
+    if current is not None:
+        yield IndexEntry(current, start, end - start, sizes)
+
+
+def build_index(fname, output=None, keys=paths.base_plus_ext):
+    """Build the index for an uncompressed local shard.
+
+    :param fname: shard file name
+    :param output: index file name (Default value = fname + ".idx")
+    :param keys: function splitting names into key and extension (Default value = base_plus_ext)
+    :returns: number of samples indexed
+    """
+    output = output or index_name(fname)
+    count = 0
+    with open(fname, "rb") as stream:
+        stream, head = ustar.open_decompressed(stream)
+        if head == b"":
+            raise ValueError(f"{fname}: cannot index compressed shards")
+        with IndexWriter(output + ".temp", shard=os.path.basename(fname)) as sink:
+            for entry in scan_samples(stream, keys=keys, head=head):
+                sink.add(*entry)
+                count += 1
+    os.rename(output + ".temp", output)
+    return count
+
+
+class IndexedShard(object):
+    """Random access to the samples of an indexed shard.
+
+    Each sample is fetched with a single `os.pread`; for shards written
+    with one zstd frame per sample, the frame is then decompressed.
+
+    :param fname: shard file name
+    :param index: index file name (Default value = fname + ".idx")
+    """
+
+    def __init__(self, fname, index=None):
+        self.fname = fname
+        self.info, self.entries = read_index(index or index_name(fname))
+        self.positions = {entry.key: i for i, entry in enumerate(self.entries)}
+        self.fd = os.open(fname, os.O_RDONLY)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        """Return the sample keys in shard order."""
+        return [entry.key for entry in self.entries]
+
+    def read(self, entry):
+        """Read and decode the sample for an index entry.
+
+        :param entry: IndexEntry
+        """
+        data = os.pread(self.fd, entry.length, entry.offset)
+        if len(data) < entry.length:
+            raise ustar.ReadError(f"{self.fname}: short read at {entry.offset}")
+        if self.info["codec"] == "zst":
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        sample = dict(__key__=entry.key)
+        for fname, value in ustar.TarScanner(io.BytesIO(data)):
+            prefix, suffix = paths.base_plus_ext(fname)
+            if prefix is not None:
+                sample[suffix] = value
+        sample["__source__"] = self.fname
+        return sample
+
+    def __getitem__(self, i):
+        """Return the sample at position `i`.
+
+        :param i: sample ordinal
+        """
+        return self.read(self.entries[i])
+
+    def get(self, key, default=None):
+        """Return the sample with the given key.
+
+        :param key: sample key
+        :param default: value if the key is not present (Default value = None)
+        """
+        i = self.positions.get(key)
+        if i is None:
+            return default
+        return self.read(self.entries[i])
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield self.read(entry)
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Background threads for stream I/O.
+
+`ReadAhead` reads large chunks from a stream on a background thread and
+`WriteBehind` writes them on one, with a bounded queue of chunks in
+between. Disk and pipe latency (and decompression or compression, when
+the wrapped stream does it) then overlap with sample processing in the
+calling thread.
+
+Both classes accumulate the time each side spent blocked in a `stats`
+dictionary: "producer_wait" is time the producing side waited for space
+in the queue, "consumer_wait" time the consuming side waited for data.
+For `ReadAhead`, a large "consumer_wait" means the input is the
+bottleneck; for `WriteBehind`, a large "producer_wait" means the output is.
+"""
+
+__all__ = "ReadAhead WriteBehind".split()
+
+import io
+import queue
+import threading
+import time
+
+
+def new_stats(stats):
+    stats = stats if stats is not None else {}
+    stats.setdefault("producer_wait", 0.0)
+    stats.setdefault("consumer_wait", 0.0)
+    stats.setdefault("chunks", 0)
+    stats.setdefault("bytes", 0)
+    return stats
+
+
+def timed_put(q, item, stats, key, stopped=lambda: False):
+    """Put an item on a queue, adding any time spent blocked to `stats[key]`."""
+    try:
+        q.put_nowait(item)
+        return
+    except queue.Full:
+        pass
+    start = time.time()
+    try:
+        while not stopped():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    finally:
+        stats[key] += time.time() - start
+
+
+def timed_get(q, stats, key):
+    """Get an item from a queue, adding any time spent blocked to `stats[key]`."""
+    try:
+        return q.get_nowait()
+    except queue.Empty:
+        pass
+    start = time.time()
+    item = q.get()
+    stats[key] += time.time() - start
+    return item
+
+
+class ReadAhead(io.RawIOBase):
+    """Read a stream ahead of the consumer on a background thread.
+
+    :param stream: binary input stream
+    :param depth: number of chunks to buffer (Default value = 4)
+    :param chunksize: bytes per read (Default value = 4 MB)
+    :param close_stream: close `stream` on close (Default value = False)
+    :param stats: dictionary accumulating counters (Default value = None)
+    """
+
+    def __init__(self, stream, depth=4, chunksize=4 << 20, close_stream=False, stats=None):
+        self.stream = stream
+        self.chunksize = chunksize
+        self.close_stream = close_stream
+        self.stats = new_stats(stats)
+        self.queue = queue.Queue(depth)
+        self.stopped = False
+        self.eof = False
+        self.current = memoryview(b"")
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped:
+                data = self.stream.read(self.chunksize)
+                timed_put(self.queue, data, self.stats, "producer_wait", lambda: self.stopped)
+                if not data:
+                    break
+        except Exception as exn:
+            timed_put(self.queue, exn, self.stats, "producer_wait", lambda: self.stopped)
+
+    def readable(self):
+        return True
+
+    def fill(self):
+        """Make sure there is buffered data; returns False at EOF."""
+        while len(self.current) == 0:
+            if self.eof:
+                return False
+            item = timed_get(self.queue, self.stats, "consumer_wait")
+            if isinstance(item, Exception):
+                self.eof = True
+                raise item
+            if not item:
+                self.eof = True
+                return False
+            self.stats["chunks"] += 1
+            self.stats["bytes"] += len(item)
+            self.current = memoryview(item)
+        return True
+
+    def readinto(self, buf):
+        if not self.fill():
+            return 0
+        n = min(len(buf), len(self.current))
+        buf[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        if not self.fill():
+            return b""
+        data = self.current[:size].tobytes()
+        self.current = self.current[len(data):]
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        self.stopped = True
+        # unblock the reader thread if it is waiting for queue space
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self.close_stream:
+            self.stream.close()
+        super().close()
+
+
+class WriteBehind(io.RawIOBase):
+    """Write to a stream on a background thread.
+
+    Writes are collected into chunks of `chunksize` bytes, which are
+    queued for the writer thread. Errors in the writer thread are raised
+    by the next `write`, `flush`, or `close`.
+
+    :param stream: binary output stream
+    :param depth: number of chunks to buffer (Default value = 4)
+    :param chunksize: bytes per write (Default value = 4 MB)
+    :param close_stream: close `stream` on close (Default value = False)
+    :param stats: dictionary accumulating counters (Default value = None)
+    """
+
+    def __init__(self, stream, depth=4, chunksize=4 << 20, close_stream=False, stats=None):
+        self.stream = stream
+        self.chunksize = chunksize
+        self.close_stream = close_stream
+        self.stats = new_stats(stats)
+        self.queue = queue.Queue(depth)
+        self.buffer = bytearray()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = timed_get(self.queue, self.stats, "consumer_wait")
+            if item is None:
+                return
+            try:
+                if isinstance(item, threading.Event):
+                    if self.error is None:
+                        self.stream.flush()
+                elif self.error is None:
+                    self.stream.write(item)
+                    self.stats["chunks"] += 1
+                    self.stats["bytes"] += len(item)
+            except Exception as exn:
+                self.error = exn
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def submit(self):
+        if len(self.buffer) > 0:
+            data, self.buffer = self.buffer, bytearray()
+            timed_put(self.queue, data, self.stats, "producer_wait")
+
+    def write(self, data):
+        self.check()
+        self.buffer += data
+        if len(self.buffer) >= self.chunksize:
+            self.submit()
+        return len(data)
+
+    def flush(self):
+        """Write all buffered data and flush the underlying stream."""
+        if self.closed or not self.thread.is_alive():
+            return
+        self.submit()
+        done = threading.Event()
+        timed_put(self.queue, done, self.stats, "producer_wait")
+        done.wait()
+        self.check()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            if self.close_stream:
+                self.stream.close()
+            super().close()
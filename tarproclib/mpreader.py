@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Read many shards in parallel using worker processes.
+
+Each worker pulls shard URLs from a shared queue until it is empty, so
+fast workers take over the remaining shards from slow ones. Samples are
+sent back as raw tar bytes, batched into the slots of a shared memory
+ring buffer; only small control messages (slot number, size, URL) go
+through the queues. The consumer copies a batch out of its slot, returns
+the slot to the workers, and parses the samples.
+"""
+
+__all__ = "ParallelReader".split()
+
+import io
+import multiprocessing as mp
+import queue
+import sys
+import time
+import traceback
+
+from . import gopen, reader, ustar
+
+
+def get_slot(free, stop):
+    """Wait for a free slot; returns None if the reader was stopped."""
+    while not stop.is_set():
+        try:
+            return free.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def worker(wid, files, free, full, buffer, slotsize, stop, threads):
+    """Worker process: read shards and send their samples in batches.
+
+    :param wid: worker number
+    :param files: queue of shard URLs, terminated by None
+    :param free: queue of free slot numbers
+    :param full: queue of messages to the consumer
+    :param buffer: shared memory for all slots
+    :param slotsize: bytes per slot
+    :param stop: event signalling shutdown
+    :param threads: threads for gzip decompression
+    """
+    view = memoryview(buffer).cast("B")
+
+    def send(url, batch, size):
+        if size > slotsize:
+            # a single sample larger than a slot
+            full.put(("data", url, b"".join(batch)))
+            return True
+        slot = get_slot(free, stop)
+        if slot is None:
+            return False
+        offset = slot * slotsize
+        for data in batch:
+            view[offset:offset + len(data)] = data
+            offset += len(data)
+        full.put(("slot", url, (slot, size)))
+        return True
+
+    for url in iter(files.get, None):
+        try:
+            with gopen.gopen(url, "rb") as stream:
+                batch, size = [], 0
+                for _, data in reader.raw_samples(stream, threads=threads):
+                    if stop.is_set():
+                        return
+                    if size + len(data) > slotsize and len(batch) > 0:
+                        if not send(url, batch, size):
+                            return
+                        batch, size = [], 0
+                    batch.append(data)
+                    size += len(data)
+                if len(batch) > 0 and not send(url, batch, size):
+                    return
+            full.put(("done", url, wid))
+        except Exception:
+            full.put(("error", url, traceback.format_exc()))
+    full.put(("exit", None, wid))
+
+
+class ParallelReader(object):
+    """Iterate over the samples of many shards using worker processes.
+
+    Samples are returned in no particular order. Counters are kept in
+    `stats`: "shards", "samples", "bytes", and "errors".
+
+    :param urls: list of shard URLs
+    :param workers: number of worker processes (Default value = 8)
+    :param slots: number of shared memory slots (Default value = 4 * workers)
+    :param slotsize: bytes per slot (Default value = 4 MB)
+    :param threads: threads for gzip decompression in each worker (Default value = 0)
+    :param allow_missing: report shards that fail to read instead of raising (Default value = False)
+    :param **kw: arguments for `reader.tariterator`
+    """
+
+    def __init__(self, urls, workers=8, slots=None, slotsize=4 << 20, threads=0, allow_missing=False, **kw):
+        self.urls = list(urls)
+        self.workers = workers
+        self.slots = slots or 4 * workers
+        self.slotsize = slotsize
+        self.threads = threads
+        self.allow_missing = allow_missing
+        self.kw = kw
+        self.jobs = []
+        self.stats = dict(shards=0, samples=0, bytes=0, errors=0)
+
+    def start(self):
+        self.files = mp.Queue()
+        self.free = mp.Queue()
+        self.full = mp.Queue()
+        self.stop = mp.Event()
+        self.buffer = mp.RawArray("B", self.slots * self.slotsize)
+        for url in self.urls:
+            self.files.put(url)
+        for i in range(self.workers):
+            self.files.put(None)
+        for slot in range(self.slots):
+            self.free.put(slot)
+        args = (self.files, self.free, self.full, self.buffer, self.slotsize, self.stop, self.threads)
+        self.jobs = [mp.Process(target=worker, args=(i,) + args, daemon=True) for i in range(self.workers)]
+        for job in self.jobs:
+            job.start()
+
+    def samples(self, url, data):
+        self.stats["bytes"] += len(data)
+        for sample in reader.tariterator(io.BytesIO(data), **self.kw):
+            if "__source__" not in sample:
+                sample["__source__"] = url
+            self.stats["samples"] += 1
+            yield sample
+
+    def receive(self):
+        """Return the next message, checking that the workers are alive."""
+        while True:
+            try:
+                return self.full.get(timeout=1.0)
+            except queue.Empty:
+                pass
+            for job in self.jobs:
+                if not job.is_alive() and job.exitcode != 0:
+                    raise ustar.ReadError(f"worker exited with status {job.exitcode}")
+
+    def __iter__(self):
+        self.start()
+        view = memoryview(self.buffer).cast("B")
+        exited = 0
+        try:
+            while exited < self.workers:
+                kind, url, value = self.receive()
+                if kind == "slot":
+                    slot, size = value
+                    offset = slot * self.slotsize
+                    data = bytes(view[offset:offset + size])
+                    self.free.put(slot)
+                    yield from self.samples(url, data)
+                elif kind == "data":
+                    yield from self.samples(url, value)
+                elif kind == "done":
+                    self.stats["shards"] += 1
+                elif kind == "error":
+                    self.stats["errors"] += 1
+                    if not self.allow_missing:
+                        raise ustar.ReadError(f"{url}: {value}")
+                    print(f"# error reading {url}\n{value}", file=sys.stderr)
+                elif kind == "exit":
+                    exited += 1
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the workers."""
+        if len(self.jobs) == 0:
+            return
+        self.stop.set()
+        # keep draining messages so that workers can flush their queues and exit
+        deadline = time.time() + 5.0
+        while any(job.is_alive() for job in self.jobs) and time.time() < deadline:
+            try:
+                self.full.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        for job in self.jobs:
+            if job.is_alive():
+                job.terminate()
+            job.join()
+        for q in [self.files, self.free, self.full]:
+            q.cancel_join_thread()
+            q.close()
+        self.jobs = []
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Bounded parallel execution of per-sample work.
+
+Work that mostly waits on subprocesses or I/O runs on threads, so samples
+are handed to workers by reference instead of being pickled, and at most
+`inflight` samples are held in memory at any time.
+"""
+
+__all__ = "WorkerDirs imap default_tmpdir".split()
+
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def default_tmpdir():
+    """Return a memory-backed temporary directory if there is one."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class WorkerDirs(object):
+    """One reusable working directory per worker thread.
+
+    :param root: directory to create the worker directories in (Default value = new temporary directory)
+    :param keep: don't remove the directories on close (Default value = False)
+    """
+
+    def __init__(self, root=None, keep=False):
+        if root is None:
+            root = tempfile.mkdtemp(prefix="_tarproc-", dir=default_tmpdir())
+        else:
+            os.mkdir(root)
+        self.root = root
+        self.keep = keep
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def get(self):
+        """Return the empty working directory of the calling thread."""
+        dirname = getattr(self.local, "dirname", None)
+        if dirname is None:
+            with self.lock:
+                dirname = os.path.join(self.root, "w%03d" % self.count)
+                self.count += 1
+            os.mkdir(dirname)
+            self.local.dirname = dirname
+        else:
+            self.clean(dirname)
+        return dirname
+
+    def clean(self, dirname):
+        """Remove the contents of a directory.
+
+        :param dirname: directory
+        """
+        for entry in os.scandir(dirname):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+
+    def close(self):
+        if not self.keep:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def imap(f, source, workers=4, inflight=None, ordered=False, stats=None):
+    """Apply `f` to the items of `source` on a pool of threads.
+
+    The source is only advanced while fewer than `inflight` items are
+    being processed or waiting to be yielded, so memory stays bounded
+    however fast the source is. With `ordered=True`, results are yielded
+    in input order; `inflight` is then the size of the reorder window, and
+    a slow item at the head of the window stops new submissions until it
+    completes (a stall). Otherwise results are yielded in completion
+    order. Exceptions raised by `f` are re-raised in the caller.
+
+    `stats` is updated with the counts "submitted", "yielded", "stalls",
+    and the total "stall_time" in seconds.
+
+    :param f: function to apply
+    :param source: iterable
+    :param workers: number of threads (Default value = 4)
+    :param inflight: maximum number of items in the window (Default value = 2 * workers)
+    :param ordered: yield results in input order (Default value = False)
+    :param stats: dictionary receiving counters (Default value = None)
+    """
+    inflight = inflight or 2 * workers
+    stats = stats if stats is not None else {}
+    for k in ["submitted", "yielded", "stalls"]:
+        stats.setdefault(k, 0)
+    stats.setdefault("stall_time", 0.0)
+    source = iter(source)
+    pending = collections.deque() if ordered else set()
+    add = pending.append if ordered else pending.add
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < inflight:
+                    try:
+                        item = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    add(pool.submit(f, item))
+                    stats["submitted"] += 1
+                if len(pending) == 0:
+                    break
+                if ordered:
+                    head = pending[0]
+                    if not head.done() and not exhausted:
+                        stats["stalls"] += 1
+                        start = time.time()
+                        wait([head])
+                        stats["stall_time"] += time.time() - start
+                    pending.popleft()
+                    done = [head]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    pending.difference_update(done)
+                for future in done:
+                    result = future.result()
+                    stats["yielded"] += 1
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Block-parallel gzip compression and decompression.
+
+`PGzipWriter` splits its input into BGZF blocks (independent gzip members
+of at most 64 KB that record their compressed size in a "BC" extra field)
+and compresses batches of blocks on a thread pool; zlib releases the GIL,
+so this scales across cores. The output is an ordinary multi-member gzip
+file readable by gzip, tar, and the standard library.
+
+`PGzipReader` decompresses BGZF input in parallel the same way. Other
+gzip input (single- or multi-member) cannot be split without decoding it,
+so it is inflated sequentially on a background thread, which still
+overlaps decompression with the consumer.
+"""
+
+__all__ = "PGzipWriter PGzipReader".split()
+
+import collections
+import io
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ustar
+
+BGZF_INPUT = 0xff00
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+BGZF_EOF = BGZF_HEADER + b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+
+def compress_blocks(data, level):
+    """Compress data into a sequence of BGZF blocks.
+
+    :param data: bytes-like input
+    :param level: zlib compression level
+    """
+    view = memoryview(data)
+    output = []
+    for i in range(0, len(view), BGZF_INPUT):
+        block = view[i:i + BGZF_INPUT]
+        z = zlib.compressobj(level, zlib.DEFLATED, -15)
+        cdata = z.compress(block) + z.flush()
+        output.append(BGZF_HEADER)
+        output.append(struct.pack("<H", len(cdata) + 25))
+        output.append(cdata)
+        output.append(struct.pack("<II", zlib.crc32(block), len(block)))
+    return b"".join(output)
+
+
+def decompress_blocks(blocks):
+    """Decompress a list of complete BGZF blocks.
+
+    :param blocks: list of (extra length, block bytes)
+    """
+    output = []
+    for xlen, block in blocks:
+        data = zlib.decompress(memoryview(block)[12 + xlen:-8], -15)
+        crc, size = struct.unpack("<II", block[-8:])
+        if zlib.crc32(data) != crc or len(data) != size:
+            raise ustar.ReadError("BGZF block checksum mismatch")
+        output.append(data)
+    return b"".join(output)
+
+
+class Inflater(object):
+    """Sequential inflater for (multi-member) gzip streams."""
+
+    def __init__(self):
+        self.z = zlib.decompressobj(31)
+
+    def __call__(self, data):
+        output = []
+        while len(data) > 0:
+            output.append(self.z.decompress(data))
+            if not self.z.eof:
+                break
+            data = self.z.unused_data
+            self.z = zlib.decompressobj(31)
+        return b"".join(output)
+
+
+class PGzipWriter(io.RawIOBase):
+    """Write a BGZF-blocked gzip stream using a pool of threads.
+
+    :param stream: binary output stream
+    :param threads: number of compression threads (Default value = 4)
+    :param level: zlib compression level (Default value = 6)
+    :param batchsize: uncompressed bytes per thread task (Default value = 1 MB)
+    :param close_stream: close `stream` on close (Default value = False)
+    """
+
+    def __init__(self, stream, threads=4, level=6, batchsize=1 << 20, close_stream=False):
+        self.stream = stream
+        self.level = level
+        self.threads = threads
+        self.batchsize = max(BGZF_INPUT, batchsize // BGZF_INPUT * BGZF_INPUT)
+        self.close_stream = close_stream
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def submit(self, data):
+        self.pending.append(self.pool.submit(compress_blocks, data, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.stream.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.batchsize:
+            n = len(self.buffer) // self.batchsize * self.batchsize
+            self.submit(bytes(self.buffer[:n]))
+            del self.buffer[:n]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if len(self.buffer) > 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.stream.write(self.pending.popleft().result())
+        self.stream.write(BGZF_EOF)
+        self.pool.shutdown()
+        if self.close_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+        super().close()
+
+
+class PGzipReader(io.RawIOBase):
+    """Read a gzip stream, decompressing BGZF blocks on a pool of threads.
+
+    :param stream: binary input stream positioned at a gzip header
+    :param threads: number of decompression threads (Default value = 4)
+    :param batchsize: compressed bytes per thread task (Default value = 1 MB)
+    :param close_stream: close `stream` on close (Default value = False)
+    """
+
+    def __init__(self, stream, threads=4, batchsize=1 << 20, close_stream=False):
+        self.stream = stream
+        self.threads = threads
+        self.batchsize = batchsize
+        self.close_stream = close_stream
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.sequential = None
+        self.inflater = None
+        self.head = b""
+        self.eof = False
+        self.pending = collections.deque()
+        self.current = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def read_block(self):
+        """Read the next BGZF block; returns (xlen, block), or None for other input."""
+        header = self.head or self.stream.read(12)
+        self.head = b""
+        if len(header) == 0:
+            return None
+        if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+            self.head = header
+            return None
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = ustar.readbytes(self.stream, xlen)
+        pos = 0
+        while pos + 4 <= xlen:
+            si, slen = extra[pos:pos + 2], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+            if si == b"BC" and slen == 2:
+                bsize = struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+                rest = ustar.readbytes(self.stream, bsize - 12 - xlen)
+                return xlen, header + extra + rest
+            pos += 4 + slen
+        self.head = header + extra
+        return None
+
+    def fill(self):
+        """Submit the next task; returns False at end of input."""
+        if self.eof:
+            return False
+        if self.sequential is None:
+            blocks = []
+            total = 0
+            while total < self.batchsize:
+                block = self.read_block()
+                if block is None:
+                    break
+                blocks.append(block)
+                total += len(block[1])
+            if blocks:
+                self.pending.append(self.pool.submit(decompress_blocks, blocks))
+                return True
+            if self.head == b"":
+                self.eof = True
+                return False
+            # not BGZF; inflate the rest of the stream sequentially
+            self.sequential = ThreadPoolExecutor(max_workers=1)
+            self.inflater = Inflater()
+        data = self.head + self.stream.read(self.batchsize)
+        self.head = b""
+        if len(data) == 0:
+            self.eof = True
+            return False
+        self.pending.append(self.sequential.submit(self.inflater, data))
+        return True
+
+    def readinto(self, buf):
+        while len(self.current) == 0:
+            while len(self.pending) < 2 * self.threads and self.fill():
+                pass
+            if len(self.pending) == 0:
+                return 0
+            self.current = memoryview(self.pending.popleft().result())
+        n = min(len(buf), len(self.current))
+        buf[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self.pool.shutdown(wait=False)
+        if self.sequential is not None:
+            self.sequential.shutdown(wait=False)
+        if self.close_stream:
+            self.stream.close()
+        super().close()
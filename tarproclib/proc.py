@@ -5,18 +5,59 @@
 # See the LICENSE file for licensing terms (BSD-style).
 #
 
+import os
 import random
+import shutil
+import tempfile
 
+import msgpack
 
-def ishuffle(data, bufsize=1000, initial=100):
+
+def random_draws(rng, batch):
+    """Return a batch of uniform random floats in [0, 1).
+
+    :param rng: `random.Random` or NumPy `Generator`
+    :param batch: number of values
+    """
+    if hasattr(rng, "integers"):
+        return rng.random(batch).tolist()
+    r = rng.random
+    return [r() for _ in range(batch)]
+
+
+def random_order(rng, n):
+    """Return a random permutation of range(n).
+
+    :param rng: `random.Random` or NumPy `Generator`
+    :param n: length
+    """
+    if hasattr(rng, "integers"):
+        return rng.permutation(n).tolist()
+    order = list(range(n))
+    rng.shuffle(order)
+    return order
+
+
+def ishuffle(data, bufsize=1000, initial=100, seed=None, rng=None, batch=1024):
     """Shuffle the data in the stream.
 
-    This uses a buffer of size `bufsize`. Shuffling at
-    startup is less random; this is traded off against
-    yielding samples quickly.
+    This uses a preallocated buffer of `bufsize` slots. Nothing is
+    output until `initial` samples have been read; after that, the buffer
+    keeps growing by one slot for every two input samples until it is
+    full, and from then on every input sample replaces a randomly chosen
+    buffered sample, which is output. Shuffling at startup is less random;
+    this is traded off against yielding samples quickly.
 
-    :param data: iterator
+    Random slot indexes are drawn in batches from a dedicated generator,
+    so results are reproducible for a given `seed` and independent of the
+    global `random` state.
+
+    :param data: iterable
     :param bufsize: buffer size for shuffling
+    :param initial: samples to read before producing output (Default value = 100)
+    :param seed: seed for the random generator (Default value = None)
+    :param rng: `random.Random` or `numpy.random.Generator`; overrides `seed` (Default value = None)
+    :param batch: number of random values drawn at once (Default value = 1024)
     :returns: iterator
 
     """
@@ -24,18 +65,160 @@ def ishuffle(data, bufsize=1000, initial=100):
         for sample in data:
             yield sample
         return
-    initial = min(initial, bufsize)
-    buf = []
-    startup = True
-    for sample in data:
-        if len(buf) < bufsize:
-            buf.append(next(data))
-        k = random.randint(0, len(buf) - 1)
-        sample, buf[k] = buf[k], sample
-        if startup and len(buf) < initial:
-            buf.append(sample)
-            continue
-        startup = False
-        yield sample
-    for sample in buf:
-        yield sample
+    if rng is None:
+        rng = random.Random(seed)
+    initial = max(1, min(initial, bufsize))
+    buf = [None] * bufsize
+    n = 0
+    source = iter(data)
+    for sample in source:
+        buf[n] = sample
+        n += 1
+        if n >= initial:
+            break
+    draws = []
+    j = 0
+    grow = False
+    for sample in source:
+        if n < bufsize:
+            grow = not grow
+            if grow:
+                buf[n] = sample
+                n += 1
+                continue
+        if j >= len(draws):
+            draws = random_draws(rng, batch)
+            j = 0
+        k = int(draws[j] * n)
+        j += 1
+        result = buf[k]
+        buf[k] = sample
+        yield result
+    for k in random_order(rng, n):
+        yield buf[k]
+        buf[k] = None
+
+
+class SpillFile(object):
+    """Append-only spill storage for serialized samples.
+
+    Data is appended to segment files of about `segsize` bytes; a segment
+    is deleted as soon as none of its samples is live anymore. Samples are
+    identified by small `(segment, offset, length)` handles and read back
+    with a single `os.pread`.
+
+    :param tempdir: parent directory for the spill files (Default value = None)
+    :param segsize: target size of each segment file (Default value = 1e9)
+    """
+
+    def __init__(self, tempdir=None, segsize=1e9):
+        self.dir = tempfile.mkdtemp(prefix="_shuffle-", dir=tempdir)
+        self.segsize = segsize
+        self.fds = {}
+        self.live = {}
+        self.segment = -1
+        self.offset = segsize
+
+    def remove(self, segment):
+        os.close(self.fds.pop(segment))
+        del self.live[segment]
+        os.unlink(os.path.join(self.dir, "%06d" % segment))
+
+    def new_segment(self):
+        if self.live.get(self.segment) == 0:
+            self.remove(self.segment)
+        self.segment += 1
+        fname = os.path.join(self.dir, "%06d" % self.segment)
+        self.fds[self.segment] = os.open(fname, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        self.live[self.segment] = 0
+        self.offset = 0
+
+    def append(self, data):
+        """Store data; returns a handle.
+
+        :param data: bytes
+        """
+        if self.offset >= self.segsize:
+            self.new_segment()
+        fd = self.fds[self.segment]
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(fd, view):]
+        handle = (self.segment, self.offset, len(data))
+        self.offset += len(data)
+        self.live[self.segment] += 1
+        return handle
+
+    def pop(self, handle):
+        """Read data for a handle and release it.
+
+        :param handle: handle returned by `append`
+        """
+        segment, offset, length = handle
+        data = os.pread(self.fds[segment], length, offset)
+        self.live[segment] -= 1
+        if self.live[segment] == 0 and segment != self.segment:
+            self.remove(segment)
+        return data
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def spill_default(obj):
+    """Serialize payload handles (e.g. `ustar.LazyPayload`) as their bytes.
+
+    :param obj: object msgpack cannot serialize
+    """
+    if hasattr(obj, "__bytes__"):
+        return bytes(obj)
+    raise TypeError(f"can not serialize {type(obj).__name__!r} object")
+
+
+def dshuffle(data, bufsize=100000, tempdir=None, segsize=1e9, seed=None, rng=None):
+    """Shuffle the data in the stream using a buffer on disk.
+
+    This works like `ishuffle`, but samples are serialized to spill files
+    and only small handles are kept in memory, so `bufsize` can be much
+    larger than what fits in RAM. Every sample output takes one random read.
+    Lazy payloads are read when they are spilled and come back as bytes.
+
+    :param data: iterator
+    :param bufsize: number of samples in the shuffle buffer (Default value = 100000)
+    :param tempdir: directory for spill files (Default value = None)
+    :param segsize: size of spill file segments (Default value = 1e9)
+    :param seed: random seed (Default value = None)
+    :param rng: `random.Random` or `numpy.random.Generator`; overrides `seed` (Default value = None)
+    :returns: iterator
+
+    """
+    if bufsize < 2:
+        for sample in data:
+            yield sample
+        return
+    if rng is None:
+        rng = random.Random(seed)
+    spill = SpillFile(tempdir=tempdir, segsize=segsize)
+    handles = []
+    draws = []
+    j = 0
+    try:
+        for sample in data:
+            handle = spill.append(msgpack.packb(sample, use_bin_type=True, default=spill_default))
+            if len(handles) < bufsize:
+                handles.append(handle)
+                continue
+            if j >= len(draws):
+                draws = random_draws(rng, 1024)
+                j = 0
+            k = int(draws[j] * bufsize)
+            j += 1
+            handle, handles[k] = handles[k], handle
+            yield msgpack.unpackb(spill.pop(handle), raw=False)
+        for k in random_order(rng, len(handles)):
+            yield msgpack.unpackb(spill.pop(handles[k]), raw=False)
+    finally:
+        spill.close()
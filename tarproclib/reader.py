@@ -7,16 +7,20 @@
 
 __all__ = "tariterator TarIterator1 TarIterator".split()
 
+import collections
+import io
 import math
+import queue
 import random
 import re
 import sys
 import tarfile
+import threading
 from urllib.parse import urlparse
 
 import braceexpand as braceexpandlib
 
-from . import gopen, paths
+from . import gopen, index, iothread, paths, ustar
 
 meta_prefix = "__"
 meta_suffix = "__"
@@ -38,11 +42,12 @@ def valid_sample(sample):
     return sample is not None and sample != {}
 
 
-def tardata(fileobj, skip_meta=r"__[^/]*__($|/)"):
-    """Iterator yielding filename, content pairs for the given tar stream.
+def tarfile_data(fileobj, skip_meta=r"__[^/]*__($|/)", select=None):
+    """Iterator yielding filename, content pairs using the `tarfile` module.
 
     :param fileobj: byte stream suitable for tarfile
     :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+    :param select: function deciding from the name whether to read a payload; others yield None (Default value = None, all)
 
     """
     stream = tarfile.open(fileobj=fileobj, mode="r|*")
@@ -57,11 +62,191 @@ def tardata(fileobj, skip_meta=r"__[^/]*__($|/)"):
             continue
         if skip_meta is not None and re.match(skip_meta, fname):
             continue
+        if select is not None and not select(fname):
+            yield fname, None
+            continue
         data = stream.extractfile(tarinfo).read()
         yield fname, data
     del stream
 
 
+def drop_meta(data, skip_meta=r"__[^/]*__($|/)"):
+    """Filter metadata members out of filename, content pairs.
+
+    :param data: iterator of (filename, content) pairs
+    :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+
+    """
+    skip = re.compile(skip_meta).match if skip_meta is not None else None
+    for fname, value in data:
+        if "/" not in fname and fname.startswith(meta_prefix) and fname.endswith(meta_suffix):
+            # skipping metadata for now
+            continue
+        if skip is not None and skip(fname):
+            continue
+        yield fname, value
+
+
+def lazy_members(scanner, shard, base, select=None):
+    """Turn the members of a scanner that reads no payloads into `ustar.LazyPayload` handles.
+
+    :param scanner: TarScanner with a select function rejecting everything
+    :param shard: ustar.ShardFile the scanner is reading
+    :param base: file offset where the scan started
+    :param select: function deciding from the name whether to keep a payload (Default value = None, all)
+    """
+    for fname, _ in scanner:
+        if select is not None and not select(fname):
+            yield fname, None
+            continue
+        size = scanner.size
+        offset = base + scanner.offset - size - ustar.padding(size)
+        yield fname, ustar.LazyPayload(shard, offset, size)
+
+
+def shard_file(fileobj, stream, head):
+    """Return a `ustar.ShardFile` if payloads of `stream` can be read lazily, otherwise None."""
+    if head == b"" or not ustar.seekable(stream):
+        return None
+    try:
+        return ustar.ShardFile(fileobj)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def native_data(fileobj, skip_meta=r"__[^/]*__($|/)", copy=True, threads=0, readahead=0, io_stats=None, select=None,
+                lazy=False):
+    """Iterator yielding filename, content pairs using the native tar parser.
+
+    Payloads of members rejected by `select` are skipped without being
+    read into memory (with `seek` on plain files) and yielded as None.
+
+    With `lazy=True` and an uncompressed local file, no payloads are read
+    at all; they are yielded as `ustar.LazyPayload` handles (file, offset,
+    size) instead. Other inputs are read normally.
+
+    :param fileobj: byte stream, optionally gzip/bzip2/xz compressed
+    :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+    :param copy: return payloads as bytes rather than memoryview (Default value = True)
+    :param threads: threads for gzip decompression (Default value = 0)
+    :param readahead: read and decompress this many chunks ahead on a background thread (Default value = 0)
+    :param io_stats: dictionary accumulating read-ahead counters (Default value = None)
+    :param select: function deciding from the name whether to read a payload (Default value = None, all)
+    :param lazy: yield payloads of local, uncompressed files as handles (Default value = False)
+
+    """
+    base = fileobj.tell() if lazy and ustar.seekable(fileobj) else 0
+    stream, head = ustar.open_decompressed(fileobj, threads=threads)
+    shard = shard_file(fileobj, stream, head) if lazy else None
+    if shard is not None:
+        scanner = ustar.TarScanner(stream, head=head, select=lambda fname: False)
+        yield from drop_meta(lazy_members(scanner, shard, base, select), skip_meta=skip_meta)
+        return
+    readahead = readahead if not isinstance(stream, ustar.MappedFile) else 0
+    if readahead > 0:
+        stream = iothread.ReadAhead(stream, depth=readahead, stats=io_stats)
+    try:
+        scanner = ustar.TarScanner(stream, copy=copy, head=head, select=select)
+        yield from drop_meta(scanner, skip_meta=skip_meta)
+    finally:
+        if readahead > 0:
+            stream.close()
+
+
+default_engine = "native"
+
+
+def tardata(fileobj, skip_meta=r"__[^/]*__($|/)", engine=None, copy=True, threads=0, readahead=0, io_stats=None,
+            select=None, lazy=False):
+    """Iterator yielding filename, content pairs for the given tar stream.
+
+    :param fileobj: byte stream suitable for tarfile
+    :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+    :param engine: "native" or "tarfile" (Default value = default_engine)
+    :param copy: native engine only; False yields payloads as memoryview (Default value = True)
+    :param threads: native engine only; threads for gzip decompression (Default value = 0)
+    :param readahead: number of chunks to read ahead on a background thread (Default value = 0)
+    :param io_stats: dictionary accumulating read-ahead counters (Default value = None)
+    :param select: function deciding from the name whether to read a payload; others yield None (Default value = None, all)
+    :param lazy: native engine only; payload handles instead of bytes for local files (Default value = False)
+
+    """
+    engine = engine or default_engine
+    if engine == "native":
+        return native_data(fileobj, skip_meta=skip_meta, copy=copy, threads=threads,
+                           readahead=readahead, io_stats=io_stats, select=select, lazy=lazy)
+    elif engine == "tarfile":
+        if readahead > 0:
+            fileobj = io.BufferedReader(iothread.ReadAhead(fileobj, depth=readahead, stats=io_stats))
+        return tarfile_data(fileobj, skip_meta=skip_meta, select=select)
+    else:
+        raise ValueError(f"{engine}: unknown tar engine")
+
+
+class SampleGrouper(object):
+    """Group consecutive key, value pairs into samples, one pair at a time.
+
+    This is the state machine behind `group_by_keys`, for callers that
+    receive members in pieces (such as the asyncio readers).
+
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param lcase: convert suffixes to lower case (Default value = True)
+    :param suffixes: keep only these suffixes (Default value = None, all)
+    """
+
+    def __init__(self, keys=paths.base_plus_ext, lcase=True, suffixes=None):
+        self.keys = keys
+        self.lcase = lcase
+        self.suffixes = suffixes
+        self.current = None
+
+    def add(self, fname, value):
+        """Add a member; returns the previous sample when this one starts a new sample, otherwise None.
+
+        Members with a value of None (payloads that were skipped) only
+        contribute their key.
+        """
+        prefix, suffix = self.keys(fname)
+        if prefix is None:
+            return None
+        if self.lcase:
+            suffix = suffix.lower()
+        current = finished = self.current
+        if current is None or prefix != current["__key__"]:
+            current = self.current = dict(__key__=prefix)
+        else:
+            finished = None
+        if value is not None and (self.suffixes is None or suffix in self.suffixes):
+            current[suffix] = value
+        return finished if valid_sample(finished) else None
+
+    def finish(self):
+        """Return the last sample, if any."""
+        current, self.current = self.current, None
+        return current if valid_sample(current) else None
+
+
+def field_selector(fields, keys=paths.base_plus_ext, lcase=True):
+    """Return a function deciding from a member name whether its field is wanted.
+
+    Metadata fields like "__key__" are not tar members and are ignored.
+
+    :param fields: field names (extensions)
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param lcase: compare extensions in lower case (Default value = True)
+    :returns: select function, set of wanted fields
+    """
+    wanted = set(f for f in fields if not (f.startswith(meta_prefix) and f.endswith(meta_suffix)))
+
+    def select(fname):
+        prefix, suffix = keys(fname)
+        if prefix is None:
+            return False
+        return (suffix.lower() if lcase else suffix) in wanted
+
+    return select, wanted
+
+
 def group_by_keys(keys=paths.base_plus_ext, lcase=True, suffixes=None):
     """Returns function over iterator that groups key, value pairs into samples.
 
@@ -70,52 +255,247 @@ def group_by_keys(keys=paths.base_plus_ext, lcase=True, suffixes=None):
 
     """
     def iterator(data):
-        current_sample = None
+        grouper = SampleGrouper(keys=keys, lcase=lcase, suffixes=suffixes)
         for fname, value in data:
-            prefix, suffix = keys(fname)
-            if prefix is None:
-                continue
-            if current_sample is not None and prefix == current_sample["__key__"]:
-                current_sample[suffix] = value
-                continue
-            if valid_sample(current_sample):
-                yield current_sample
-            current_sample = dict(__key__=prefix)
-            if lcase:
-                suffix = suffix.lower()
-            if suffixes is None or suffix in suffixes:
-                current_sample[suffix] = value
-        if valid_sample(current_sample):
-            yield current_sample
+            sample = grouper.add(fname, value)
+            if sample is not None:
+                yield sample
+        sample = grouper.finish()
+        if sample is not None:
+            yield sample
     return iterator
 
 
-def tariterator(fileobj, keys=paths.base_plus_ext, decoder=None, suffixes=None, errors=True, container=None):
+def tariterator(fileobj, keys=paths.base_plus_ext, decoder=None, suffixes=None, errors=True, container=None,
+                engine=None, copy=True, threads=0, readahead=0, io_stats=None, fields=None, lazy=False):
     """Iterate through training samples stored in a sharded tar file.
 
+    With `fields`, samples only contain those fields (plus "__key__"),
+    and the payloads of all other members are skipped in the tar scan
+    instead of being read; `suffixes` does the same filtering after
+    reading every member.
+
     :param fileobj:
     :param check_sorted:  (Default value = False)
     :param keys:  (Default value = base_plus_ext)
     :param decode:  (Default value = True)
+    :param engine: tar parsing engine, "native" or "tarfile" (Default value = None)
+    :param copy: False yields memoryview payloads with the native engine (Default value = True)
+    :param threads: threads for gzip decompression with the native engine (Default value = 0)
+    :param readahead: number of chunks to read (and decompress) ahead on a background thread (Default value = 0)
+    :param io_stats: dictionary accumulating read-ahead counters (Default value = None)
+    :param fields: list of fields to read (Default value = None, all)
+    :param lazy: for uncompressed local files, return payloads as `ustar.LazyPayload` handles (Default value = False)
 
     """
-    content = tardata(fileobj)
+    select = None
+    if fields is not None:
+        select, suffixes = field_selector(fields, keys=keys)
+    content = tardata(fileobj, engine=engine, copy=copy, threads=threads, readahead=readahead, io_stats=io_stats,
+                      select=select, lazy=lazy)
     samples = group_by_keys(keys=keys, suffixes=suffixes)(content)
     if decoder is not None:
         samples = (decoder(sample) for sample in samples)
     return samples
 
 
+def raw_samples(fileobj, keys=paths.base_plus_ext, threads=0, fields=None):
+    """Iterate over samples as verbatim tar bytes.
+
+    Yields `(sample, data)` pairs; `data` holds the members of the sample
+    exactly as they appear in the (decompressed) input, headers included,
+    and can be passed to `TarWriter1.write_raw`; `sample` is the decoded
+    dict, for looking at fields such as sort keys.
+
+    :param fileobj: byte stream, optionally compressed
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param threads: threads for gzip decompression (Default value = 0)
+    :param fields: fields to put into `sample`; the data always has all of them (Default value = None, all)
+
+    """
+    stream, head = ustar.open_decompressed(fileobj, threads=threads)
+    scanner = ustar.TarScanner(stream, head=head, keep_headers=True)
+    wanted = field_selector(fields, keys=keys)[1] if fields is not None else None
+    current = None
+    parts = []
+    for fname, value in scanner:
+        prefix, suffix = keys(fname)
+        if prefix is None:
+            continue
+        if current is not None and prefix != current["__key__"]:
+            yield current, b"".join(parts)
+            current = None
+        if current is None:
+            current = dict(__key__=prefix)
+            parts = []
+        if wanted is None or suffix.lower() in wanted:
+            current[suffix] = value
+        parts += scanner.headers
+        parts.append(value)
+        parts.append(ustar.PADDING[-len(value) % ustar.BLOCKSIZE])
+    if current is not None:
+        yield current, b"".join(parts)
+
+
+def scan_headers(fileobj, keys=paths.base_plus_ext, threads=0, skip_meta=r"__[^/]*__($|/)"):
+    """Iterate over the samples of a tar stream, reading only the headers.
+
+    Yields `(key, sizes)` pairs, where `sizes` maps the extensions of the
+    members of the sample to their payload sizes. Payloads are never read
+    into memory; on uncompressed local files they are skipped with `seek`,
+    so a shard is scanned with one small read per member.
+
+    :param fileobj: byte stream, optionally compressed
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param threads: threads for gzip decompression (Default value = 0)
+    :param skip_meta: regexp for keys that are skipped entirely (Default value = r"__[^/]*__($|/)")
+
+    """
+    stream, head = ustar.open_decompressed(fileobj, threads=threads)
+    scanner = ustar.TarScanner(stream, head=head, select=lambda fname: False)
+    key, sizes = None, {}
+    for fname, _ in drop_meta(scanner, skip_meta=skip_meta):
+        prefix, suffix = keys(fname)
+        if prefix is None:
+            continue
+        if prefix != key:
+            if key is not None:
+                yield key, sizes
+            key, sizes = prefix, {}
+        sizes[suffix.lower()] = scanner.size
+    if key is not None:
+        yield key, sizes
+
+
+RawSpan = collections.namedtuple("RawSpan", "key names offset length data sizes")
+
+
+def sample_spans(fileobj, keys=paths.base_plus_ext, threads=0):
+    """Iterate over samples as contiguous byte spans of the tar stream.
+
+    Yields `RawSpan(key, names, offset, length, data, sizes)`, where
+    `names` are the extensions of the members of the sample, `sizes` their
+    payload sizes, and the span includes their headers and padding. For uncompressed input that supports
+    seeking (local files), payloads are skipped without being read,
+    `offset` is the position of the sample in `fileobj`, and `data` is
+    None; the bytes can be copied directly from the file with
+    `TarWriter1.write_span`. Otherwise, `data` holds the bytes of the span.
+
+    :param fileobj: byte stream, optionally compressed
+    :param keys: function that splits the key into key and extension (Default value = base_plus_ext)
+    :param threads: threads for gzip decompression (Default value = 0)
+
+    """
+    base = fileobj.tell() if ustar.seekable(fileobj) else 0
+    stream, head = ustar.open_decompressed(fileobj, threads=threads)
+    direct = head != b"" and ustar.seekable(stream)
+    scanner = ustar.TarScanner(stream, head=head, keep_headers=not direct,
+                               select=(lambda name: False) if direct else None)
+    current = None
+    names, sizes, parts = [], [], []
+    start = end = 0
+
+    def span():
+        data = None if direct else b"".join(parts)
+        return RawSpan(current, names, base + start if direct else start, end - start, data, sizes)
+
+    for fname, value in scanner:
+        prefix, suffix = keys(fname)
+        if prefix is None:
+            continue
+        if current is not None and prefix != current:
+            yield span()
+            current = None
+        if current is None:
+            current = prefix
+            names, sizes, parts = [], [], []
+            start = scanner.start
+        names.append(suffix)
+        sizes.append(scanner.size)
+        end = scanner.offset
+        if not direct:
+            parts += scanner.headers
+            parts.append(value)
+            parts.append(ustar.PADDING[-len(value) % ustar.BLOCKSIZE])
+    if current is not None:
+        yield span()
+
+
+class ShardReader(object):
+    """Read the samples of a shard on a background thread.
+
+    :param samples: iterator of samples
+    :param bufsize: number of samples to buffer (Default value = 100)
+    :param stats: dictionary accumulating the time the consumer waited for samples ("shard_wait")
+        and the reader waited for the consumer ("prefetch_wait") (Default value = None)
+    """
+
+    def __init__(self, samples, bufsize=100, stats=None):
+        self.queue = queue.Queue(bufsize)
+        self.stats = stats if stats is not None else {}
+        self.stats.setdefault("shard_wait", 0.0)
+        self.stats.setdefault("prefetch_wait", 0.0)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, args=(samples,), daemon=True)
+        self.thread.start()
+
+    def run(self, samples):
+        def put(item):
+            iothread.timed_put(self.queue, item, self.stats, "prefetch_wait", lambda: self.stopped)
+
+        try:
+            for sample in samples:
+                if self.stopped:
+                    break
+                put(sample)
+            put(None)
+        except Exception as exn:
+            put(exn)
+        finally:
+            samples.close()
+
+    def get(self):
+        """Return the next sample, or None at the end of the shard."""
+        item = iothread.timed_get(self.queue, self.stats, "shard_wait")
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.stopped = True
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
 class TarIterator1(object):
     """Iterate of tar files consisting of samples.
 
+    With `prefetch=K`, the next K shards are opened and read on background
+    threads while the current one is being consumed, hiding the startup
+    latency of `pipe:` URLs. With `interleave=N`, N shards are open at once
+    and samples are taken from them round robin. A "#start,end" suffix on
+    the URL selects samples by their position in the output.
+
     :param url: source URL
     :param braceexpand: expand braces in the source URL
     :param shuffle: shuffle the samples
-    :param allow_missing: allow missing shards
+    :param allow_missing: skip shards that cannot be opened
+    :param readahead: number of chunks to read ahead on a background thread (Default value = 0)
+    :param prefetch: number of shards to open and read ahead of the current ones (Default value = 0)
+    :param interleave: number of shards to read round robin (Default value = 1)
+    :param bufsize: samples buffered per prefetched shard (Default value = 100)
+    :param mapped: memory map local shards; payloads are memoryviews of the mapping unless copy=True (Default value = False)
+    :param cache: directory caching `pipe:` shards on local disk, see `gopen.gopen` (Default value = None)
     :param **kw:
+
+    Time spent waiting for input (and by the read-ahead thread waiting for
+    the consumer) is accumulated in `io_stats`.
     """
-    def __init__(self, url, braceexpand=True, shuffle=False, allow_missing=False, **kw):
+    def __init__(self, url, braceexpand=True, shuffle=False, allow_missing=False, readahead=0,
+                 prefetch=0, interleave=1, bufsize=100, mapped=False, cache=None, **kw):
         self.start = 0
         self.end = math.inf
         self.allow_missing = allow_missing
@@ -130,23 +510,110 @@ class TarIterator1(object):
             self.urls = [url]
         if shuffle:
             random.shuffle(self.urls)
+        self.readahead = readahead
+        self.prefetch = prefetch
+        self.interleave = max(1, interleave)
+        self.bufsize = bufsize
+        self.mapped = mapped
+        self.cache = cache
+        self.io_stats = {}
         self.kw = kw
 
-    def __iter__(self):
+    def plan(self):
+        """Return the (url, offset) pairs to read and the number of samples skipped.
+
+        In sequential order, sidecar indexes are used to skip whole shards
+        and to seek to the first sample inside a shard.
+        """
         count = 0
+        result = []
         for url in self.urls:
-            with gopen.gopen(url, "rb") as stream:
-                for sample in tariterator(stream, **self.kw):
-                    if count < self.start:
+            offset = 0
+            if self.interleave == 1 and count < self.start and len(result) == 0:
+                # with a sidecar index, skip whole shards and seek within a shard
+                idx = index.find_index(url)
+                if idx is not None:
+                    _, entries = index.read_index(idx)
+                    if count + len(entries) <= self.start:
+                        count += len(entries)
                         continue
-                    if count >= self.end:
+                    offset = entries[self.start - count].offset
+                    count = self.start
+            result.append((url, offset))
+        return result, count
+
+    def shard_samples(self, url, offset=0):
+        """Iterate over the samples of one shard.
+
+        :param url: shard URL
+        :param offset: byte offset of the first sample (Default value = 0)
+        """
+        kw = self.kw
+        if self.mapped:
+            kw = dict(kw)
+            kw.setdefault("copy", False)
+        try:
+            stream = gopen.gopen(url, "rb", mapped=self.mapped, cache=self.cache)
+        except OSError:
+            if self.allow_missing:
+                return
+            raise
+        with stream:
+            if offset > 0:
+                stream.seek(offset)
+            for sample in tariterator(stream, readahead=self.readahead, io_stats=self.io_stats, **kw):
+                if "__source__" not in sample:
+                    sample["__source__"] = url
+                yield sample
+
+    def prefetched(self, plan):
+        """Iterate over the samples of the planned shards using background readers.
+
+        :param plan: list of (url, offset)
+        """
+        plan = iter(plan)
+        active, waiting = [], collections.deque()
+        position = 0
+        try:
+            while True:
+                while len(active) + len(waiting) < self.interleave + self.prefetch:
+                    try:
+                        url, offset = next(plan)
+                    except StopIteration:
                         break
-                    if "__source__" not in sample:
-                        sample["__source__"] = url
+                    waiting.append(ShardReader(self.shard_samples(url, offset), self.bufsize, self.io_stats))
+                while len(active) < self.interleave and len(waiting) > 0:
+                    active.append(waiting.popleft())
+                if len(active) == 0:
+                    break
+                position %= len(active)
+                sample = active[position].get()
+                if sample is None:
+                    active.pop(position).close()
+                    continue
+                yield sample
+                position += 1
+        finally:
+            for reader in active + list(waiting):
+                reader.close()
+
+    def __iter__(self):
+        plan, count = self.plan()
+        if self.prefetch == 0 and self.interleave == 1:
+            samples = (sample for url, offset in plan for sample in self.shard_samples(url, offset))
+        else:
+            samples = self.prefetched(plan)
+        if count >= self.end:
+            return
+        try:
+            for sample in samples:
+                if count >= self.start:
                     yield sample
-                    count += 1
-            if count >= self.end:
-                break
+                count += 1
+                if count >= self.end:
+                    break
+        finally:
+            samples.close()
 
 
 zmq_schemes = set("zpush zpull zpub zsub zrpush zrpull zrpub zrsub".split())
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Summary statistics of tar shards from their headers.
+
+`shard_stats` scans one shard with `reader.scan_headers`, so payloads
+are never read, and returns a small dict that can be sent back from a
+worker process; `merge_stats` combines the results for a whole dataset.
+Payload sizes are summarized as histograms with power of two buckets:
+bucket `b` counts sizes in `[2**(b-1), 2**b)`, bucket 0 empty payloads.
+"""
+
+__all__ = "shard_stats merge_stats format_size".split()
+
+import collections
+import hashlib
+import sys
+
+from . import gopen, reader
+
+
+def format_size(n):
+    """Format a byte count with a binary unit suffix.
+
+    :param n: number of bytes
+    """
+    if n < 1024:
+        return str(n)
+    for unit in ["K", "M", "G", "T"]:
+        n /= 1024
+        if n < 1024:
+            return f"{n:.1f}{unit}"
+    return f"{n / 1024:.1f}P"
+
+
+def key_digest(key):
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+
+def shard_stats(url, digests=False, threads=0):
+    """Collect statistics for one shard.
+
+    Returns a dict with the "url", the number of "samples", total "bytes"
+    of payload, per-field "counts", "sizes" (histograms, bucket -> count),
+    "min" and "max" sizes, the number of "duplicates" (keys seen earlier
+    in the shard) and "unsorted" samples (key smaller than the previous
+    one), and an "error" message if the shard could not be read to the end.
+    With `digests`, "digests" holds an 8 byte hash of every key for
+    finding duplicates across shards.
+
+    :param url: shard URL
+    :param digests: return key digests (Default value = False)
+    :param threads: threads for gzip decompression (Default value = 0)
+    """
+    result = dict(url=url, samples=0, bytes=0, counts=collections.Counter(),
+                  sizes=collections.defaultdict(collections.Counter), min={}, max={},
+                  duplicates=0, unsorted=0, error=None)
+    seen = set()
+    previous = None
+    try:
+        with gopen.gopen(url, "rb") as stream:
+            for key, sizes in reader.scan_headers(stream, threads=threads):
+                result["samples"] += 1
+                digest = key_digest(key)
+                if digest in seen:
+                    result["duplicates"] += 1
+                seen.add(digest)
+                if previous is not None and key < previous:
+                    result["unsorted"] += 1
+                previous = key
+                for field, size in sizes.items():
+                    result["counts"][field] += 1
+                    result["sizes"][field][size.bit_length()] += 1
+                    result["bytes"] += size
+                    result["min"][field] = min(size, result["min"].get(field, size))
+                    result["max"][field] = max(size, result["max"].get(field, size))
+    except Exception as exn:
+        result["error"] = f"{type(exn).__name__}: {exn}"
+    result["counts"] = dict(result["counts"])
+    result["sizes"] = {field: dict(hist) for field, hist in result["sizes"].items()}
+    if digests:
+        result["digests"] = seen
+    return result
+
+
+def merge_stats(results):
+    """Combine the results of `shard_stats` into dataset statistics.
+
+    Adds "shards", "errors", and "missing" (per field, the number of
+    samples without it); with key digests, "duplicates" also counts keys
+    that occur in more than one shard.
+
+    :param results: iterable of dicts from `shard_stats`
+    """
+    total = dict(shards=0, errors=0, samples=0, bytes=0, counts=collections.Counter(),
+                 sizes=collections.defaultdict(collections.Counter), min={}, max={},
+                 duplicates=0, unsorted=0)
+    seen = None
+    for result in results:
+        total["shards"] += 1
+        total["errors"] += result["error"] is not None
+        for k in ["samples", "bytes", "duplicates", "unsorted"]:
+            total[k] += result[k]
+        total["counts"].update(result["counts"])
+        for field, hist in result["sizes"].items():
+            total["sizes"][field].update(hist)
+            total["min"][field] = min(result["min"][field], total["min"].get(field, result["min"][field]))
+            total["max"][field] = max(result["max"][field], total["max"].get(field, result["max"][field]))
+        if "digests" in result:
+            seen = seen if seen is not None else set()
+            total["duplicates"] += len(seen & result["digests"])
+            seen |= result["digests"]
+    total["missing"] = {field: total["samples"] - count for field, count in total["counts"].items()}
+    return total
+
+
+def print_stats(total, stream=sys.stdout):
+    """Print dataset statistics as a table.
+
+    :param total: dict from `merge_stats`
+    :param stream: output stream (Default value = sys.stdout)
+    """
+    print(f"shards {total['shards']} samples {total['samples']} bytes {format_size(total['bytes'])}"
+          f" errors {total['errors']} duplicates {total['duplicates']} unsorted {total['unsorted']}", file=stream)
+    print(f"{'field':16s} {'count':>10s} {'missing':>10s} {'min':>8s} {'max':>8s}  sizes", file=stream)
+    for field in sorted(total["counts"]):
+        hist = total["sizes"][field]
+        buckets = " ".join(f"<{format_size(1 << b)}:{hist[b]}" if b > 0 else f"0:{hist[b]}" for b in sorted(hist))
+        print(f"{field:16s} {total['counts'][field]:10d} {total['missing'][field]:10d}"
+              f" {format_size(total['min'][field]):>8s} {format_size(total['max'][field]):>8s}  {buckets}",
+              file=stream)
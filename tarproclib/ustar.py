@@ -0,0 +1,819 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+"""Native streaming parser for POSIX tar archives (ustar, pax, GNU).
+
+This avoids constructing a `tarfile.TarInfo` for every member; headers
+are parsed out of a single reusable 512 byte buffer.
+"""
+
+__all__ = "TarScanner TarParser TarEncoder ReadError LazyPayload MappedFile open_decompressed".split()
+
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import tarfile
+import time
+
+BLOCKSIZE = 512
+RECORDSIZE = 20 * BLOCKSIZE
+
+ZERO_BLOCK = bytes(BLOCKSIZE)
+PADDING = [bytes(n) for n in range(BLOCKSIZE)]
+
+REGTYPES = frozenset([ord("0"), 0, ord("7")])
+GNU_LONGNAME = ord("L")
+GNU_LONGLINK = ord("K")
+PAX_HEADER = ord("x")
+PAX_GLOBAL = ord("g")
+SPECIALTYPES = frozenset([GNU_LONGNAME, GNU_LONGLINK, PAX_HEADER, PAX_GLOBAL])
+
+
+class ReadError(tarfile.ReadError):
+    """Malformed or truncated tar stream."""
+    pass
+
+
+def padding(size):
+    """Number of bytes needed to pad `size` to a full block.
+
+    :param size: payload size
+    """
+    return -size % BLOCKSIZE
+
+
+def nts(field):
+    """Convert a null-terminated header field to a string.
+
+    :param field: bytes-like header field
+    """
+    return bytes(field).split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+
+
+def nti(field):
+    """Convert a numeric header field (octal or GNU base-256) to an int.
+
+    :param field: bytes-like header field
+    """
+    if field[0] in (0o200, 0o377):
+        n = 0
+        for b in field[1:]:
+            n = (n << 8) + b
+        if field[0] == 0o377:
+            n = -(256 ** (len(field) - 1) - n)
+        return n
+    field = bytes(field).split(b"\0", 1)[0].strip()
+    try:
+        return int(field, 8) if field else 0
+    except ValueError:
+        raise ReadError("invalid numeric header field {!r}".format(field))
+
+
+def header_name(block):
+    """Extract the member name from a ustar/GNU header block.
+
+    :param block: 512 byte header
+    """
+    name = nts(block[0:100])
+    if block[257:263] == b"ustar\0":
+        prefix = nts(block[345:500])
+        if prefix:
+            name = prefix + "/" + name
+    return name
+
+
+def parse_pax(payload):
+    """Parse the records of a pax extended header.
+
+    :param payload: header payload
+    :returns: dict of keywords to values
+    """
+    buf = bytes(payload)
+    result = {}
+    pos = 0
+    while pos < len(buf) and buf[pos] != 0:
+        space = buf.find(b" ", pos)
+        if space < 0:
+            raise ReadError("invalid pax header")
+        length = int(buf[pos:space])
+        if length <= 0:
+            raise ReadError("invalid pax header")
+        key, _, value = buf[space + 1:pos + length - 1].partition(b"=")
+        result[key.decode("utf-8")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return result
+
+
+def readfull(stream, view):
+    """Fill `view` from `stream`, retrying on short reads.
+
+    :param stream: binary stream with `readinto`
+    :param view: writable memoryview
+    :returns: number of bytes read (less than `len(view)` only at EOF)
+    """
+    total = stream.readinto(view) or 0
+    while total < len(view):
+        n = stream.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def readbytes(stream, size):
+    """Read exactly `size` bytes into a single `bytes` object.
+
+    :param stream: binary stream
+    :param size: number of bytes
+    """
+    data = stream.read(size)
+    if len(data) < size:
+        data = bytearray(data)
+        while len(data) < size:
+            more = stream.read(size - len(data))
+            if not more:
+                raise ReadError("unexpected end of data")
+            data += more
+        data = bytes(data)
+    return data
+
+
+def verify_header(block, offset):
+    """Check the checksum of a header block.
+
+    :param block: 512 byte header (bytearray)
+    :param offset: stream offset of the block, for error messages
+    """
+    if nti(block[148:156]) != sum(block) - sum(block[148:156]) + 256:
+        raise ReadError("bad checksum in header at offset {}".format(offset))
+
+
+def member_name(view, size, longname, pax, globals_):
+    """Determine the name and size of a member from its header and any preceding extended headers.
+
+    :param view: header block
+    :param size: size from the header block
+    :param longname: GNU long name or None
+    :param pax: pax header records or None
+    :param globals_: global pax header records
+    :returns: name, size
+    """
+    name = longname if longname is not None else header_name(view)
+    if pax is not None or globals_:
+        info = dict(globals_, **(pax or {}))
+        name = info.get("path", name)
+        if "size" in info:
+            size = int(info["size"])
+    return name, size
+
+
+def is_regular(typeflag, name):
+    return typeflag in REGTYPES and not (typeflag == 0 and name.endswith("/"))
+
+
+class Prefixed(io.RawIOBase):
+    """Raw stream that returns `head` before the rest of `stream`."""
+
+    def __init__(self, head, stream):
+        self.head = memoryview(head)
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if len(self.head) > 0:
+            n = min(len(buf), len(self.head))
+            buf[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        return self.stream.readinto(buf)
+
+
+def open_decompressed(fileobj, threads=0):
+    """Detect compression from the magic number and wrap `fileobj`.
+
+    Handles the same formats as `tarfile` mode "r|*" (gzip, bzip2, xz),
+    plus zstd and lz4 if the optional `zstandard` and `lz4` packages are installed.
+    Uncompressed streams are not wrapped; the bytes consumed for detection
+    are returned as `head` and must be passed on to `TarScanner`.
+
+    :param fileobj: binary input stream
+    :param threads: decompress gzip with this many threads (Default value = 0)
+    :returns: stream, head
+    """
+    head = bytearray(BLOCKSIZE)
+    head = bytes(head[:readfull(fileobj, memoryview(head))])
+    if head.startswith(b"\x1f\x8b"):
+        if threads > 0:
+            from . import pgzip
+            return io.BufferedReader(pgzip.PGzipReader(Prefixed(head, fileobj), threads=threads)), b""
+        return gzip.GzipFile(fileobj=Prefixed(head, fileobj), mode="rb"), b""
+    if head.startswith(b"BZh91"):
+        return bz2.BZ2File(Prefixed(head, fileobj)), b""
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return lzma.LZMAFile(Prefixed(head, fileobj)), b""
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        import zstandard
+        dctx = zstandard.ZstdDecompressor()
+        return dctx.stream_reader(Prefixed(head, fileobj), read_across_frames=True, closefd=False), b""
+    if head.startswith(b"\x04\x22\x4d\x18"):
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(Prefixed(head, fileobj), mode="rb"), b""
+    return fileobj, head
+
+
+def seekable(stream):
+    """Check whether skipping over data in `stream` can use `seek`.
+
+    Only plain files, mapped files, and in-memory streams qualify;
+    decompressors emulate seeking by reading.
+
+    :param stream: binary input stream
+    """
+    return isinstance(stream, (io.BufferedReader, io.FileIO, io.BytesIO, MappedFile)) and stream.seekable()
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only stream over a memory mapping of a local file.
+
+    `readview` returns zero-copy memoryview slices of the mapping, which
+    `TarScanner` uses for payloads when `copy=False`. The kernel is told
+    that the file is read sequentially (`posix_fadvise`, `madvise`), and
+    the next `window` bytes are requested ahead (MADV_WILLNEED) as the
+    position advances.
+
+    :param fname: file name
+    :param window: bytes to request ahead of the current position (Default value = 16 MB)
+    """
+
+    def __init__(self, fname, window=16 << 20):
+        self.file = open(fname, "rb")
+        self.fd = self.file.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.window = window
+        self.pos = 0
+        self.advised = 0
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if self.size == 0:
+            # empty files cannot be mapped
+            self.mapping = None
+            self.view = memoryview(b"")
+            return
+        self.mapping = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        if hasattr(self.mapping, "madvise"):
+            self.mapping.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.mapping)
+        self.advise()
+
+    def advise(self):
+        """Request the next window of the file ahead of the current position."""
+        if self.pos < self.advised or self.mapping is None or not hasattr(self.mapping, "madvise"):
+            return
+        start = self.pos - self.pos % mmap.PAGESIZE
+        length = min(self.window, self.size - start)
+        if length > 0:
+            self.mapping.madvise(mmap.MADV_WILLNEED, start, length)
+        self.advised = start + self.window // 2
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(0, offset)
+        self.advise()
+        return self.pos
+
+    def readview(self, size):
+        """Return the next `size` bytes as a memoryview of the mapping."""
+        pos = self.pos
+        data = self.view[pos:pos + size]
+        self.pos = pos + len(data)
+        if self.pos >= self.advised:
+            self.advise()
+        return data
+
+    def readinto(self, buf):
+        pos = self.pos
+        n = min(len(buf), self.size - pos)
+        buf[:n] = self.view[pos:pos + n]
+        self.pos = pos + n
+        if self.pos >= self.advised:
+            self.advise()
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.pos
+        return self.readview(size).tobytes()
+
+    def close(self):
+        if self.closed:
+            return
+        self.view.release()
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                # payload views are still in use; the mapping goes away with them
+                pass
+        self.file.close()
+        super().close()
+
+
+class ShardFile(object):
+    """A file descriptor shared by the lazy payloads of one shard.
+
+    The descriptor is duplicated, so the original file can be closed; it
+    is closed when the last payload referring to it goes away.
+
+    :param fileobj: open file
+    """
+
+    def __init__(self, fileobj):
+        self.fd = os.dup(fileobj.fileno())
+        self.mapping = None
+
+    def pread(self, offset, size):
+        data = os.pread(self.fd, size, offset)
+        if len(data) < size:
+            raise ReadError("unexpected end of data")
+        return data
+
+    def view(self, offset, size):
+        if self.mapping is None:
+            self.mapping = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        return memoryview(self.mapping)[offset:offset + size]
+
+    def __del__(self):
+        os.close(self.fd)
+
+
+class LazyPayload(object):
+    """Handle for a member payload that is read only when needed.
+
+    `read()` (or `bytes(payload)`) reads it with `pread`, `view()` returns
+    a zero-copy memoryview of a memory mapping of the shard, and
+    `TarEncoder` copies it to its output with `os.sendfile` where possible.
+    Pickling stores the data.
+
+    :param shard: ShardFile
+    :param offset: offset of the payload in the file
+    :param size: payload size
+    """
+
+    __slots__ = ("shard", "offset", "size")
+
+    def __init__(self, shard, offset, size):
+        self.shard = shard
+        self.offset = offset
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def read(self):
+        return self.shard.pread(self.offset, self.size)
+
+    def view(self):
+        return self.shard.view(self.offset, self.size)
+
+    def __bytes__(self):
+        return self.read()
+
+    def __reduce__(self):
+        return (bytes, (self.read(),))
+
+    def __repr__(self):
+        return f"<LazyPayload fd={self.shard.fd} offset={self.offset} size={self.size}>"
+
+    def sendto(self, fd):
+        """Copy the payload to a file descriptor.
+
+        :param fd: output file descriptor
+        """
+        offset, remaining = self.offset, self.size
+        if hasattr(os, "sendfile"):
+            try:
+                while remaining > 0:
+                    n = os.sendfile(fd, self.shard.fd, offset, remaining)
+                    if n == 0:
+                        raise ReadError("unexpected end of data")
+                    offset += n
+                    remaining -= n
+                return
+            except OSError:
+                if remaining < self.size:
+                    raise
+                # sendfile not supported for these files
+        data = memoryview(self.read())
+        while len(data) > 0:
+            data = data[os.write(fd, data):]
+
+
+class TarScanner(object):
+    """Iterate over the regular members of an uncompressed tar stream.
+
+    Yields `(name, data)` pairs. Payloads are returned as `bytes` (a single
+    allocation per member) or, with `copy=False`, as `memoryview` slices of
+    a buffer that also absorbs the block padding (for a `MappedFile`,
+    slices of the mapping itself).
+
+    After each member, `start` is the stream offset of the first header
+    block belonging to it (including GNU long name and pax headers) and
+    `offset` is the offset just past its padded payload. With
+    `keep_headers=True`, `headers` is the list of raw header blocks
+    (and long name/pax payloads) preceding the member's payload, so that
+    the member can be copied verbatim. `size` is the payload size.
+
+    With `select`, the payloads of members whose name is not selected are
+    skipped without being read into memory (using `seek` on plain files)
+    and yielded as None.
+
+    :param stream: binary input stream
+    :param copy: return payloads as `bytes` (Default value = True)
+    :param head: bytes already consumed from the stream (Default value = b"")
+    :param keep_headers: keep the raw header blocks of each member (Default value = False)
+    :param select: function deciding from the member name whether to read the payload (Default value = None, all)
+    """
+
+    def __init__(self, stream, copy=True, head=b"", keep_headers=False, select=None):
+        self.stream = stream
+        self.copy = copy
+        self.head = head
+        self.keep_headers = keep_headers
+        self.select = select
+        self.seekable = seekable(stream)
+        self.headers = []
+        self.start = 0
+        self.offset = 0
+        self.size = 0
+        self.scratch = memoryview(bytearray(65536))
+
+    def discard(self, size):
+        """Skip over `size` bytes of the stream.
+
+        :param size: number of bytes
+        """
+        if self.seekable and size > 0:
+            self.stream.seek(size, io.SEEK_CUR)
+            return
+        view = self.scratch
+        while size > 0:
+            n = self.stream.readinto(view[:min(size, len(view))])
+            if not n:
+                raise ReadError("unexpected end of data")
+            size -= n
+
+    def __iter__(self):
+        stream = self.stream
+        block = bytearray(BLOCKSIZE)
+        view = memoryview(block)
+        head = self.head
+        offset = start = 0
+        longname = None
+        pax = None
+        globals_ = {}
+        keep_headers = self.keep_headers
+        select = self.select
+        headers = []
+        while True:
+            if head:
+                n = len(head)
+                view[:n] = head
+                n += readfull(stream, view[n:])
+                head = None
+            else:
+                n = readfull(stream, view)
+            if n == 0:
+                break
+            if n < BLOCKSIZE:
+                raise ReadError("truncated header at offset {}".format(offset))
+            if block == ZERO_BLOCK:
+                break
+            verify_header(block, offset)
+            if longname is None and pax is None:
+                start = offset
+                if keep_headers:
+                    headers = []
+            if keep_headers:
+                headers.append(bytes(block))
+            size = nti(view[124:136])
+            typeflag = block[156]
+            pad = -size % BLOCKSIZE
+            offset += BLOCKSIZE
+            if typeflag in SPECIALTYPES:
+                payload = readbytes(stream, size)
+                self.discard(pad)
+                offset += size + pad
+                if keep_headers:
+                    headers += [payload, PADDING[pad]]
+                if typeflag == GNU_LONGNAME:
+                    longname = nts(payload)
+                elif typeflag == PAX_HEADER:
+                    pax = parse_pax(payload)
+                elif typeflag == PAX_GLOBAL:
+                    globals_.update(parse_pax(payload))
+                continue
+            name, size = member_name(view, size, longname, pax, globals_)
+            pad = -size % BLOCKSIZE
+            longname = pax = None
+            if not is_regular(typeflag, name):
+                self.discard(size + pad)
+                offset += size + pad
+                continue
+            if select is not None and not select(name):
+                self.discard(size + pad)
+                data = None
+            elif self.copy:
+                data = readbytes(stream, size)
+                if pad:
+                    self.discard(pad)
+            elif isinstance(stream, MappedFile):
+                data = stream.readview(size)
+                if len(data) < size:
+                    raise ReadError("unexpected end of data")
+                self.discard(pad)
+            else:
+                buf = bytearray(size + pad)
+                if readfull(stream, memoryview(buf)) < size + pad:
+                    raise ReadError("unexpected end of data")
+                data = memoryview(buf)[:size]
+            offset += size + pad
+            self.start = start
+            self.offset = offset
+            self.headers = headers
+            self.size = size
+            yield name, data
+
+
+class TarParser(object):
+    """Incremental tar parser for data that arrives in chunks.
+
+    This is the push counterpart of `TarScanner` for callers that do
+    their own I/O, such as asyncio readers: `feed` takes the next chunk of
+    uncompressed tar data and returns the list of `(name, data)` members
+    completed by it. Payloads are returned as `bytes`. With `select`,
+    unselected payloads are dropped as they arrive and yielded as None.
+
+    :param select: function deciding from the member name whether to keep the payload (Default value = None, all)
+    """
+
+    def __init__(self, select=None):
+        self.select = select
+        self.buffer = bytearray()
+        self.offset = 0
+        self.skip = 0
+        self.member = None
+        self.longname = None
+        self.pax = None
+        self.globals = {}
+        self.finished = False
+
+    def feed(self, data):
+        """Parse the next chunk of data.
+
+        :param data: bytes-like
+        :returns: list of (name, data) pairs
+        """
+        if self.finished:
+            return []
+        buf = self.buffer
+        buf += data
+        pos = 0
+        result = []
+        while True:
+            if self.skip > 0:
+                n = min(self.skip, len(buf) - pos)
+                pos += n
+                self.skip -= n
+                if self.skip > 0:
+                    break
+            if self.member is None:
+                if len(buf) - pos < BLOCKSIZE:
+                    break
+                block = buf[pos:pos + BLOCKSIZE]
+                if block == ZERO_BLOCK:
+                    self.finished = True
+                    pos = len(buf)
+                    break
+                verify_header(block, self.offset + pos)
+                pos += BLOCKSIZE
+                size = nti(block[124:136])
+                typeflag = block[156]
+                if typeflag in SPECIALTYPES:
+                    self.member = (typeflag, None, size)
+                    continue
+                name, size = member_name(block, size, self.longname, self.pax, self.globals)
+                self.longname = self.pax = None
+                if not is_regular(typeflag, name):
+                    self.skip = size + padding(size)
+                    continue
+                if self.select is not None and not self.select(name):
+                    self.skip = size + padding(size)
+                    result.append((name, None))
+                    continue
+                self.member = (typeflag, name, size)
+            typeflag, name, size = self.member
+            if len(buf) - pos < size:
+                break
+            payload = bytes(buf[pos:pos + size])
+            pos += size
+            self.skip = padding(size)
+            self.member = None
+            if typeflag == GNU_LONGNAME:
+                self.longname = nts(payload)
+            elif typeflag == PAX_HEADER:
+                self.pax = parse_pax(payload)
+            elif typeflag == PAX_GLOBAL:
+                self.globals.update(parse_pax(payload))
+            elif typeflag not in SPECIALTYPES:
+                result.append((name, payload))
+        del buf[:pos]
+        self.offset += pos
+        return result
+
+    def close(self):
+        """Check that the data ended on a member boundary."""
+        if not self.finished and (len(self.buffer) > 0 or self.member is not None or self.skip > 0):
+            raise ReadError("unexpected end of data")
+
+
+def pax_record(key, value):
+    """Encode a single pax extended header record.
+
+    :param key: keyword
+    :param value: value
+    """
+    payload = " {}={}\n".format(key, value).encode("utf-8", "surrogateescape")
+    n = len(payload) + 1
+    while len(str(n)) + len(payload) != n:
+        n = len(str(n)) + len(payload)
+    return str(n).encode("ascii") + payload
+
+
+class TarEncoder(object):
+    """Write tar members to a binary stream without `tarfile.TarInfo`.
+
+    Headers are packed from a precomputed ustar template that shares
+    mode, owner and mtime across all members; only name, size and
+    checksum are filled in per member. Names longer than 100 bytes and
+    sizes that do not fit the octal field get a pax extended header.
+    Header, payload and padding of all members passed to one `write`
+    call are emitted with a single `os.writev` when the stream has a
+    usable file descriptor.
+
+    :param stream: binary output stream
+    :param user: user name for all members (Default value = "bigdata")
+    :param group: group name for all members (Default value = "bigdata")
+    :param mode: file mode for all members (Default value = 0o444)
+    :param mtime: modification time (Default value = current time)
+    """
+
+    def __init__(self, stream, user="bigdata", group="bigdata", mode=0o444, mtime=None):
+        self.stream = stream
+        self.offset = 0
+        mtime = int(time.time() if mtime is None else mtime)
+        template = bytearray(BLOCKSIZE)
+        template[100:108] = b"%07o\0" % mode
+        template[108:116] = b"%07o\0" % 0
+        template[116:124] = b"%07o\0" % 0
+        template[136:148] = b"%011o\0" % mtime
+        template[148:156] = b" " * 8
+        template[156] = ord("0")
+        template[257:265] = b"ustar\x0000"
+        user = user.encode("utf-8")[:31]
+        group = group.encode("utf-8")[:31]
+        template[265:265 + len(user)] = user
+        template[297:297 + len(group)] = group
+        template[329:337] = b"%07o\0" % 0
+        template[337:345] = b"%07o\0" % 0
+        self.template = bytes(template)
+        self.checksum = sum(template)
+        self.fd = None
+        if isinstance(stream, (io.BufferedWriter, io.FileIO)):
+            # wrappers like GzipFile also have a fileno(), so only plain files qualify
+            try:
+                fd = stream.fileno()
+                stream.flush()
+                self.fd = fd
+                self.iov_max = os.sysconf("SC_IOV_MAX")
+            except (OSError, ValueError, io.UnsupportedOperation):
+                pass
+
+    def header(self, name, size, typeflag=b"0"):
+        """Return the header block(s) for a member.
+
+        :param name: member name
+        :param size: payload size
+        :param typeflag: tar type flag (Default value = b"0")
+        """
+        bname = name.encode("utf-8", "surrogateescape")
+        pax = b""
+        if len(bname) > 100:
+            pax += pax_record("path", name)
+            bname = bname[:100]
+        if size > 0o77777777777:
+            pax += pax_record("size", size)
+            sizefield = b"%011o\0" % 0
+        else:
+            sizefield = b"%011o\0" % size
+        block = bytearray(self.template)
+        block[0:len(bname)] = bname
+        block[124:136] = sizefield
+        block[156:157] = typeflag
+        chksum = self.checksum + sum(bname) + sum(sizefield) + typeflag[0] - ord("0")
+        block[148:155] = b"%06o\0" % chksum
+        if pax:
+            return self.header("././@PaxHeader", len(pax), b"x") + pax + bytes(-len(pax) % BLOCKSIZE) + block
+        return bytes(block)
+
+    def emit(self, parts):
+        """Write a list of buffers to the stream.
+
+        `LazyPayload` parts are copied from their shard file, with
+        `os.sendfile` when the stream is a plain file or pipe.
+
+        :param parts: list of bytes-like objects or LazyPayload
+        """
+        if self.fd is None:
+            for part in parts:
+                self.stream.write(part.read() if isinstance(part, LazyPayload) else part)
+            return
+        start = 0
+        for i, part in enumerate(parts):
+            if isinstance(part, LazyPayload):
+                self.writev(parts[start:i])
+                part.sendto(self.fd)
+                start = i + 1
+        self.writev(parts[start:])
+
+    def writev(self, parts):
+        """Write a list of buffers to the file descriptor of the stream.
+
+        :param parts: list of bytes-like objects
+        """
+        while len(parts) > 0:
+            chunk = parts[:self.iov_max]
+            total = sum(len(p) for p in chunk)
+            n = os.writev(self.fd, chunk)
+            if n < total:
+                # partial write; continue with the remainder
+                for i, p in enumerate(chunk):
+                    if n < len(p):
+                        parts = [memoryview(p)[n:]] + parts[i + 1:]
+                        break
+                    n -= len(p)
+                continue
+            parts = parts[len(chunk):]
+
+    def write(self, members):
+        """Write a group of members, usually all the fields of one sample.
+
+        :param members: list of (name, data) pairs; data is bytes-like or LazyPayload
+        :returns: total payload size
+        """
+        parts = []
+        total = 0
+        offset = self.offset
+        for name, data in members:
+            size = len(data)
+            header = self.header(name, size)
+            parts.append(header)
+            parts.append(data)
+            pad = -size % BLOCKSIZE
+            if pad:
+                parts.append(PADDING[pad])
+            offset += len(header) + size + pad
+            total += size
+        self.emit(parts)
+        self.offset = offset
+        return total
+
+    def close(self):
+        """Write the end-of-archive marker and pad to a full record."""
+        end = self.offset + 2 * BLOCKSIZE
+        end += -end % RECORDSIZE
+        self.emit([bytes(end - self.offset)])
+        self.offset = end
@@ -5,49 +5,195 @@
 # See the LICENSE file for licensing terms (BSD-style).
 #
 
+import gzip
 import io
+import os
+import queue
 import sys
 import tarfile
+import threading
 import time
 from urllib.parse import urlparse
 
-__all__ = "TarWriter1 TarWriter".split()
+from . import index as indexlib
+from . import iothread, pgzip, ustar
+
+__all__ = "TarWriter1 ThreadedWriter TarWriter".split()
+
+default_engine = "native"
+
+
+codecs = ["gz", "zst", "lz4"]
+
+
+def compression_codec(fname, compress=None):
+    """Determine the compression codec for an output.
+
+    :param fname: output file name or None
+    :param compress: True (gzip), False, None (by extension), or a codec name
+    :returns: "gz", "zst", "lz4", or None
+    """
+    if compress is False:
+        return None
+    if compress is True:
+        return "gz"
+    if compress is not None:
+        if compress not in codecs:
+            raise ValueError(f"{compress}: unknown compression (should be one of {codecs})")
+        return compress
+    if fname is None:
+        return None
+    if fname.endswith("gz"):
+        return "gz"
+    if fname.endswith(".zst"):
+        return "zst"
+    if fname.endswith(".lz4"):
+        return "lz4"
+    return None
+
+
+def open_compressor(stream, codec, threads=0, level=None):
+    """Wrap a binary output stream in a compressor.
+
+    The compressor does not close `stream`. zstandard and lz4 are
+    optional dependencies and are only imported when used.
+
+    :param stream: binary output stream
+    :param codec: "gz", "zst", or "lz4"
+    :param threads: compression threads (gz, zst) (Default value = 0)
+    :param level: compression level (Default value = codec default)
+    """
+    if codec == "gz":
+        if threads > 0:
+            return pgzip.PGzipWriter(stream, threads=threads, level=level or 6)
+        return gzip.GzipFile(fileobj=stream, mode="wb", compresslevel=level or 9)
+    elif codec == "zst":
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=level or 3, threads=threads)
+        return cctx.stream_writer(stream, closefd=False)
+    elif codec == "lz4":
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(stream, mode="wb", compression_level=level or 0)
+    else:
+        raise ValueError(f"{codec}: unknown compression")
+
+
+payload_types = (bytes, bytearray, memoryview, ustar.LazyPayload)
+
+
+def sample_members(obj, keep_meta=False):
+    """Turn an encoded sample into tar members.
+
+    Values may be `ustar.LazyPayload` handles from a lazy reader; they are
+    copied from their source file when written.
+
+    :param obj: dictionary with a "__key__" and bytes values
+    :param keep_meta: keep fields starting with "_" (Default value = False)
+    :returns: key, list of (name, data) pairs
+    """
+    if "__key__" not in obj:
+        raise ValueError("object must contain a __key__")
+    for k, v in list(obj.items()):
+        if k[0] == "_":
+            continue
+        if not isinstance(v, payload_types):
+            raise ValueError("{} doesn't map to a bytes after encoding ({})".format(k, type(v)))
+    key = obj["__key__"]
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    members = []
+    for k in sorted(obj.keys()):
+        if k == "__key__":
+            continue
+        if not keep_meta and k[0] == "_":
+            continue
+        v = obj[k]
+        if isinstance(v, str):
+            v = v.encode("utf-8")
+        if not isinstance(v, payload_types):
+            raise ValueError("converter didn't yield bytes: %s" % ((k, type(v)),))
+        members.append((str(key + "." + k), v))
+    return key, members
 
 
 class TarWriter1(object):
     """ """
 
-    def __init__(self, fileobj, keep_meta=False, user="bigdata", group="bigdata", mode=0o0444, compress=None, encoder=None, output_mode=None):
+    def __init__(self, fileobj, keep_meta=False, user="bigdata", group="bigdata", mode=0o0444, compress=None, encoder=None, output_mode=None,
+                 engine=None, index=None, threads=0, seekable=False, writebehind=0):
         """A class for writing dictionaries to tar files.
 
-        :param fileobj: fileobj: file name for tar file (.tgz)
+        :param fileobj: fileobj: file name for tar file (.tgz, .tar.zst, .tar.lz4)
         :param bool: keep_meta: keep fields starting with "_"
         :param keep_meta:  (Default value = False)
         :param encoder: sample encoding (Default value = None)
-        :param compress:  (Default value = None)
+        :param compress: True/False for gzip, or "gz", "zst", "lz4" (Default value = None, by extension)
+        :param engine: "native" (ustar templates, one writev per sample) or "tarfile" (Default value = None)
+        :param index: write a sidecar index; True for fileobj + ".idx", or a file name (Default value = None)
+        :param threads: compression threads for gzip and zstd (Default value = 0)
+        :param seekable: zstd and native engine only; write one frame per sample so an index can seek to it (Default value = False)
+        :param writebehind: compress and write on a background thread with a queue of this many chunks (Default value = 0)
+
+        Time spent waiting for the output (and by the background thread
+        waiting for data) is accumulated in `io_stats`.
         """
+        shard = fileobj if isinstance(fileobj, str) else ""
+        if index is True:
+            if shard in ["", "-"]:
+                raise ValueError("index=True requires an output file name")
+            index = indexlib.index_name(shard)
         if isinstance(fileobj, str):
-            if compress is False:
-                tarmode = "w|"
-            elif compress is True:
-                tarmode = "w|gz"
-            else:
-                tarmode = "w|gz" if fileobj.endswith("gz") else "w|"
+            codec = compression_codec(fileobj, compress)
             if fileobj == "-":
                 fileobj = sys.stdout.buffer
             else:
                 fileobj = open(fileobj, "wb")
         else:
-            tarmode = "w|gz" if compress is True else "w|"
+            codec = compression_codec(None, compress)
+        if seekable:
+            if codec != "zst":
+                raise ValueError("seekable output requires zstd compression")
+            import zstandard
+            self.flush_frame = zstandard.FLUSH_FRAME
+        if index is not None and codec is not None and not seekable:
+            raise ValueError("index requires an uncompressed or seekable output")
+        if seekable and writebehind > 0:
+            raise ValueError("seekable output cannot be combined with writebehind")
         self.encoder = lambda x: x if encoder is None else encoder
         self.keep_meta = keep_meta
         self.stream = fileobj
-        self.tarstream = tarfile.open(fileobj=fileobj, mode=tarmode)
+        self.engine = engine or default_engine
+        if seekable and self.engine != "native":
+            # tarfile buffers its output, so frames would not end at sample boundaries
+            raise ValueError("seekable output requires the native engine")
+        self.codec = codec
+        self.seekable = seekable
+        self.zstream = None
+        self.behind = None
+        self.io_stats = {}
+        tarmode = "w|"
+        if codec == "gz" and threads == 0 and self.engine == "tarfile":
+            tarmode = "w|gz"
+        elif codec is not None:
+            self.zstream = open_compressor(fileobj, codec, threads=threads)
+            fileobj = self.zstream
+        if writebehind > 0:
+            self.behind = iothread.WriteBehind(fileobj, depth=writebehind, stats=self.io_stats)
+            fileobj = self.behind
+        if self.engine == "tarfile":
+            self.tarstream = tarfile.open(fileobj=fileobj, mode=tarmode)
+        elif self.engine == "native":
+            self.tarstream = ustar.TarEncoder(fileobj, user=user, group=group, mode=mode)
+        else:
+            raise ValueError(f"{self.engine}: unknown tar engine")
 
         self.user = user
         self.group = group
         self.mode = mode
         self.compress = compress
+        self.index = None
+        if index is not None:
+            self.index = indexlib.IndexWriter(index, shard=os.path.basename(shard), codec=codec if seekable else "")
 
     def __enter__(self):
         return self
@@ -58,6 +204,12 @@ class TarWriter1(object):
     def close(self):
         """Close the tar file."""
         self.tarstream.close()
+        if self.behind is not None:
+            self.behind.close()
+        if self.index is not None:
+            self.index.close()
+        if self.zstream is not None:
+            self.zstream.close()
         if self.stream:
             self.stream.close()
 
@@ -67,46 +219,169 @@ class TarWriter1(object):
         :param obj: dictionary of objects to be stored
         :returns: size of the entry
 
+        """
+        key, members = sample_members(self.encoder(obj), self.keep_meta)
+        offset = self.position()
+        if self.engine == "native":
+            total = self.tarstream.write(members)
+        else:
+            total = self.addfiles(members)
+        if self.seekable:
+            self.zstream.flush(self.flush_frame)
+        if self.index is not None:
+            sizes = [(fname[len(key) + 1:], len(v)) for fname, v in members]
+            self.index.add(key, offset, self.position() - offset, sizes)
+        return total
+
+    def write_raw(self, data):
+        """Write verbatim tar bytes, e.g. from `reader.raw_samples`.
+
+        :param data: complete tar members (headers, payloads, padding)
+        :returns: number of bytes written
+        """
+        if len(data) % ustar.BLOCKSIZE != 0:
+            raise ValueError("raw tar data must be a multiple of the block size")
+        if self.engine == "native":
+            self.tarstream.emit([data])
+        else:
+            self.tarstream.fileobj.write(data)
+        self.tarstream.offset += len(data)
+        if self.seekable:
+            self.zstream.flush(self.flush_frame)
+        return len(data)
+
+    def write_span(self, span, fileobj=None):
+        """Copy a sample span from `reader.sample_spans` verbatim.
+
+        Spans without data are copied from `fileobj`, using `os.sendfile`
+        when the output is an uncompressed file or pipe, so the bytes
+        don't pass through Python.
+
+        :param span: RawSpan
+        :param fileobj: file the span was scanned from (Default value = None)
+        :returns: number of bytes written
+        """
+        if span.data is not None:
+            return self.write_raw(span.data)
+        infd = fileobj.fileno()
+        if self.engine == "native" and self.zstream is None and self.behind is None and hasattr(os, "sendfile"):
+            try:
+                outfd = self.stream.fileno()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                outfd = None
+            if outfd is not None:
+                self.stream.flush()
+                offset, remaining = span.offset, span.length
+                try:
+                    while remaining > 0:
+                        n = os.sendfile(outfd, infd, offset, remaining)
+                        if n == 0:
+                            raise ustar.ReadError("unexpected end of data")
+                        offset += n
+                        remaining -= n
+                    self.tarstream.offset += span.length
+                    return span.length
+                except OSError:
+                    if remaining < span.length:
+                        raise
+                    # sendfile not supported for these files
+        data = os.pread(infd, span.length, span.offset)
+        if len(data) < span.length:
+            raise ustar.ReadError("unexpected end of data")
+        return self.write_raw(data)
+
+    def position(self):
+        """Offset of the next sample in the output; compressed for seekable output."""
+        if self.seekable:
+            return self.zstream.tell()
+        return self.tarstream.offset
+
+    def addfiles(self, members):
+        """Write members through `tarfile`.
+
+        :param members: list of (name, data) pairs
         """
         total = 0
-        obj = self.encoder(obj)
-        if "__key__" not in obj:
-            raise ValueError("object must contain a __key__")
-        for k, v in list(obj.items()):
-            if k[0] == "_":
-                continue
-            if not isinstance(v, bytes):
-                raise ValueError("{} doesn't map to a bytes after encoding ({})".format(k, type(v)))
-        key = obj["__key__"]
-        for k in sorted(obj.keys()):
-            if k == "__key__":
-                continue
-            if not self.keep_meta and k[0] == "_":
-                continue
-            v = obj[k]
-            if isinstance(v, str):
-                v = v.encode("utf-8")
-            if not isinstance(v, (bytes)):
-                raise ValueError("converter didn't yield bytes: %s" % ((k, type(v)),))
-            now = time.time()
-            if isinstance(key, bytes):
-                key = key.decode("utf-8")
-            fname = str(key + "." + k)
+        now = time.time()
+        for fname, v in members:
             ti = tarfile.TarInfo(fname)
             ti.size = len(v)
             ti.mtime = now
             ti.mode = self.mode
             ti.uname = self.user
             ti.gname = self.group
-            # Since, you are writing to file, it should be of type bytes
-            if not isinstance(v, bytes):
-                raise ValueError(str(type(v)))
-            stream = io.BytesIO(v)
+            stream = io.BytesIO(v.read() if isinstance(v, ustar.LazyPayload) else v)
             self.tarstream.addfile(ti, stream)
             total += ti.size
         return total
 
 
+class ThreadedWriter(object):
+    """Run the writes of a TarWriter1 on a background thread.
+
+    Encoding, compression, and output then overlap with the caller. At
+    most `depth` writes are queued. Errors raised on the thread are
+    re-raised by the next `write` or by `close`.
+
+    :param sink: TarWriter1
+    :param depth: maximum number of queued writes (Default value = 100)
+    """
+
+    def __init__(self, sink, depth=100):
+        self.sink = sink
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            method, args = item
+            try:
+                getattr(self.sink, method)(*args)
+            except Exception as exn:
+                self.error = exn
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, obj):
+        """Queue a sample for writing.
+
+        :param obj: dictionary of objects to be stored
+        """
+        self.check()
+        self.queue.put(("write", (obj,)))
+
+    def write_span(self, span, fileobj=None):
+        """Queue a sample span for copying (see `TarWriter1.write_span`).
+
+        :param span: RawSpan
+        :param fileobj: file the span was scanned from (Default value = None)
+        """
+        self.check()
+        self.queue.put(("write_span", (span, fileobj)))
+
+    def close(self):
+        """Finish the queued writes and close the writer."""
+        self.queue.put(None)
+        self.thread.join()
+        self.sink.close()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 zmq_schemes = set("zpush zpull zpub zsub zrpush zrpull zrpub zrsub".split())
 
 
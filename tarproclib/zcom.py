@@ -5,6 +5,7 @@
 # See the LICENSE file for licensing terms (BSD-style).
 #
 
+import collections
 import logging
 import os
 import random
@@ -97,19 +98,117 @@ def urls2list(urls, noexpand=False):
     return urls
 
 
+def pack_batch(samples):
+    """Pack a list of samples into a two part message.
+
+    The first frame is a msgpack header with one `[inline, fields]` entry
+    per sample: `inline` holds the values that are not bytes, `fields`
+    lists `[key, offset, length]` for the bytes values, which are
+    concatenated into the second frame.
+
+    :param samples: list of dicts
+    :returns: list of frames
+    """
+    header = []
+    payloads = []
+    offset = 0
+    for sample in samples:
+        inline, fields = {}, []
+        for k, v in sample.items():
+            if isinstance(v, (bytes, bytearray, memoryview)):
+                fields.append([k, offset, len(v)])
+                payloads.append(v)
+                offset += len(v)
+            else:
+                inline[k] = v
+        header.append([inline, fields])
+    return [msgpack.packb(dict(__batch__=header), use_bin_type=True), b"".join(payloads)]
+
+
+def unpack_message(frames):
+    """Unpack a (single sample or batched) message received with `copy=False`.
+
+    Payloads of batched messages are returned as memoryviews of the
+    received data frame, without copying.
+
+    :param frames: list of zmq.Frame
+    :returns: list of samples
+    """
+    message = msgpack.unpackb(frames[0].buffer, raw=False)
+    if not isinstance(message, dict):
+        raise ValueError(f"{message}: must be dict")
+    if "__batch__" not in message:
+        return [{k.decode("utf-8") if isinstance(k, bytes) else k: v for k, v in message.items()}]
+    data = frames[1].buffer
+    samples = []
+    for inline, fields in message["__batch__"]:
+        for k, offset, length in fields:
+            inline[k] = data[offset:offset + length]
+        samples.append(inline)
+    return samples
+
+
+def ack_message(ping):
+    """Return the acknowledgement for a ping from a `MultiWriter`."""
+    return msgpack.packb(dict(__ACK__=ping["__PING__"], seq=ping["seq"], eof=ping.get("__EOF__", False)))
+
+
+class Batcher(object):
+    """Collect samples until a batch is full or old enough.
+
+    :param batch: maximum samples per batch
+    :param batch_bytes: flush when the payloads reach this size (Default value = 1 MB)
+    :param batch_time: flush when the oldest sample is this many seconds old (Default value = 0.1)
+    """
+
+    def __init__(self, batch, batch_bytes=1 << 20, batch_time=0.1):
+        self.batch = batch
+        self.batch_bytes = batch_bytes
+        self.batch_time = batch_time
+        self.samples = []
+        self.size = 0
+        self.start = 0.0
+
+    def add(self, sample):
+        """Add a sample; returns True if the batch should be sent."""
+        if len(self.samples) == 0:
+            self.start = time.time()
+        self.samples.append(sample)
+        self.size += sum(len(v) for v in sample.values() if isinstance(v, (bytes, bytearray, memoryview)))
+        return (len(self.samples) >= self.batch or self.size >= self.batch_bytes or
+                time.time() - self.start >= self.batch_time)
+
+    def take(self):
+        """Return the collected samples and start a new batch."""
+        samples, self.samples, self.size = self.samples, [], 0
+        return samples
+
+
 class Connection(object):
     """A class for sending/receiving samples via ZMQ sockets."""
 
-    def __init__(self, urls=None, noexpand=False, keep_meta=True, **kw):
+    def __init__(self, urls=None, noexpand=False, keep_meta=True, batch=0, batch_bytes=1 << 20, batch_time=0.1, **kw):
         """Initialize a connection.
 
+        With `batch > 0`, `send` packs up to `batch` samples into one
+        multipart message, a header and the concatenated payloads. Received
+        batches are unpacked without copying; payloads are memoryviews of
+        the message frames. Single-sample messages are always understood.
+        Pings from a `MultiWriter` with `ack` are answered and not returned.
+
         :param urls:  list of ZMQ-URL to connect to (Default value = None)
         :param noexpand: do not expand braces in URLs (Default value = False)
+        :param batch: maximum samples per message (Default value = 0, one message per sample)
+        :param batch_bytes: send a batch when its payloads reach this size (Default value = 1 MB)
+        :param batch_time: send a batch when its oldest sample is this many seconds old (Default value = 0.1)
 
         """
         self.context = zmq.Context()
         self.socket = None
         self.count = 0
+        self.batcher = Batcher(batch, batch_bytes, batch_time) if batch > 0 else None
+        self.received = collections.deque()
+        self.acks = {}
         if urls is not None:
             urls = urls2list(urls, noexpand=noexpand)
             self.socket = zmq_make(self.context, urls[0])
@@ -123,7 +222,10 @@ class Connection(object):
 
     def close(self, linger=-1):
         """Close the connection."""
+        self.flush()
         self.socket.close(linger=linger)
+        for ack in self.acks.values():
+            ack.close()
 
     def send(self, sample):
         """Send data over the connection.
@@ -133,13 +235,23 @@ class Connection(object):
         """
         if not isinstance(sample, dict):
             raise ValueError(f"{sample}: must be dict")
-        data = msgpack.packb(sample)
-        self.socket.send(data)
+        if self.batcher is not None:
+            if self.batcher.add(sample):
+                self.flush()
+        else:
+            data = msgpack.packb(sample)
+            self.socket.send(data)
         if verbose and self.count % 10000 == 0:
             print("# send", self, self.count)
         self.count += 1
 
+    def flush(self):
+        """Send any batched samples."""
+        if self.batcher is not None and len(self.batcher.samples) > 0:
+            self.socket.send_multipart(pack_batch(self.batcher.take()), copy=False)
+
     def send_eof(self):
+        self.flush()
         data = msgpack.packb(dict(__EOF__=True))
         self.socket.send(data)
         time.sleep(1.0)
@@ -149,16 +261,28 @@ class Connection(object):
 
     def recv(self):
         """Receive data from the connection."""
-        data = self.socket.recv()
-        sample = msgpack.unpackb(data)
-        if not isinstance(sample, dict):
-            raise ValueError(f"{sample}: must be dict")
-        data = {k.decode("utf-8") if isinstance(k, bytes) else k: v for k, v in sample.items()}
+        while len(self.received) == 0:
+            for sample in unpack_message(self.socket.recv_multipart(copy=False)):
+                if "__PING__" in sample:
+                    self.acknowledge(sample)
+                    if not sample.get("__EOF__", False):
+                        continue
+                self.received.append(sample)
+        data = self.received.popleft()
         if verbose and self.count % 10000 == 0:
             print("# recv", self, self.count)
         self.count += 1
         return data
 
+    def acknowledge(self, ping):
+        """Answer a ping from a `MultiWriter`."""
+        url = ping["ack"]
+        if url not in self.acks:
+            self.acks[url] = self.context.socket(zmq.PUSH)
+            self.acks[url].setsockopt(zmq.LINGER, 1000)
+            self.acks[url].connect(url)
+        self.acks[url].send(ack_message(ping))
+
     def __iter__(self, report=-1):
         """Receive data through an iterator"""
         count = 0
@@ -180,35 +304,187 @@ class Connection(object):
 
 
 class MultiWriter(object):
-    """A class for sending/receiving samples via ZMQ sockets."""
+    """A class for sending samples to several consumers via ZMQ sockets.
+
+    Output modes are "random", "round_robin", and "least_loaded". In
+    "least_loaded" mode, messages are sent with NOBLOCK to the least
+    loaded consumer whose socket has room below its high-water mark,
+    falling back to the next one.
+
+    If `ack` is given, the writer binds a PULL socket there and sends
+    a small ping after every `ping` samples to each consumer; consumers
+    (`Connection`) answer on that socket with the number of samples they
+    have received. Samples sent but not yet acknowledged are the queue
+    depth of a consumer; a consumer holding `credits` or more
+    unacknowledged samples is not sent more until it catches up, and
+    `send_eof` waits for every consumer to acknowledge the EOF.
+
+    Per-consumer counters are kept in `stats`, a list of dicts with
+    "url", "samples", "messages", "bytes", "acked", and "full" (the
+    number of times the socket was skipped because it was full).
+    """
 
-    def __init__(self, urls=None, noexpand=False, keep_meta=True, linger=-1, output_mode="random", **kw):
+    def __init__(self, urls=None, noexpand=False, keep_meta=True, linger=-1, output_mode="random",
+                 batch=0, batch_bytes=1 << 20, batch_time=0.1,
+                 hwm=None, ack=None, credits=10000, ping=None, eof_timeout=10.0, **kw):
         """Initialize a connection.
 
+        With `batch > 0`, samples are sent in batches as in `Connection`;
+        the output socket is chosen once per batch.
+
         :param urls:  list of ZMQ-URL to connect to (Default value = None)
         :param noexpand: do not expand braces in URLs (Default value = False)
+        :param output_mode: "random", "round_robin", or "least_loaded" (Default value = "random")
+        :param batch: maximum samples per message (Default value = 0, one message per sample)
+        :param batch_bytes: send a batch when its payloads reach this size (Default value = 1 MB)
+        :param batch_time: send a batch when its oldest sample is this many seconds old (Default value = 0.1)
+        :param hwm: ZMQ send high-water mark in messages per socket (Default value = None, ZMQ default)
+        :param ack: ZMQ address for acknowledgements from consumers, reachable by them (Default value = None)
+        :param credits: maximum unacknowledged samples per consumer (Default value = 10000)
+        :param ping: samples between pings (Default value = credits // 4)
+        :param eof_timeout: seconds to wait for EOF acknowledgements (Default value = 10.0)
 
         """
+        if output_mode not in ["random", "round_robin", "least_loaded"]:
+            raise ValueError(f"{output_mode}: unknown MultiWriter mode")
         self.context = zmq.Context()
         self.sockets = None
         self.linger = linger
         self.output_mode = output_mode
         self.count = 0
+        self.messages = 0
+        self.batcher = Batcher(batch, batch_bytes, batch_time) if batch > 0 else None
+        self.hwm = hwm
+        self.credits = credits
+        self.ping = ping or max(1, credits // 4)
+        self.eof_timeout = eof_timeout
+        self.wait_time = 0.0
+        self.ack_url = ack
+        self.ack = None
+        if ack is not None:
+            self.ack = self.context.socket(zmq.PULL)
+            self.ack.setsockopt(zmq.LINGER, 0)
+            self.ack.bind(ack)
         if urls is not None:
             self.connect(urls, noexpand=False)
 
     def connect(self, urls, topic="", noexpand=False):
         urls = urls2list(urls, noexpand=noexpand)
         self.sockets = []
+        self.stats = []
+        self.pinged = []
         for url in urls:
             s = zmq_make(self.context, url, linger=self.linger)
+            if self.hwm is not None:
+                s.setsockopt(zmq.SNDHWM, self.hwm)
             zmq_connect(s, [url])
             self.sockets.append(s)
+            self.stats.append(dict(url=url, samples=0, messages=0, bytes=0, acked=0, full=0))
+            self.pinged.append(0)
 
     def close(self, linger=-1):
         """Close the connection."""
+        self.flush()
         for s in self.sockets:
             s.close(linger=linger)
+        if self.ack is not None:
+            self.ack.close()
+
+    def depth(self, index):
+        """Samples sent to a consumer but not acknowledged (requires `ack`)."""
+        return self.stats[index]["samples"] - self.stats[index]["acked"]
+
+    def receive_acks(self, timeout=0):
+        """Process acknowledgements, waiting up to `timeout` ms for the first."""
+        while self.ack.poll(timeout):
+            message = msgpack.unpackb(self.ack.recv(), raw=False)
+            stats = self.stats[message["__ACK__"]]
+            stats["acked"] = max(stats["acked"], message["seq"])
+            if message.get("eof", False):
+                stats["eof"] = True
+            timeout = 0
+
+    def send_pending_pings(self):
+        """Ping consumers without credits that have unpinged samples.
+
+        Pings are sent with NOBLOCK and dropped if the socket is full; a
+        consumer without credits is not sent to again, so without this it
+        would never be pinged, never acknowledge, and never get credits back.
+        """
+        for i in range(len(self.sockets)):
+            if self.depth(i) >= self.credits and self.pinged[i] < self.stats[i]["samples"]:
+                self.send_ping(i)
+
+    def wait_writable(self, order):
+        """Wait until one of the `order` sockets can accept a message or an ack arrives.
+
+        When no consumer has credits left, `order` is empty and only the ack
+        socket is polled; acknowledgements are the only way to make progress,
+        so pending pings are sent first.
+
+        :param order: indexes of the consumers that may be sent to
+        """
+        start = time.time()
+        if self.ack is not None:
+            self.send_pending_pings()
+        poller = zmq.Poller()
+        for i in order:
+            poller.register(self.sockets[i], zmq.POLLOUT)
+        if self.ack is not None:
+            poller.register(self.ack, zmq.POLLIN)
+        poller.poll(100)
+        self.wait_time += time.time() - start
+
+    def candidates(self):
+        """Consumer indexes in the order they should be tried."""
+        n = len(self.sockets)
+        if self.output_mode == "round_robin":
+            return [self.messages % n]
+        elif self.output_mode == "random":
+            return [random.randint(0, n - 1)]
+        if self.ack is None:
+            start = self.messages % n
+            return [(start + i) % n for i in range(n)]
+        self.receive_acks()
+        order = sorted(range(n), key=self.depth)
+        return [i for i in order if self.depth(i) < self.credits]
+
+    def dispatch(self, frames, nsamples, nbytes):
+        """Send a message to the consumer chosen by the output mode."""
+        while True:
+            order = self.candidates()
+            if self.output_mode != "least_loaded":
+                index = order[0]
+                self.sockets[index].send_multipart(frames, copy=False)
+                break
+            index = None
+            for i in order:
+                try:
+                    self.sockets[i].send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
+                    index = i
+                    break
+                except zmq.Again:
+                    self.stats[i]["full"] += 1
+            if index is not None:
+                break
+            self.wait_writable(order)
+        self.messages += 1
+        stats = self.stats[index]
+        stats["messages"] += 1
+        stats["samples"] += nsamples
+        stats["bytes"] += nbytes
+        if self.ack is not None and stats["samples"] - self.pinged[index] >= self.ping:
+            self.send_ping(index)
+
+    def send_ping(self, index, eof=False, flags=zmq.NOBLOCK):
+        message = dict(__PING__=index, seq=self.stats[index]["samples"], ack=self.ack_url)
+        if eof:
+            message["__EOF__"] = True
+        try:
+            self.sockets[index].send(msgpack.packb(message), flags=flags)
+            self.pinged[index] = self.stats[index]["samples"]
+        except zmq.Again:
+            pass
 
     def send(self, sample):
         """Send data over the connection.
@@ -218,23 +494,45 @@ class MultiWriter(object):
         """
         if not isinstance(sample, dict):
             raise ValueError(f"{sample}: must be dict")
-        data = msgpack.packb(sample)
-        if self.output_mode == "round_robin":
-            index = self.count % len(self.sockets)
-        elif self.output_mode == "random":
-            index = random.randint(0, len(self.sockets) - 1)
+        if self.batcher is not None:
+            if self.batcher.add(sample):
+                self.flush()
         else:
-            raise ValueError(f"{self.output_mode}: unknown MultiWriter mode")
-        self.sockets[index].send(data)
+            data = msgpack.packb(sample)
+            self.dispatch([data], 1, len(data))
         if verbose and self.count % 10000 == 0:
             print("# send", self, self.count)
         self.count += 1
 
+    def flush(self):
+        """Send any batched samples."""
+        if self.batcher is not None and len(self.batcher.samples) > 0:
+            nbytes = self.batcher.size
+            samples = self.batcher.take()
+            self.dispatch(pack_batch(samples), len(samples), nbytes)
+
     def send_eof(self):
-        data = msgpack.packb(dict(__EOF__=True))
-        for s in self.sockets:
-            s.send(data)
-        time.sleep(1.0)
+        """Send EOF to all consumers.
+
+        With `ack`, wait until every consumer has acknowledged it; returns
+        False if that takes longer than `eof_timeout`.
+        """
+        self.flush()
+        if self.ack is None:
+            data = msgpack.packb(dict(__EOF__=True))
+            for s in self.sockets:
+                s.send(data)
+            return True
+        for i in range(len(self.sockets)):
+            self.send_ping(i, eof=True, flags=0)
+        deadline = time.time() + self.eof_timeout
+        while not all(stats.get("eof", False) for stats in self.stats):
+            if time.time() > deadline:
+                missing = [stats["url"] for stats in self.stats if not stats.get("eof", False)]
+                print(f"# no EOF acknowledgement from {missing}", file=sys.stderr)
+                return False
+            self.receive_acks(100)
+        return True
 
     def write(self, sample):
         self.send(sample)
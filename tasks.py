@@ -15,7 +15,7 @@ TEMP = "tarproc.yaml tarproc.yml"
 DOCKER = "tarproctest"
 
 commands = (
-    "tar2tsv tarcats tarfirst tarmix tarpcat tarproc tarshow tarsort tarsplit tsv2tar"
+    "tar2tsv tarcats tarfirst tarmix tarpcat tarproc tarshow tarsort tarsplit tsv2tar taridx tarshuffle tarstats"
 ).split()
 
 
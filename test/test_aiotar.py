@@ -0,0 +1,122 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import asyncio
+import io
+import subprocess
+
+import pytest
+
+from tarproclib import aiotar, reader, ustar, writer
+
+samples = [
+    dict(__key__="a", txt=b"hello", jpg=bytes(range(256)) * 3),
+    dict(__key__="dir/" + "x" * 200, txt=b"long name"),
+    dict(__key__="c", txt=b"view", cls=b""),
+]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def collect(source):
+    return [sample async for sample in source]
+
+
+def strip(result):
+    return [{k: v for k, v in sample.items() if k != "__source__"} for sample in result]
+
+
+def test_parser_matches_scanner(tmpdir):
+    fname = str(tmpdir.join("out.tar"))
+    with writer.TarWriter(fname) as sink:
+        for sample in samples:
+            sink.write(sample)
+    with open(fname, "rb") as stream:
+        data = stream.read()
+    expected = list(ustar.TarScanner(io.BytesIO(data)))
+    for chunk in [1, 100, 512, 1000, len(data)]:
+        parser = ustar.TarParser()
+        result = []
+        for i in range(0, len(data), chunk):
+            result += parser.feed(data[i:i + chunk])
+        parser.close()
+        assert result == expected
+    parser = ustar.TarParser()
+    parser.feed(data[:700])
+    with pytest.raises(ustar.ReadError):
+        parser.close()
+
+
+@pytest.mark.parametrize("ext", ["tar", "tgz", "tar.zst", "tar.lz4"])
+def test_async_roundtrip(tmpdir, ext):
+    if ext.endswith("zst"):
+        pytest.importorskip("zstandard")
+    if ext.endswith("lz4"):
+        pytest.importorskip("lz4")
+    fname = str(tmpdir.join("out." + ext))
+
+    async def write():
+        async with aiotar.AsyncTarWriter(fname, chunksize=100) as sink:
+            for sample in samples:
+                await sink.write(sample)
+
+    run(write())
+    with open(fname, "rb") as stream:
+        assert strip(reader.tariterator(stream)) == samples
+    assert strip(run(collect(aiotar.AsyncTarIterator(fname, chunksize=1000)))) == samples
+    assert strip(run(collect(aiotar.AsyncTarIterator("pipe:cat " + fname)))) == samples
+
+
+def test_async_pipe_writer(tmpdir):
+    fname = str(tmpdir.join("out.tar"))
+
+    async def write():
+        async with aiotar.AsyncTarWriter(f"pipe:cat > {fname}") as sink:
+            for sample in samples:
+                await sink.write(sample)
+
+    run(write())
+    with open(fname, "rb") as stream:
+        assert strip(reader.tariterator(stream)) == samples
+
+
+def test_async_interleave(tmpdir):
+    for i in range(5):
+        with writer.TarWriter(str(tmpdir.join(f"s{i}.tar"))) as sink:
+            for j in range(20):
+                sink.write(dict(__key__=f"{i}-{j:02d}", txt=b"x" * j))
+    url = str(tmpdir.join("s{0..4}.tar"))
+    result = run(collect(aiotar.AsyncTarIterator(url, interleave=3, bufsize=4)))
+    assert sorted(s["__key__"] for s in result) == sorted(f"{i}-{j:02d}" for i in range(5) for j in range(20))
+    result = run(collect(aiotar.AsyncTarIterator(url + "#10,29")))
+    assert [s["__key__"] for s in result] == [f"{i}-{j:02d}" for i in range(5) for j in range(20)][10:30]
+    with pytest.raises(subprocess.CalledProcessError):
+        run(collect(aiotar.AsyncTarIterator("pipe:false")))
+
+
+def test_async_zmq(tmpdir):
+    url = "ipc://" + str(tmpdir.join("socket"))
+
+    async def main():
+        receiver = aiotar.AsyncTarIterator("zpull+" + url)
+        sender = aiotar.AsyncTarWriter("zpush+" + url, batch=2)
+
+        async def send():
+            for sample in samples:
+                await sender.write(sample)
+            await sender.send_eof()
+
+        task = asyncio.ensure_future(send())
+        result = await collect(receiver)
+        await task
+        await sender.close()
+        await receiver.close()
+        return result
+
+    result = run(main())
+    assert [{k: bytes(v) if isinstance(v, memoryview) else v for k, v in s.items()} for s in result] == samples
@@ -44,6 +44,18 @@ def test_tarcats_2(tmpdir):
     run(f"(echo d; echo e; echo f) | {PY}lines2tar > {tmpdir}/tar2.tar")
     run(f"{PY}tarcats {tmpdir}/tar1.tar {tmpdir}/tar2.tar > {tmpdir}/tar12.tar")
     run(f"{PY}tar2json -k txt < {tmpdir}/tar12.tar", "txt: a", "txt: e")
+    run(f"tar tf {tmpdir}/tar12.tar", "000000.txt", "000000.__source__")
+    run(f"cat {tmpdir}/tar1.tar | {PY}tarcats -s 1 -c 2 | tar tf -", "000001.txt")
+    run(f"{PY}tarcats --shuffle 2 {tmpdir}/tar1.tar | tar tf - | wc -l", "6")
+
+
+def test_tarpcat(tmpdir):
+    for i in range(4):
+        run(f"(for i in $(seq 1 10); do echo {i}$i; done) | {PY}lines2tar > {tmpdir}/tar{i}.tar")
+    run(f"{PY}tarpcat -p 2 {tmpdir}/tar[0-3].tar -o {tmpdir}/out.tar")
+    run(f"tar tf {tmpdir}/out.tar | grep -c txt", "^40$")
+    run(f"{PY}tarpcat -p 2 -c 5 {tmpdir}/tar[0-3].tar -o {tmpdir}/out.tar")
+    run(f"tar tf {tmpdir}/out.tar | grep -c txt", "^5$")
 
 
 def test_tarproc(tmpdir):
@@ -57,6 +69,20 @@ def test_tarproc_2():
     run(f"{PY}tar2json -k x.txt < {tmpdir}/tar2.tar", 'x.txt: a')
 
 
+def test_tarproc_3(tmpdir):
+    run(f"(for i in $(seq 1 50); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarproc -p 4 -c 'cp sample.txt sample.x.txt' {tmpdir}/tar1.tar -o {tmpdir}/tar2.tar")
+    run(f"{PY}tar2json -k x.txt < {tmpdir}/tar2.tar | grep -c x.txt", "^50$")
+    run(f"{PY}tarproc -p 4 --ordered --count 20 -c 'cp sample.txt sample.x.txt' {tmpdir}/tar1.tar -o {tmpdir}/tar3.tar")
+    run(f"{PY}tar2json -k x.txt < {tmpdir}/tar3.tar | grep x.txt | tr -d '\\n'", "^" + "".join(f"x.txt: '?{i}'?" for i in range(1, 21)) + "$")
+
+
+def test_tarproc_coprocess(tmpdir):
+    run(f"(echo a; echo b; echo c) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarproc --coprocess -s testdata/upper.py -p 2 {tmpdir}/tar1.tar -o {tmpdir}/tar2.tar")
+    run(f"{PY}tar2json -k x.txt < {tmpdir}/tar2.tar", "x.txt: B")
+
+
 def test_tarshow(tmpdir):
     run(f"{PY}tarshow --help", "Show data inside")
 
@@ -72,7 +98,73 @@ def test_tarsort(tmpdir):
     run(f"(echo c; echo b; echo a) | {PY}lines2tar > {tmpdir}/tar1.tar")
     run(f"{PY}tarsort {tmpdir}/tar1.tar -o {tmpdir}/tar2.tar -s txt")
     run(f"{PY}tar2json -k txt < {tmpdir}/tar2.tar", 'txt: a')
-    # TODO check for actually sorted
+    run(f"{PY}tar2json -f jsonlines -k txt < {tmpdir}/tar2.tar", '"a"}\n.*"b"}\n.*"c"}')
+    run(f"{PY}tarsort -M 1000 {tmpdir}/tar1.tar -o {tmpdir}/tar3.tar -s txt")
+    run(f"cmp {tmpdir}/tar2.tar {tmpdir}/tar3.tar")
+    run(f"(echo f; echo e; echo d) | {PY}lines2tar > {tmpdir}/tar4.tar")
+    run(f"{PY}tarsort '{tmpdir}/tar{{1,4}}.tar' -o {tmpdir}/tar5.tar -s txt")
+    run(f"{PY}tar2json -f jsonlines -k txt < {tmpdir}/tar5.tar", '"a"}\n(.*\n){2}.*"d"}\n(.*\n)*.*"f"}')
 
 def test_tarsplit(tmpdir):
     run(f"{PY}tarsplit --help", "Split a tar")
+
+
+def test_taridx(tmpdir):
+    run(f"{PY}taridx --help", "Build index files")
+    run(f"(echo a; echo b; echo c) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}taridx {tmpdir}/tar1.tar")
+    run(f"cat {tmpdir}/tar1.tar.idx", "000002\t2048\t1024\ttxt=1")
+
+
+def test_tarsplit_2(tmpdir):
+    run(f"(echo a; echo b; echo c) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit -n 2 -z -o {tmpdir}/split {tmpdir}/tar1.tar")
+    run(f"{PY}tar2json -k txt < {tmpdir}/split-000001.tgz", "txt: c")
+    run(f"{PY}tarsplit -n 2 -o {tmpdir}/split {tmpdir}/tar1.tar")
+    run(f"tar tf {tmpdir}/split-000000.tar", "000000.txt", "000001.txt")
+    run(f"{PY}tar2json -k txt < {tmpdir}/split-000001.tar", "txt: c")
+
+
+def test_tarsplit_size(tmpdir):
+    run(f"(for i in $(seq 200); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit -s 1000 -o {tmpdir}/raw {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit -s 1000 --decode -o {tmpdir}/dec {tmpdir}/tar1.tar")
+    run(f"ls {tmpdir}/raw-*.tar | wc -l", "^5\n")
+    run(f"ls {tmpdir}/dec-*.tar | wc -l", "^5\n")
+    run(f"cmp <(tar tf {tmpdir}/raw-000001.tar) <(tar tf {tmpdir}/dec-000001.tar) && echo same", "same")
+
+    run(f"(for i in $(seq 100); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit -P 3 -n 10 -z -o {tmpdir}/split -C 'gzip -t {{shard}}' --nodelete {tmpdir}/tar1.tar")
+    run(f"ls {tmpdir}/split-*.tgz | wc -l", "10")
+    run(f"{PY}tar2json -k txt < {tmpdir}/split-000009.tgz", "txt: '?100")
+    run(f"{PY}tarsplit -P 2 -n 50 -o {tmpdir}/fail -C false {tmpdir}/tar1.tar 2>&1 || echo status $?",
+        "2 shard.s. failed", "status 1")
+
+
+def test_tarsplit_partition(tmpdir):
+    run(f"(for i in $(seq 100); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit --partition hash -N 3 -o {tmpdir}/hash {tmpdir}/tar1.tar")
+    run(f"{PY}tarsplit --partition hash -N 3 --decode -o {tmpdir}/hash2 {tmpdir}/tar1.tar")
+    run(f"cmp <(tar tf {tmpdir}/hash-000001.tar) <(tar tf {tmpdir}/hash2-000001.tar) && echo same", "same")
+    run(f"cat {tmpdir}/hash-00000[0-2].tar | tar tif - | wc -l", "100")
+    run(f"{PY}tarsplit --partition balanced -N 4 -P 2 -o {tmpdir}/bal {tmpdir}/tar1.tar 2>&1", "bal-000003.tar 25 samples")
+    # samples of different sizes land on the same shards with and without --decode
+    run(f"(for i in $(seq 100); do printf '%0*d\\n' $((i * 37 % 900)) $i; done) | {PY}lines2tar > {tmpdir}/tar2.tar")
+    run(f"{PY}tarsplit --partition balanced -N 4 -o {tmpdir}/bal2 {tmpdir}/tar2.tar")
+    run(f"{PY}tarsplit --partition balanced -N 4 --decode -o {tmpdir}/bal3 {tmpdir}/tar2.tar")
+    run(f"cmp <(tar tf {tmpdir}/bal2-000002.tar) <(tar tf {tmpdir}/bal3-000002.tar) && echo same", "same")
+
+
+def test_tarshuffle(tmpdir):
+    run(f"{PY}tarshuffle --help", "Shuffle tar files")
+    run(f"(for i in $(seq 100); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarshuffle -b 10 --seed 0 -t {tmpdir} {tmpdir}/tar1.tar -o {tmpdir}/tar2.tar")
+    run(f"{PY}tar2json -f jsonlines -k txt < {tmpdir}/tar2.tar | sort | uniq | wc -l", "100")
+    run(f"{PY}tarcats --shuffle 10 --shuffle-dir {tmpdir} {tmpdir}/tar1.tar | tar tf - | wc -l", "200")
+    run(f"{PY}tarcats --lazy --shuffle 10 --shuffle-dir {tmpdir} {tmpdir}/tar1.tar | tar tf - | wc -l", "200")
+
+
+def test_tarstats(tmpdir):
+    run(f"{PY}tarstats --help", "Report sample counts")
+    run(f"(for i in $(seq 1 20); do echo $i; done) | {PY}lines2tar > {tmpdir}/tar1.tar")
+    run(f"{PY}tarstats -s -g {tmpdir}/tar1.tar {tmpdir}/tar1.tar", "samples 40 ", "duplicates 20 ", "txt +40 +0 ")
@@ -0,0 +1,44 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import pytest
+
+from tarproclib import coproc, parallel
+
+script = """
+def process(sample):
+    if sample["__key__"] == "bad":
+        raise ValueError("bad sample")
+    if sample["__key__"] == "none":
+        return None
+    sample["y"] = sample["x"] * 2
+    return sample
+"""
+
+
+def test_coprocess(tmpdir):
+    fname = str(tmpdir.join("script.py"))
+    with open(fname, "w") as stream:
+        stream.write(script)
+    proc = coproc.Coprocess(fname)
+    assert proc(dict(__key__="a", x=b"ab")) == [dict(__key__="a", x=b"ab", y=b"abab")]
+    assert proc(dict(__key__="none", x=b"")) == []
+    with pytest.raises(coproc.CoprocessError, match="bad sample"):
+        proc(dict(__key__="bad", x=b""))
+    assert proc(dict(__key__="b", x=b"c"))[0]["y"] == b"cc"
+    assert proc.close() == 0
+
+
+def test_coprocesses(tmpdir):
+    fname = str(tmpdir.join("script.py"))
+    with open(fname, "w") as stream:
+        stream.write(script)
+    procs = coproc.Coprocesses(fname)
+    samples = [dict(__key__=str(i), x=b"%d" % i) for i in range(100)]
+    results = [r[0]["y"] for r in parallel.imap(procs, samples, workers=3)]
+    assert len(procs.procs) <= 3
+    procs.close()
+    assert sorted(results) == sorted(b"%d%d" % (i, i) for i in range(100))
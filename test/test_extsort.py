@@ -0,0 +1,52 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import random
+
+import pytest
+
+from tarproclib import extsort
+
+
+@pytest.mark.parametrize("run_size,workers", [(1e9, 0), (100, 0), (100, 2)])
+def test_sorted(tmpdir, run_size, workers):
+    keys = list(range(200))
+    random.shuffle(keys)
+    with extsort.ExternalSorter(run_size=run_size, tempdir=str(tmpdir), workers=workers) as sorter:
+        for k in keys:
+            sorter.add(k, b"%d" % k)
+        result = [(k, bytes(data)) for k, data in sorter]
+    assert result == [(k, b"%d" % k) for k in range(200)]
+
+
+def test_backpressure(tmpdir, monkeypatch):
+    import time
+    write_run = extsort.write_run
+
+    def slow_write_run(*args):
+        time.sleep(0.01)
+        return write_run(*args)
+
+    monkeypatch.setattr(extsort, "write_run", slow_write_run)
+    peak = 0
+    with extsort.ExternalSorter(run_size=10, tempdir=str(tmpdir), workers=2) as sorter:
+        for k in range(50):
+            sorter.add(k, b"x" * 10)
+            peak = max(peak, sum(not future.done() for _, future in sorter.runs))
+        assert [k for k, _ in sorter] == list(range(50))
+    assert peak <= 2
+
+
+def test_duplicates(tmpdir):
+    with extsort.ExternalSorter(run_size=10, tempdir=str(tmpdir), duplicates="replace") as sorter:
+        for i, k in enumerate("bab"):
+            sorter.add(k, b"%d" % i)
+        assert [(k, bytes(d)) for k, d in sorter] == [("a", b"1"), ("b", b"2")]
+    with extsort.ExternalSorter(tempdir=str(tmpdir), duplicates="error") as sorter:
+        sorter.add("a", b"")
+        sorter.add("a", b"")
+        with pytest.raises(ValueError):
+            list(sorter)
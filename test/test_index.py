@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import pytest
+
+from tarproclib import index, reader, writer
+
+
+def make_shard(fname, n=10, **kw):
+    with writer.TarWriter(fname, **kw) as sink:
+        for i in range(n):
+            sink.write(dict(__key__="%03d" % i, txt=b"x" * i, cls=b"%d" % i))
+
+
+@pytest.mark.parametrize("engine", ["native", "tarfile"])
+def test_writer_index_matches_build_index(tmpdir, engine):
+    fname = f"{tmpdir}/shard.tar"
+    make_shard(fname, index=True, engine=engine)
+    _, written = index.read_index(fname + ".idx")
+    assert index.build_index(fname, output=f"{tmpdir}/rebuilt.idx") == 10
+    _, rebuilt = index.read_index(f"{tmpdir}/rebuilt.idx")
+    assert written == rebuilt
+    assert written[3].sizes == dict(cls=1, txt=3)
+
+
+def test_indexed_shard(tmpdir):
+    fname = f"{tmpdir}/shard.tar"
+    make_shard(fname, index=True)
+    with index.IndexedShard(fname) as shard:
+        assert len(shard) == 10
+        assert shard[7]["txt"] == b"x" * 7
+        assert shard.get("004")["cls"] == b"4"
+        assert shard.get("missing") is None
+
+
+def test_iterator_seeks_with_index(tmpdir):
+    make_shard(f"{tmpdir}/shard-0.tar", index=True)
+    make_shard(f"{tmpdir}/shard-1.tar", index=True)
+    keys = [s["__key__"] for s in reader.TarIterator(f"{tmpdir}/shard-{{0..1}}.tar#13,15")]
+    assert keys == ["003", "004", "005"]
+
+
+def test_scan_samples_skips_payloads(tmpdir):
+    import io
+
+    class CountingBytesIO(io.BytesIO):
+        count = 0
+
+        def read(self, size=-1):
+            data = super().read(size)
+            self.count += len(data)
+            return data
+
+    fname = f"{tmpdir}/shard.tar"
+    with writer.TarWriter(fname) as sink:
+        for i in range(10):
+            sink.write(dict(__key__="%03d" % i, jpg=bytes(100000)))
+    with open(fname, "rb") as stream:
+        data = stream.read()
+    stream = CountingBytesIO(data)
+    entries = list(index.scan_samples(stream))
+    assert [entry.sizes for entry in entries] == [[("jpg", 100000)]] * 10
+    assert stream.count < len(data) // 10
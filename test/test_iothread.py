@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import io
+
+import pytest
+
+from tarproclib import iothread
+
+data = bytes(range(256)) * 4000
+
+
+def test_readahead():
+    stream = iothread.ReadAhead(io.BytesIO(data), depth=2, chunksize=1000)
+    assert stream.read(10) == data[:10]
+    buf = bytearray(5000)
+    n = stream.readinto(buf)
+    assert 0 < n <= 990 and buf[:n] == data[10:10 + n]
+    assert stream.read() == data[10 + n:]
+    assert stream.read(10) == b""
+    assert stream.stats["bytes"] == len(data)
+    stream.close()
+
+
+def test_readahead_early_close():
+    stream = iothread.ReadAhead(io.BytesIO(data), depth=1, chunksize=100)
+    assert stream.read(5) == data[:5]
+    stream.close()
+    stream.thread.join(5.0)
+    assert not stream.thread.is_alive()
+
+
+class Broken(io.RawIOBase):
+    def writable(self):
+        return True
+
+    def write(self, data):
+        raise OSError("broken")
+
+
+def test_writebehind():
+    output = io.BytesIO()
+    stream = iothread.WriteBehind(output, depth=2, chunksize=1000)
+    for i in range(0, len(data), 777):
+        stream.write(data[i:i + 777])
+    stream.flush()
+    assert output.getvalue() == data
+    stream.write(b"end")
+    stream.close()
+    assert output.getvalue() == data + b"end"
+    with pytest.raises(OSError):
+        stream = iothread.WriteBehind(Broken())
+        stream.write(b"x")
+        stream.close()
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import pytest
+
+from tarproclib import mpreader, ustar, writer
+
+
+def make_shards(tmpdir, n=5, size=100):
+    urls = []
+    for i in range(n):
+        fname = f"{tmpdir}/shard-{i}.tar"
+        with writer.TarWriter(fname) as sink:
+            for j in range(size):
+                sink.write(dict(__key__="%d-%03d" % (i, j), txt=b"x" * j))
+        urls.append(fname)
+    return urls
+
+
+def test_all_shards(tmpdir):
+    urls = make_shards(tmpdir)
+    # more shards than workers, and slots smaller than some samples
+    source = mpreader.ParallelReader(urls, workers=2, slotsize=4096)
+    samples = list(source)
+    assert sorted(s["__key__"] for s in samples) == sorted("%d-%03d" % (i, j) for i in range(5) for j in range(100))
+    assert all(s["txt"] == b"x" * int(s["__key__"][2:]) for s in samples)
+    assert source.stats["shards"] == 5
+    assert source.jobs == []
+
+
+def test_early_stop(tmpdir):
+    urls = make_shards(tmpdir)
+    source = mpreader.ParallelReader(urls, workers=3, slots=2, slotsize=2048)
+    for i, sample in enumerate(source):
+        if i == 10:
+            break
+    source.close()
+    assert source.jobs == []
+
+
+def test_missing(tmpdir):
+    urls = make_shards(tmpdir, n=2) + [f"{tmpdir}/missing.tar"]
+    with pytest.raises(ustar.ReadError):
+        list(mpreader.ParallelReader(urls, workers=2))
+    source = mpreader.ParallelReader(urls, workers=2, allow_missing=True)
+    assert len(list(source)) == 200
+    assert source.stats["errors"] == 1
+
+
+def test_more_workers_than_shards(tmpdir):
+    urls = make_shards(tmpdir, n=1, size=10)
+    source = mpreader.ParallelReader(urls, workers=4)
+    assert len(list(source)) == 10
+    assert source.stats["shards"] == 1
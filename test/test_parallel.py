@@ -0,0 +1,72 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import os
+import threading
+import time
+
+import pytest
+
+from tarproclib import parallel
+
+
+def test_imap_bounded():
+    lock = threading.Lock()
+    state = dict(active=0, peak=0, read=0)
+
+    def source():
+        for i in range(100):
+            state["read"] += 1
+            yield i
+
+    def f(x):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.001)
+        with lock:
+            state["active"] -= 1
+        return x * x
+
+    results = parallel.imap(f, source(), workers=4, inflight=6)
+    first = next(results)
+    assert state["read"] <= 6
+    assert sorted([first] + list(results)) == [i * i for i in range(100)]
+    assert state["peak"] <= 4
+
+
+def test_imap_ordered():
+    def f(x):
+        time.sleep(0.02 if x % 10 == 0 else 0.0)
+        return x
+
+    stats = {}
+    result = list(parallel.imap(f, range(50), workers=4, inflight=4, ordered=True, stats=stats))
+    assert result == list(range(50))
+    assert stats["submitted"] == stats["yielded"] == 50
+    assert stats["stalls"] > 0
+
+
+def test_imap_error():
+    def f(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+
+    with pytest.raises(ValueError):
+        list(parallel.imap(f, range(10), workers=2))
+
+
+def test_workerdirs(tmpdir):
+    dirs = parallel.WorkerDirs(os.path.join(str(tmpdir), "work"))
+    a = dirs.get()
+    with open(os.path.join(a, "x"), "w") as stream:
+        stream.write("x")
+    os.mkdir(os.path.join(a, "sub"))
+    assert dirs.get() == a
+    assert os.listdir(a) == []
+    dirs.close()
+    assert not os.path.exists(dirs.root)
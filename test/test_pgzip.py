@@ -0,0 +1,43 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import gzip
+import io
+import os
+
+from tarproclib import gopen, pgzip, reader, writer
+
+data = (os.urandom(1000) + b"abc" * 1000) * 300
+
+
+def test_writer_output_is_gzip():
+    stream = io.BytesIO()
+    with pgzip.PGzipWriter(stream, threads=3, batchsize=100000) as sink:
+        sink.write(data[:12345])
+        sink.write(data[12345:])
+    assert gzip.decompress(stream.getvalue()) == data
+
+
+def test_reader_bgzf_and_plain():
+    stream = io.BytesIO()
+    with pgzip.PGzipWriter(stream, threads=2) as sink:
+        sink.write(data)
+    compressed = stream.getvalue()
+    assert pgzip.PGzipReader(io.BytesIO(compressed), threads=3, batchsize=50000).read() == data
+    plain = gzip.compress(data) + gzip.compress(b"tail")
+    assert pgzip.PGzipReader(io.BytesIO(plain), threads=3, batchsize=50000).read() == data + b"tail"
+
+
+def test_tar_roundtrip(tmpdir):
+    fname = f"{tmpdir}/shard.tgz"
+    with writer.TarWriter(fname, threads=4) as sink:
+        for i in range(100):
+            sink.write(dict(__key__="%03d" % i, txt=data[:i * 100]))
+    samples = list(reader.TarIterator(fname, threads=4))
+    assert len(samples) == 100
+    assert samples[50]["txt"] == data[:5000]
+    with gopen.gopen(fname, "rb", threads=2) as stream:
+        assert len(list(reader.tariterator(stream))) == 100
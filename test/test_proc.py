@@ -0,0 +1,59 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import os
+
+from tarproclib import proc
+
+
+def samples(n):
+    return (dict(__key__="%04d" % i, txt=b"x" * i) for i in range(n))
+
+
+def test_dshuffle(tmpdir):
+    result = list(proc.dshuffle(samples(1000), bufsize=100, tempdir=str(tmpdir), segsize=5000, seed=0))
+    assert sorted(s["__key__"] for s in result) == ["%04d" % i for i in range(1000)]
+    assert [s["__key__"] for s in result] != ["%04d" % i for i in range(1000)]
+    assert result[0]["txt"] == b"x" * int(result[0]["__key__"])
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_dshuffle_seed(tmpdir):
+    a = [s["__key__"] for s in proc.dshuffle(samples(300), bufsize=50, tempdir=str(tmpdir), seed=3)]
+    b = [s["__key__"] for s in proc.dshuffle(samples(300), bufsize=50, tempdir=str(tmpdir), seed=3)]
+    assert a == b
+
+
+def test_dshuffle_small_buffer(tmpdir):
+    for bufsize in [0, 1]:
+        result = [s["__key__"] for s in proc.dshuffle(samples(10), bufsize=bufsize, tempdir=str(tmpdir))]
+        assert result == ["%04d" % i for i in range(10)]
+
+
+def test_dshuffle_lazy(tmpdir):
+    from tarproclib import reader, writer
+    fname = str(tmpdir.join("data.tar"))
+    with writer.TarWriter(fname) as sink:
+        for sample in samples(100):
+            sink.write(sample)
+    spill = str(tmpdir.mkdir("spill"))
+    with open(fname, "rb") as stream:
+        result = list(proc.dshuffle(reader.tariterator(stream, lazy=True), bufsize=10, tempdir=spill, seed=0))
+    assert sorted((s["__key__"], s["txt"]) for s in result) == sorted((s["__key__"], s["txt"]) for s in samples(100))
+
+    for n in [0, 1, 7, 99, 100, 101, 2001]:
+        result = list(proc.ishuffle(range(n), bufsize=100, initial=10))
+        assert sorted(result) == list(range(n))
+
+
+def test_ishuffle_seed():
+    import numpy as np
+    a = list(proc.ishuffle(range(1000), bufsize=100, seed=7))
+    assert a == list(proc.ishuffle(range(1000), bufsize=100, seed=7))
+    assert a != list(range(1000))
+    b = list(proc.ishuffle(range(1000), bufsize=100, rng=np.random.default_rng(7)))
+    assert sorted(b) == list(range(1000))
+    assert b == list(proc.ishuffle(range(1000), bufsize=100, rng=np.random.default_rng(7)))
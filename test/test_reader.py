@@ -0,0 +1,214 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import io
+import tarfile
+
+import pytest
+
+from tarproclib import reader, ustar
+
+
+def make_tar(members, format=tarfile.PAX_FORMAT, mode="w"):
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode=mode, format=format) as tar:
+        for name, data in members:
+            ti = tarfile.TarInfo(name)
+            if data is None:
+                ti.type = tarfile.DIRTYPE
+                tar.addfile(ti)
+                continue
+            ti.size = len(data)
+            tar.addfile(ti, io.BytesIO(data))
+    return stream.getvalue()
+
+
+members = [
+    ("dir", None),
+    ("a.txt", b"hello"),
+    ("a.cls", b"1"),
+    ("x" * 150 + "/b.txt", b"long name"),
+    ("b.jpg", bytes(range(256)) * 5),
+    ("c.json", b""),
+]
+
+
+@pytest.mark.parametrize("format", [tarfile.PAX_FORMAT, tarfile.GNU_FORMAT, tarfile.USTAR_FORMAT])
+def test_native_matches_tarfile(format):
+    if format == tarfile.USTAR_FORMAT:
+        data = make_tar(members[:3] + members[4:], format=format)
+    else:
+        data = make_tar(members, format=format)
+    native = list(reader.tardata(io.BytesIO(data), engine="native"))
+    expected = list(reader.tardata(io.BytesIO(data), engine="tarfile"))
+    assert native == expected
+    assert "dir" not in [name for name, _ in native]
+
+
+@pytest.mark.parametrize("mode", ["w:gz", "w:bz2", "w:xz"])
+def test_native_compressed(mode):
+    data = make_tar(members, mode=mode)
+    native = list(reader.tardata(io.BytesIO(data), engine="native"))
+    assert native == [(k, v) for k, v in members if v is not None]
+
+
+def test_native_memoryview():
+    data = make_tar(members)
+    for name, value in reader.tardata(io.BytesIO(data), copy=False):
+        assert isinstance(value, memoryview)
+        assert bytes(value) == dict(members)[name]
+
+
+def test_native_offsets():
+    data = make_tar(members)
+    scanner = ustar.TarScanner(io.BytesIO(data))
+    for name, value in scanner:
+        assert data[scanner.offset - len(value) - ustar.padding(len(value)):][:len(value)] == value
+
+
+def test_native_bad_checksum():
+    data = bytearray(make_tar(members))
+    data[150] ^= 1
+    with pytest.raises(tarfile.ReadError):
+        list(reader.tardata(io.BytesIO(bytes(data))))
+
+
+def make_shards(tmpdir, n=3, size=5):
+    from tarproclib import writer
+    for i in range(n):
+        with writer.TarWriter(f"{tmpdir}/shard-{i}.tar") as sink:
+            for j in range(size):
+                sink.write(dict(__key__="%d-%d" % (i, j), txt=b"x"))
+    return f"{tmpdir}/shard-{{0..{n - 1}}}.tar"
+
+
+def keys(source):
+    return [s["__key__"] for s in source]
+
+
+def test_iterator_prefetch_interleave(tmpdir):
+    url = make_shards(tmpdir)
+    expected = keys(reader.TarIterator(url))
+    assert len(expected) == 15
+    assert keys(reader.TarIterator(url, prefetch=2)) == expected
+    assert keys(reader.TarIterator(url + "#3,7")) == expected[3:8]
+    assert keys(reader.TarIterator(url + "#3,7", prefetch=1)) == expected[3:8]
+    interleaved = keys(reader.TarIterator(url, interleave=2))
+    assert interleaved[:4] == ["0-0", "1-0", "0-1", "1-1"]
+    assert sorted(interleaved) == sorted(expected)
+    assert keys(reader.TarIterator(url + "#1,2", interleave=3)) == ["1-0", "2-0"]
+
+
+def test_iterator_allow_missing(tmpdir):
+    url = make_shards(tmpdir, n=2)
+    url = url.replace("{0..1}", "{0..2}")
+    with pytest.raises(OSError):
+        list(reader.TarIterator(url))
+    assert len(list(reader.TarIterator(url, allow_missing=True))) == 10
+    assert len(list(reader.TarIterator(url, allow_missing=True, prefetch=2))) == 10
+
+
+class CountingBytesIO(io.BytesIO):
+    """In-memory stream counting the bytes read."""
+
+    count = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.count += len(data)
+        return data
+
+    def readinto(self, buf):
+        n = super().readinto(buf)
+        self.count += n
+        return n
+
+
+@pytest.mark.parametrize("engine", ["native", "tarfile"])
+def test_fields(engine):
+    data = make_tar([("a.txt", b"hello"), ("a.JPG", bytes(10000)), ("a.cls", b"1"), ("b.jpg", bytes(10000))])
+    result = list(reader.tariterator(io.BytesIO(data), fields=["__key__", "cls", "txt"], engine=engine))
+    assert result == [dict(__key__="a", txt=b"hello", cls=b"1"), dict(__key__="b")]
+    result = list(reader.tariterator(io.BytesIO(data), fields=["jpg"], engine=engine))
+    assert [sorted(s.keys()) for s in result] == [["__key__", "jpg"], ["__key__", "jpg"]]
+
+
+def test_fields_skip_payloads():
+    data = make_tar([("a.cls", b"1"), ("a.jpg", bytes(1 << 20)), ("b.cls", b"2"), ("b.jpg", bytes(1 << 20))])
+    scanner = ustar.TarScanner(io.BytesIO(data), select=lambda name: name.endswith(".cls"))
+    assert [value for _, value in scanner] == [b"1", None, b"2", None]
+    stream = CountingBytesIO(data)
+    result = list(reader.tariterator(stream, fields=["cls"]))
+    assert result == [dict(__key__="a", cls=b"1"), dict(__key__="b", cls=b"2")]
+    # the jpg payloads were seeked over
+    assert stream.count < 100000
+
+
+def test_group_by_keys_lcase():
+    data = [("a.TXT", b"1"), ("a.JPG", b"2"), ("a.cls", b"3")]
+    assert list(reader.group_by_keys()(data)) == [dict(__key__="a", txt=b"1", jpg=b"2", cls=b"3")]
+    assert list(reader.group_by_keys(suffixes={"jpg"})(data)) == [dict(__key__="a", jpg=b"2")]
+
+
+def test_mapped(tmpdir):
+    from tarproclib import gopen
+    fname = str(tmpdir.join("data.tar"))
+    with open(fname, "wb") as stream:
+        stream.write(make_tar(members))
+    with gopen.gopen(fname, "rb", mapped=True) as stream:
+        assert isinstance(stream, ustar.MappedFile)
+        result = list(reader.tardata(stream, copy=False))
+    assert all(isinstance(value, memoryview) for _, value in result)
+    assert [(name, bytes(value)) for name, value in result] == [(k, v) for k, v in members if v is not None]
+    with gopen.gopen(fname, "rb", mapped=True) as stream:
+        assert list(reader.tardata(stream)) == [(k, v) for k, v in members if v is not None]
+    url = make_shards(tmpdir)
+    expected = list(reader.TarIterator(url))
+    result = list(reader.TarIterator(url, mapped=True))
+    assert isinstance(result[0]["txt"], memoryview)
+    assert [dict(s, txt=bytes(s["txt"])) for s in result] == expected
+    assert keys(reader.TarIterator(url + "#3,7", mapped=True)) == keys(expected)[3:8]
+
+
+def test_gopen_cache(tmpdir, monkeypatch):
+    import collections
+    import os
+    from tarproclib import gopen
+    monkeypatch.setattr(gopen, "cache_stats", collections.Counter())
+    cache = str(tmpdir.join("cache"))
+    url = "pipe:cat " + make_shards(tmpdir)
+    expected = keys(reader.TarIterator(url))
+    assert keys(reader.TarIterator(url, cache=cache)) == expected
+    assert gopen.cache_stats["misses"] == 3 and gopen.cache_stats["hits"] == 0
+    assert len(os.listdir(cache)) == 4  # three shards and the lock file
+    assert keys(reader.TarIterator(url, cache=cache, mapped=True)) == expected
+    assert gopen.cache_stats["hits"] == 3
+    assert gopen.cache_stats["bytes_saved"] == gopen.cache_stats["bytes_cached"] > 0
+    # streams closed early and failed commands are not cached
+    with open(f"{tmpdir}/big", "wb") as stream:
+        stream.write(bytes(4 << 20))
+    with gopen.gopen(f"pipe:cat {tmpdir}/big", "rb", cache=cache) as stream:
+        stream.read(10)
+    with gopen.gopen(f"pipe:cat {tmpdir}/big; exit 1", "rb", cache=cache) as stream:
+        stream.read()
+    assert gopen.cache_stats["discarded"] == 2
+    assert len(os.listdir(cache)) == 4
+    # least recently used shards are evicted
+    monkeypatch.setattr(gopen, "cache_size", os.path.getsize(f"{tmpdir}/shard-0.tar") * 2)
+    with gopen.gopen(f"pipe:cat {tmpdir}/shard-0.tar", "rb", cache=cache) as stream:
+        stream.read()
+    with gopen.gopen(f"pipe:cat {tmpdir}/shard-2.tar; true", "rb", cache=cache) as stream:
+        stream.read()
+    assert gopen.cache_stats["evicted"] == 2
+    assert os.path.exists(gopen.cache_path(f"pipe:cat {tmpdir}/shard-0.tar", cache))
+    assert not os.path.exists(gopen.cache_path(f"pipe:cat {tmpdir}/shard-1.tar", cache))
+
+
+def test_scan_headers():
+    data = make_tar(members)
+    result = list(reader.scan_headers(io.BytesIO(data)))
+    assert result == [("a", dict(txt=5, cls=1)), ("x" * 150 + "/b", dict(txt=9)), ("b", dict(jpg=1280)), ("c", dict(json=0))]
+    assert list(reader.scan_headers(io.BytesIO(make_tar(members, mode="w:gz")))) == result
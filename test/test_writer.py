@@ -0,0 +1,145 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from tarproclib import reader, ustar, writer
+
+samples = [
+    dict(__key__="a", txt=b"hello", jpg=bytes(range(256)) * 3),
+    dict(__key__="dir/" + "x" * 200, txt=b"long name"),
+    dict(__key__="c", txt=memoryview(b"view"), cls=b""),
+]
+
+
+def write_samples(fname, **kw):
+    with writer.TarWriter(fname, **kw) as sink:
+        for sample in samples:
+            sink.write(sample)
+
+
+@pytest.mark.parametrize("ext", ["tar", "tgz"])
+def test_native_readable_by_tarfile(tmpdir, ext):
+    fname = f"{tmpdir}/out.{ext}"
+    write_samples(fname)
+    with tarfile.open(fname) as tar:
+        members = tar.getmembers()
+        assert [m.name for m in members] == ["a.jpg", "a.txt", "dir/" + "x" * 200 + ".txt", "c.cls", "c.txt"]
+        assert all(m.uname == "bigdata" and m.mode == 0o444 for m in members)
+        assert tar.extractfile("c.txt").read() == b"view"
+    if ext == "tar":
+        assert os.path.getsize(fname) % 10240 == 0
+
+
+@pytest.mark.skipif(shutil.which("tar") is None, reason="needs GNU tar")
+def test_native_readable_by_gnu_tar(tmpdir):
+    fname = f"{tmpdir}/out.tar"
+    write_samples(fname)
+    output = subprocess.check_output(["tar", "tf", fname]).decode("utf-8").split()
+    assert "dir/" + "x" * 200 + ".txt" in output
+    output = subprocess.check_output(["tar", "xOf", fname, "a.txt"])
+    assert output == b"hello"
+
+
+def test_engines_agree(tmpdir):
+    write_samples(f"{tmpdir}/native.tar", engine="native")
+    write_samples(f"{tmpdir}/tarfile.tar", engine="tarfile")
+    with open(f"{tmpdir}/native.tar", "rb") as native, open(f"{tmpdir}/tarfile.tar", "rb") as other:
+        assert list(reader.tardata(native)) == list(reader.tardata(other))
+
+
+@pytest.mark.parametrize("ext", ["tar.zst", "tar.lz4"])
+def test_zstd_lz4_roundtrip(tmpdir, ext):
+    pytest.importorskip("zstandard" if ext.endswith("zst") else "lz4")
+    fname = f"{tmpdir}/out.{ext}"
+    write_samples(fname)
+    result = list(reader.TarIterator(fname))
+    assert [s["__key__"] for s in result] == [s["__key__"] for s in samples]
+    assert result[0]["jpg"] == samples[0]["jpg"]
+
+
+def test_zstd_seekable_index(tmpdir):
+    pytest.importorskip("zstandard")
+    from tarproclib import index
+    fname = f"{tmpdir}/out.tar.zst"
+    with writer.TarWriter(fname, seekable=True, index=True, threads=2) as sink:
+        for i in range(20):
+            sink.write(dict(__key__="%03d" % i, txt=b"%d" % i))
+    with index.IndexedShard(fname) as shard:
+        assert shard.get("013")["txt"] == b"13"
+    assert [s["__key__"] for s in reader.TarIterator(fname + "#17,18")] == ["017", "018"]
+    with pytest.raises(ValueError):
+        writer.TarWriter(f"{tmpdir}/out.tgz", index=True)
+    with pytest.raises(ValueError):
+        writer.TarWriter(f"{tmpdir}/out2.tar.zst", seekable=True, engine="tarfile")
+
+
+@pytest.mark.parametrize("ext,engine", [("tar", "native"), ("tgz", "native"), ("tgz", "tarfile")])
+def test_writebehind_readahead(tmpdir, ext, engine):
+    fname = f"{tmpdir}/out.{ext}"
+    with writer.TarWriter(fname, writebehind=2, engine=engine) as sink:
+        for i in range(100):
+            sink.write(dict(__key__="%03d" % i, txt=b"%d" % i, bin=bytes(1000)))
+    assert sink.io_stats["bytes"] > 0
+    source = reader.TarIterator(fname, readahead=2, engine=engine)
+    result = list(source)
+    assert [s["txt"] for s in result] == [b"%d" % i for i in range(100)]
+    assert source.io_stats["bytes"] > 0
+
+
+@pytest.mark.parametrize("ext", ["tar", "tgz"])
+def test_sample_spans_copy(tmpdir, ext):
+    write_samples(f"{tmpdir}/in.{ext}")
+    with open(f"{tmpdir}/in.{ext}", "rb") as stream:
+        spans = list(reader.sample_spans(stream))
+        assert [s.key for s in spans] == [s["__key__"] for s in samples]
+        assert spans[0].names == ["jpg", "txt"]
+        assert (spans[0].data is None) == (ext == "tar")
+        stream.seek(0)
+        with writer.TarWriter(f"{tmpdir}/out.tar") as sink:
+            for span in reader.sample_spans(stream):
+                sink.write_span(span, stream)
+    with open(f"{tmpdir}/out.tar", "rb") as a, open(f"{tmpdir}/in.tar" if ext == "tar" else f"{tmpdir}/out.tar", "rb") as b:
+        assert list(reader.tardata(a)) == list(reader.tardata(b))
+    assert [s["__key__"] for s in reader.TarIterator(f"{tmpdir}/out.tar")] == [s["__key__"] for s in samples]
+
+
+def test_threaded_writer(tmpdir):
+    with writer.ThreadedWriter(writer.TarWriter(f"{tmpdir}/out.tgz"), depth=2) as sink:
+        for i in range(50):
+            sink.write(dict(__key__="%03d" % i, txt=b"%d" % i))
+    assert [s["txt"] for s in reader.TarIterator(f"{tmpdir}/out.tgz")] == [b"%d" % i for i in range(50)]
+    sink = writer.ThreadedWriter(writer.TarWriter(f"{tmpdir}/bad.tar"))
+    sink.write(dict(txt=b"no key"))
+    with pytest.raises(ValueError):
+        sink.close()
+
+
+def test_lazy_copy(tmpdir):
+    import pickle
+    src = str(tmpdir.join("src.tar"))
+    write_samples(src)
+    with open(src, "rb") as stream:
+        lazy = list(reader.tariterator(stream, lazy=True))
+    assert isinstance(lazy[0]["jpg"], ustar.LazyPayload)
+    assert bytes(lazy[0]["jpg"]) == samples[0]["jpg"]
+    assert lazy[2]["txt"].view() == b"view"
+    assert pickle.loads(pickle.dumps(lazy[0]))["txt"] == b"hello"
+    for ext, engine in [("tar", "native"), ("tgz", "native"), ("tar", "tarfile")]:
+        dst = str(tmpdir.join(f"dst-{engine}.{ext}"))
+        with writer.TarWriter(dst, engine=engine) as sink:
+            for sample in lazy:
+                sink.write(sample)
+        with open(dst, "rb") as stream:
+            assert list(reader.tariterator(stream)) == [dict(s, txt=bytes(s["txt"])) for s in samples]
+    # compressed input is read normally
+    with open(dst.replace("tarfile.tar", "native.tgz"), "rb") as stream:
+        assert isinstance(next(reader.tariterator(stream, lazy=True))["jpg"], bytes)
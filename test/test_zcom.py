@@ -0,0 +1,126 @@
+#
+# Copyright (c) 2017-2019 NVIDIA CORPORATION. All rights reserved.
+# This file is part of webloader (see TBD).
+# See the LICENSE file for licensing terms (BSD-style).
+#
+
+import threading
+import time
+
+from tarproclib import zcom
+
+
+def samples(n):
+    for i in range(n):
+        yield {"__key__": f"{i:06d}", "txt": b"x" * i, "cls": i}
+
+
+def transfer(tmpdir, n, **kw):
+    url = "ipc://" + str(tmpdir.join("socket"))
+    receiver = zcom.Connection("zpull+" + url)
+    sender = zcom.Connection("zpush+" + url, **kw)
+
+    def send():
+        for sample in samples(n):
+            sender.send(sample)
+        sender.send_eof()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    result = list(receiver)
+    thread.join()
+    sender.close()
+    receiver.close()
+    return result
+
+
+def test_pack_batch():
+    batch = list(samples(3))
+    frames = zcom.pack_batch(batch)
+    assert len(frames) == 2
+    assert frames[1] == b"xxx"
+
+
+def test_unbatched(tmpdir):
+    result = transfer(tmpdir, 10)
+    assert result == list(samples(10))
+
+
+def test_batched(tmpdir):
+    result = transfer(tmpdir, 100, batch=7)
+    assert len(result) == 100
+    assert isinstance(result[5]["txt"], memoryview)
+    assert [dict(s, txt=bytes(s["txt"])) for s in result] == list(samples(100))
+
+
+def test_batch_bytes():
+    batcher = zcom.Batcher(1000, batch_bytes=10, batch_time=1e9)
+    assert not batcher.add(dict(a=b"x" * 5))
+    assert batcher.add(dict(a=b"x" * 5))
+    assert len(batcher.take()) == 2
+    assert batcher.size == 0
+
+
+def consume(url, result, delay=0.0):
+    receiver = zcom.Connection("zpull+" + url)
+    for sample in receiver:
+        result.append(sample)
+        time.sleep(delay)
+    receiver.close()
+
+
+def test_least_loaded(tmpdir):
+    urls = ["ipc://" + str(tmpdir.join(f"socket{i}")) for i in range(2)]
+    ack = "ipc://" + str(tmpdir.join("ack"))
+    results = [[], []]
+    threads = [threading.Thread(target=consume, args=(url, result, delay))
+               for url, result, delay in zip(urls, results, [0.0, 0.01])]
+    for thread in threads:
+        thread.start()
+    sender = zcom.MultiWriter(["zpush+" + url for url in urls], output_mode="least_loaded",
+                              ack=ack, credits=8, ping=2)
+    for sample in samples(200):
+        sender.send(sample)
+    assert sender.send_eof()
+    for thread in threads:
+        thread.join()
+    sender.close()
+    assert sorted(s["__key__"] for s in results[0] + results[1]) == [s["__key__"] for s in samples(200)]
+    # the slow consumer is held to its credits
+    assert len(results[1]) < len(results[0])
+    assert [stats["samples"] for stats in sender.stats] == [len(result) for result in results]
+    assert all(stats["acked"] == stats["samples"] for stats in sender.stats)
+
+
+def test_unpinged_credits(tmpdir):
+    # credits run out before a ping is due, as when a ping is dropped on a full socket
+    url = "ipc://" + str(tmpdir.join("socket"))
+    result = []
+    thread = threading.Thread(target=consume, args=(url, result))
+    thread.start()
+    sender = zcom.MultiWriter(["zpush+" + url], output_mode="least_loaded",
+                              ack="ipc://" + str(tmpdir.join("ack")), credits=4, ping=100)
+
+    def send():
+        for sample in samples(20):
+            sender.send(sample)
+        sender.send_eof()
+
+    writer = threading.Thread(target=send, daemon=True)
+    writer.start()
+    writer.join(20.0)
+    assert not writer.is_alive()
+    thread.join()
+    sender.close()
+    assert len(result) == 20
+
+    url = "ipc://" + str(tmpdir.join("socket"))
+    sender = zcom.MultiWriter(["zpush+" + url], output_mode="least_loaded",
+                              ack="ipc://" + str(tmpdir.join("ack")), credits=1, linger=0)
+    sender.stats[0]["samples"] = 1
+    assert sender.candidates() == []
+    # without credits, only acknowledgements are waited for; sockets stay writable
+    start = time.time()
+    sender.wait_writable([])
+    assert time.time() - start >= 0.05
+    sender.close()
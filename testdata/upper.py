@@ -0,0 +1,3 @@
+def process(sample):
+    sample["x.txt"] = sample["txt"].upper()
+    return [sample]